@@ -1,20 +1,20 @@
 from django.contrib import admin
-from .models import Device, ValveControl, SensorReading
+from .models import Device, ValveControl, SensorReading, DeviceCommand, DeviceAlert, ValveSession
 
 # ✅ Registrar Device (Dispositivos ESP32)
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'device_id', 'ip_address', 'is_online', 'created_at')
+    list_display = ('name', 'device_id', 'ip_address', 'is_online', 'last_seen', 'created_at')
     list_filter = ('is_online', 'created_at')
     search_fields = ('name', 'device_id', 'ip_address')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('last_seen', 'created_at', 'updated_at')
     
     fieldsets = (
         ('Información del Dispositivo', {
             'fields': ('name', 'device_id', 'ip_address')
         }),
         ('Estado', {
-            'fields': ('is_online',)
+            'fields': ('is_online', 'last_seen')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -54,4 +54,30 @@ class SensorReadingAdmin(admin.ModelAdmin):
         ('Lectura', {
             'fields': ('device', 'flow_rate', 'timestamp')
         }),
-    )
\ No newline at end of file
+    )
+
+
+# ✅ Registrar DeviceCommand (Cola de comandos)
+@admin.register(DeviceCommand)
+class DeviceCommandAdmin(admin.ModelAdmin):
+    list_display = ('device', 'action', 'status', 'created_at', 'delivered_at', 'acked_at')
+    list_filter = ('status', 'action', 'device')
+    search_fields = ('device__name', 'device__device_id')
+    readonly_fields = ('created_at', 'delivered_at', 'acked_at')
+
+
+# ✅ Registrar DeviceAlert (Alertas de fuga)
+@admin.register(DeviceAlert)
+class DeviceAlertAdmin(admin.ModelAdmin):
+    list_display = ('device', 'kind', 'started_at', 'created_at', 'resolved_at')
+    list_filter = ('kind', 'device')
+    search_fields = ('device__name', 'device__device_id', 'message')
+    readonly_fields = ('created_at',)
+
+
+# ✅ Registrar ValveSession (Sesiones de válvula abierta)
+@admin.register(ValveSession)
+class ValveSessionAdmin(admin.ModelAdmin):
+    list_display = ('device', 'opened_at', 'closed_at', 'duration', 'volume', 'readings')
+    list_filter = ('device',)
+    search_fields = ('device__name', 'device__device_id')
@@ -0,0 +1,268 @@
+"""Simulador de flota para medir el rendimiento de la API.
+
+Dispositivos virtuales que siguen el protocolo del firmware (lectura cada
+pocos segundos, consulta de comandos y reporte del estado de la válvula) y
+visores que consultan lo mismo que el dashboard. Las peticiones se hacen
+dentro del proceso con el cliente de pruebas de Django o por HTTP contra un
+servidor en marcha, y se registran latencia, código de estado y número de
+consultas a la base de datos por endpoint.
+"""
+import heapq
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+class InProcessTransport:
+    """Peticiones con el cliente de pruebas de Django (cuenta consultas)"""
+    name = 'en proceso'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            # Una excepción en la vista (p. ej. database is locked) cuenta como 500
+            self._local.client = Client(raise_request_exception=False, HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        return self._local.client
+
+    def request(self, method, path, data=None):
+        client = self._client()
+        with CaptureQueriesContext(connection) as captured:
+            if method == 'GET':
+                response = client.get(path)
+            else:
+                response = client.post(path, data or {}, content_type='application/json')
+        try:
+            body = json.loads(response.content)
+        except ValueError:
+            body = None
+        return response.status_code, body, len(captured)
+
+    def close(self):
+        connection.close()
+
+
+class HttpTransport:
+    """Peticiones HTTP contra un servidor en marcha (sin conteo de consultas)"""
+    name = 'HTTP'
+
+    def __init__(self, base_url, timeout=60):
+        import requests
+
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.requests.Session()
+        return self._local.session
+
+    def request(self, method, path, data=None):
+        url = self.base_url + path
+        try:
+            response = self._session().request(method, url, json=data, timeout=self.timeout)
+        except self.requests.RequestException:
+            return 0, None, None
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body, None
+
+    def close(self):
+        pass
+
+
+class Recorder:
+    """Latencias, errores y consultas por endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lag = []
+        self.aborted = []  # (hilo, excepción) de los hilos que terminaron con un error
+
+    def record(self, endpoint, seconds, status_code, queries):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+            if not 200 <= status_code < 300:
+                self.errors[endpoint] += 1
+
+    def record_lag(self, seconds):
+        with self._lock:
+            self.lag.append(seconds)
+
+    def record_abort(self, thread_name, exc):
+        with self._lock:
+            self.aborted.append((thread_name, f'{type(exc).__name__}: {exc}'))
+
+    def summary(self, elapsed):
+        """Resumen por endpoint más una fila 'TOTAL'"""
+        rows = {}
+        endpoints = sorted(self.latencies)
+        for endpoint in endpoints + ['TOTAL']:
+            if endpoint == 'TOTAL':
+                latencies = [value for name in endpoints for value in self.latencies[name]]
+                queries = [value for name in endpoints for value in self.queries[name]]
+                errors = sum(self.errors.values())
+            else:
+                latencies = self.latencies[endpoint]
+                queries = self.queries[endpoint]
+                errors = self.errors[endpoint]
+            if not latencies:
+                continue
+            latencies = sorted(latencies)
+            rows[endpoint] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'rps': len(latencies) / elapsed if elapsed else 0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'queries': sum(queries) / len(queries) if queries else None,
+            }
+        return rows
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class VirtualDevice:
+    """ESP32 simulado: envía lectura, consulta comandos y reporta la válvula"""
+
+    def __init__(self, device_id, interval, wait=0):
+        self.device_id = device_id
+        self.interval = interval
+        self.wait = wait
+        self.valve_state = 'closed'
+        self.total_volume = 0.0
+
+    def step(self, call):
+        flow_rate = round(random.uniform(2, 12), 2) if self.valve_state == 'open' else 0.0
+        self.total_volume += flow_rate * self.interval / 60
+        call('POST sensor-readings', 'POST', '/api/sensor-readings/', {
+            'device_id': self.device_id,
+            'flow_rate': flow_rate,
+            'total_volume': round(self.total_volume, 3),
+        })
+
+        path = f'/api/devices/get_pending_command/?device_id={self.device_id}'
+        if self.wait:
+            path += f'&wait={self.wait}'
+        _, body = call('GET get_pending_command', 'GET', path)
+        command = (body or {}).get('command')
+        if command in ('open', 'closed'):
+            self.valve_state = command
+            call('POST report_valve_state', 'POST', '/api/devices/report_valve_state/', {
+                'device_id': self.device_id,
+                'valve_state': command,
+            })
+
+
+class Viewer:
+    """Dashboard simulado: estado, última lectura y estadísticas de un dispositivo"""
+
+    def __init__(self, device_pks, interval, command_ratio=0.0):
+        self.device_pks = device_pks
+        self.interval = interval
+        self.command_ratio = command_ratio
+
+    def step(self, call):
+        pk = random.choice(self.device_pks)
+        _, body = call('GET status', 'GET', f'/api/devices/{pk}/status/')
+        call('GET latest', 'GET', f'/api/sensor-readings/latest/?device_id={pk}')
+        call('GET stats', 'GET', f'/api/sensor-readings/stats/?device_id={pk}')
+        if random.random() < self.command_ratio:
+            state = (body or {}).get('current_valve_state')
+            action = 'close_valve' if state == 'open' else 'open_valve'
+            call('POST open/close_valve', 'POST', f'/api/devices/{pk}/{action}/')
+
+
+def run(actors, transport, duration, concurrency, recorder=None):
+    """Ejecutar los actores durante `duration` segundos con `concurrency` hilos.
+
+    Cada actor se programa a intervalos fijos desde un instante aleatorio
+    de su primer intervalo. Si los hilos no dan abasto, el retraso respecto
+    al instante programado queda registrado en `recorder.lag`. Los hilos que
+    terminan con una excepción quedan en `recorder.aborted`.
+    """
+    recorder = recorder or Recorder()
+    start = time.monotonic()
+    deadline = start + duration
+    heap = [
+        (start + random.uniform(0, actor.interval), index, actor)
+        for index, actor in enumerate(actors)
+    ]
+    heapq.heapify(heap)
+    condition = threading.Condition()
+    running = 0
+
+    def call(endpoint, method, path, data=None):
+        began = time.perf_counter()
+        try:
+            status_code, body, queries = transport.request(method, path, data)
+        except Exception:
+            # Sin respuesta: cuenta como error, igual que un fallo de conexión HTTP
+            status_code, body, queries = 0, None, None
+        recorder.record(endpoint, time.perf_counter() - began, status_code, queries)
+        return status_code, body
+
+    def worker():
+        nonlocal running
+        try:
+            while True:
+                with condition:
+                    while True:
+                        if heap and heap[0][0] < deadline:
+                            due, index, actor = heap[0]
+                            delay = due - time.monotonic()
+                            if delay <= 0:
+                                heapq.heappop(heap)
+                                running += 1
+                                break
+                            condition.wait(delay)
+                        elif running:
+                            # Un actor en curso aún puede volver a la cola
+                            condition.wait()
+                        else:
+                            return
+                recorder.record_lag(time.monotonic() - due)
+                try:
+                    actor.step(call)
+                finally:
+                    with condition:
+                        heapq.heappush(heap, (due + actor.interval, index, actor))
+                        running -= 1
+                        condition.notify_all()
+        except Exception as exc:
+            # Un hilo caído deja actores sin ejecutar: los resultados no son válidos
+            recorder.record_abort(threading.current_thread().name, exc)
+        finally:
+            transport.close()
+
+    threads = [threading.Thread(target=worker, name=f'bench-{n}') for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.monotonic() - start
@@ -0,0 +1,119 @@
+"""Cola de comandos de válvula para los ESP32.
+
+Los comandos se entregan en orden de creación. La entrega es un UPDATE
+condicional sobre el estado `pending`, así que dos consultas simultáneas
+nunca reciben el mismo comando.
+
+Un comando pendiente vence COMMAND_TTL segundos después de crearse y uno
+entregado, COMMAND_TTL segundos después de la entrega si el ESP32 no lo
+confirma. Si el ESP32 reporta otro estado, el comando entregado se da por
+vencido: el estado deseado nunca se queda atascado.
+"""
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import metrics, state_cache
+from .events import publish_device_event
+from .models import DeviceCommand
+
+
+def enqueue(device, action):
+    """Encolar un comando y avisar a los long-polls del dispositivo"""
+    now = timezone.now()
+    # Los pendientes y entregados vencidos ya no cuentan: marcarlos como expirados
+    DeviceCommand.objects.filter(
+        device=device, status__in=('pending', 'delivered'), expires_at__lte=now
+    ).update(status='expired')
+
+    command = DeviceCommand.objects.create(
+        device=device,
+        action=action,
+        created_at=now,
+        expires_at=now + timedelta(seconds=settings.COMMAND_TTL),
+    )
+
+    publish_device_event(device.pk, 'command', {'command_id': command.id, 'action': action})
+    state_cache.bump_version(device.pk, command_deadline=command.expires_at)
+    metrics.inc('device_commands_enqueued_total', device=device.pk)
+    return command
+
+
+def _next_pending(device_pk):
+    # Usa el índice (device, status, created_at)
+    return (
+        DeviceCommand.objects
+        .filter(device_id=device_pk, status='pending', expires_at__gt=timezone.now())
+        .order_by('created_at', 'id')
+    )
+
+
+async def aclaim_next(device_pk):
+    """Tomar el siguiente comando pendiente del dispositivo, o None"""
+    while True:
+        command = await _next_pending(device_pk).afirst()
+        if command is None:
+            return None
+        now = timezone.now()
+        # Desde la entrega, el ESP32 tiene COMMAND_TTL segundos para confirmarlo
+        expires_at = now + timedelta(seconds=settings.COMMAND_TTL)
+        claimed = await DeviceCommand.objects.filter(
+            pk=command.pk, status='pending'
+        ).aupdate(status='delivered', delivered_at=now, expires_at=expires_at)
+        if claimed:
+            command.status = 'delivered'
+            command.delivered_at = now
+            command.expires_at = expires_at
+            await sync_to_async(state_cache.bump_version)(device_pk, command_deadline=expires_at)
+            metrics.inc('device_commands_delivered_total', device=device_pk)
+            return command
+        # Otra consulta lo entregó primero: probar con el siguiente
+
+
+def acknowledge(device_pk, valve_state):
+    """Confirmar los comandos entregados que el ESP32 ya ejecutó.
+
+    Los entregados con la acción contraria quedan superados por el estado
+    reportado y se marcan como expirados.
+    """
+    delivered = DeviceCommand.objects.filter(device_id=device_pk, status='delivered')
+    acked = delivered.filter(action=valve_state).update(status='acked', acked_at=timezone.now())
+    superseded = delivered.exclude(action=valve_state).update(status='expired')
+    if acked or superseded:
+        state_cache.bump_version(device_pk)
+    return acked
+
+
+def desired_state(device):
+    """Acción del último comando si aún no se ha confirmado ('none' si no hay)"""
+    command = (
+        DeviceCommand.objects
+        .filter(device=device)
+        .order_by('-created_at', '-id')
+        .only('action', 'status', 'expires_at')
+        .first()
+    )
+    if command is None or command.status not in ('pending', 'delivered'):
+        return 'none'
+    if command.expires_at <= timezone.now():
+        return 'none'
+    return command.action
+
+
+def desired_state_annotation():
+    """Lo mismo que desired_state, como subconsulta para anotar un queryset de Device"""
+    newest = (
+        DeviceCommand.objects
+        .filter(device=OuterRef('pk'))
+        .order_by('-created_at', '-id')
+        .annotate(desired=Case(
+            When(status__in=('pending', 'delivered'), expires_at__gt=timezone.now(), then=F('action')),
+            default=Value('none'),
+        ))
+        .values('desired')[:1]
+    )
+    return Coalesce(Subquery(newest), Value('none'))
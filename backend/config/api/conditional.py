@@ -0,0 +1,64 @@
+"""GET condicional (ETag / If-None-Match) para los endpoints de lectura.
+
+El ETag se calcula a partir de la versión de los datos (ver
+state_cache.data_version) y de la URL pedida, sin ejecutar la consulta
+principal del endpoint. Si el cliente ya tiene esa versión se responde
+304 sin cuerpo.
+
+Con settings.CONDITIONAL_GET desactivado (caché de estado en la memoria de
+cada proceso) make_etag devuelve None y respond() no usa ETag.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.utils.cache import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+_lock = threading.Lock()
+_counters = {'responses': 0, 'not_modified': 0}
+
+
+def make_etag(request, *parts):
+    """ETag para la URL pedida, su formato de respuesta y las partes dadas (None si está desactivado)"""
+    if not settings.CONDITIONAL_GET:
+        return None
+    key = '|'.join(str(part) for part in (request.get_full_path(), request.accepted_renderer.format, *parts))
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def respond(request, etag, build):
+    """304 si If-None-Match coincide con `etag`; si no, la respuesta de build()"""
+    if etag is None:
+        return build()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in etags or '*' in etags:
+        _count(not_modified=True)
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response = build()
+    if response.status_code == status.HTTP_200_OK:
+        for name, value in headers.items():
+            response[name] = value
+        _count(not_modified=False)
+    return response
+
+
+def _count(not_modified):
+    with _lock:
+        _counters['responses'] += 1
+        if not_modified:
+            _counters['not_modified'] += 1
+
+
+def stats():
+    """Respuestas con ETag y cuántas fueron 304 en este proceso"""
+    with _lock:
+        responses, not_modified = _counters['responses'], _counters['not_modified']
+    return {
+        'responses': responses,
+        'not_modified': not_modified,
+        'not_modified_ratio': round(not_modified / responses, 4) if responses else None,
+    }
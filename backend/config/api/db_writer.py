@@ -0,0 +1,73 @@
+"""Un solo hilo escritor por proceso para SQLite (SQLITE_EMBEDDED).
+
+SQLite admite un escritor a la vez: con varios hilos escribiendo, cada uno
+espera el bloqueo de la base de datos con reintentos (busy_timeout) y las
+latencias se disparan. Con SQLITE_EMBEDDED la ingesta y los reportes de
+válvula se encolan y los ejecuta, de uno en uno, un hilo dedicado con su
+propia conexión. Las consultas siguen en el hilo de cada petición y, con
+WAL, no esperan a las escrituras.
+
+Las demás escrituras (comandos, cambios de online/offline) son pocas y usan
+BEGIN IMMEDIATE con busy_timeout. Con varios procesos cada uno tiene su
+escritor y se esperan entre ellos: en un solo nodo conviene un worker con
+hilos.
+"""
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+_jobs = queue.SimpleQueue()
+_thread = None
+_start_lock = threading.Lock()
+
+
+def enabled():
+    return settings.SQLITE_EMBEDDED and connection.vendor == 'sqlite'
+
+
+def _run():
+    while True:
+        future, fn, args, kwargs = _jobs.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        # Como al empezar una petición: cerrar la conexión si caducó o falló
+        close_old_connections()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+
+def submit(fn, *args, **kwargs):
+    """Encolar fn(*args, **kwargs) en el hilo escritor. Devuelve un Future"""
+    global _thread
+    with _start_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='sqlite-writer', daemon=True)
+            _thread.start()
+    future = Future()
+    _jobs.put((future, fn, args, kwargs))
+    return future
+
+
+def run(fn, *args, **kwargs):
+    """fn(*args, **kwargs) en el hilo escritor con SQLITE_EMBEDDED; si no, en este hilo"""
+    # Dentro de una transacción (o del propio escritor) otra conexión no vería
+    # sus cambios y esperaría su bloqueo: se ejecuta aquí
+    if not enabled() or threading.current_thread() is _thread or connection.in_atomic_block:
+        return fn(*args, **kwargs)
+    return submit(fn, *args, **kwargs).result()
+
+
+async def arun(fn, *args, **kwargs):
+    """Igual que run desde una vista async, sin ocupar un hilo mientras espera"""
+    if not enabled():
+        return await sync_to_async(fn)(*args, **kwargs)
+    return await asyncio.wrap_future(submit(fn, *args, **kwargs))
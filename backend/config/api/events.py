@@ -0,0 +1,184 @@
+"""Notificaciones entre vistas (comandos nuevos, lecturas, estado de válvula).
+
+Las vistas síncronas publican eventos y las vistas async que esperan en el
+event loop (long-polling, stream SSE) los reciben sin consultar la base de
+datos en bucle. El broker se elige con EVENTS_BROKER:
+
+- LocalBroker: fan-out dentro del proceso (un solo worker).
+- UnixSocketBroker: además reenvía los eventos al resto de procesos worker
+  de la misma máquina mediante sockets Unix en EVENTS_SOCKET_DIR.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+FLEET_CHANNEL = 'fleet'
+
+
+def device_channel(device_pk):
+    """Canal de eventos de un dispositivo"""
+    return f'device:{device_pk}'
+
+
+def publish_device_event(device_pk, event_type, data=None):
+    """Publicar un evento del dispositivo cuando se confirme la transacción.
+
+    Se entrega en el canal del dispositivo y en el canal de toda la flota.
+    """
+    event = {'type': event_type, 'device': device_pk, 'data': data or {}}
+
+    def publish():
+        broker.publish(device_channel(device_pk), event)
+        broker.publish(FLEET_CHANNEL, event)
+
+    transaction.on_commit(publish)
+
+
+class Subscription:
+    """Cola de eventos de un suscriptor, ligada a su event loop"""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def _put(self, event):
+        # Un suscriptor lento pierde eventos en lugar de bloquear al publicador
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout=None):
+        """Esperar el siguiente evento (asyncio.TimeoutError si vence `timeout`)"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalBroker:
+    """Fan-out de eventos entre los hilos y event loops de un proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel, maxsize=100):
+        """Suscribirse a un canal; debe llamarse desde un event loop"""
+        subscription = Subscription(self, channel, maxsize)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, event):
+        """Entregar `event` a los suscriptores del canal (desde cualquier hilo)"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # El event loop del suscriptor ya se cerró
+                self.unsubscribe(subscription)
+
+
+class UnixSocketBroker(LocalBroker):
+    """Broker local para varios procesos worker en la misma máquina.
+
+    Cada proceso escucha en un socket Unix de datagramas dentro de
+    EVENTS_SOCKET_DIR y publica en los sockets de los demás procesos.
+    """
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = directory or settings.EVENTS_SOCKET_DIR
+        self._socket = None
+        self._sender = None
+        self._path = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._socket is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self._path)
+            # Envío no bloqueante: un proceso saturado no frena al publicador
+            sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sender.setblocking(False)
+            self._sender = sender
+            self._socket = sock
+            atexit.register(self._stop)
+            threading.Thread(target=self._receive, name='events-broker', daemon=True).start()
+
+    def _stop(self):
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+    def _receive(self):
+        while True:
+            payload = self._socket.recv(65536)
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                continue
+            super().publish(message['channel'], message['event'])
+
+    def subscribe(self, channel, maxsize=100):
+        self._start()
+        return super().subscribe(channel, maxsize)
+
+    def publish(self, channel, event):
+        self._start()
+        super().publish(channel, event)
+        payload = json.dumps({'channel': channel, 'event': event}, cls=DjangoJSONEncoder).encode()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.sock') or path == self._path:
+                continue
+            try:
+                self._sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Proceso terminado sin limpiar su socket
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as exc:
+                logger.warning('No se pudo reenviar el evento a %s: %s', path, exc)
+
+
+broker = import_string(settings.EVENTS_BROKER)()
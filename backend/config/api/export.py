@@ -0,0 +1,63 @@
+"""Exportación del historial de lecturas en CSV por streaming.
+
+Las filas se leen con un cursor por bloques (`iterator`) y se envían en
+trozos, opcionalmente comprimidos con gzip, así que la memoria no depende
+del tamaño de la exportación.
+"""
+import csv
+import io
+import zlib
+
+from asgiref.sync import sync_to_async
+
+COLUMNS = ['id', 'device_id', 'timestamp', 'flow_rate', 'total_volume']
+FIELDS = ['id', 'device__device_id', 'timestamp', 'flow_rate', 'total_volume']
+
+
+class CSVEncoder:
+    """Convierte bloques de filas en bytes de CSV (y gzip si se pide)"""
+
+    def __init__(self, compress=False):
+        # wbits=31: flujo con cabecera gzip
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        data = buffer.getvalue().encode()
+        return self.compressor.compress(data) if self.compressor else data
+
+    def finish(self):
+        return self.compressor.flush() if self.compressor else b''
+
+
+def _row(values):
+    pk, device_id, timestamp, flow_rate, total_volume = values
+    return pk, device_id, timestamp.isoformat(), flow_rate, total_volume
+
+
+def stream_csv(queryset, chunk_size, compress=False):
+    """Generador de bytes CSV para servidores WSGI"""
+    encoder = CSVEncoder(compress)
+    yield encoder.encode([COLUMNS])
+    rows = []
+    for values in queryset.values_list(*FIELDS).iterator(chunk_size=chunk_size):
+        rows.append(_row(values))
+        if len(rows) >= chunk_size:
+            yield encoder.encode(rows)
+            rows = []
+    yield encoder.encode(rows) + encoder.finish()
+
+
+async def astream_csv(queryset, chunk_size, compress=False):
+    """Igual que stream_csv para ASGI (Django agotaría en memoria un generador síncrono).
+
+    Cada bloque se genera en el hilo de la conexión con sync_to_async, así el
+    cursor se mantiene entre bloques.
+    """
+    chunks = stream_csv(queryset, chunk_size, compress)
+    while True:
+        chunk = await sync_to_async(next)(chunks, None)
+        if chunk is None:
+            break
+        yield chunk
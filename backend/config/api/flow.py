@@ -0,0 +1,134 @@
+"""Procesamiento incremental de las lecturas: consumo y detección de fugas.
+
+`total_volume` es un contador acumulado que vuelve a cero cuando el ESP32 se
+reinicia. En la ingesta se calcula para cada lectura el consumo desde la
+anterior (`volume_delta`), detectando los reinicios, y se sigue por
+dispositivo el caudal con la válvula cerrada para generar alertas de fuga.
+El estado de cada dispositivo vive en DeviceFlowState, así que cada lectura
+cuesta O(1) y no hace falta recorrer el historial.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from . import state_cache
+from .events import publish_device_event
+from .models import DeviceAlert, DeviceFlowState, ValveSession
+from .serializers import DeviceAlertSerializer
+
+# Bajadas menores del contador se consideran ruido de redondeo, no reinicios
+RESET_TOLERANCE = 0.01
+
+
+def volume_delta(previous, current):
+    """Litros consumidos entre dos valores del contador acumulado"""
+    if previous is None:
+        return 0.0
+    if current < previous - RESET_TOLERANCE:
+        # El contador se reinició: desde entonces se consumió `current`
+        return current
+    return max(current - previous, 0.0)
+
+
+def _initial_state(device_pk):
+    """Estado de un dispositivo sin procesar: continuar desde su última lectura"""
+    state = DeviceFlowState(device_id=device_pk)
+    latest = state_cache.get_latest_reading(device_pk)
+    if latest is not None:
+        state.last_timestamp = parse_datetime(latest['timestamp'])
+        state.last_volume = latest['total_volume']
+    return state
+
+
+def process_readings(readings):
+    """Asignar volume_delta a lecturas sin guardar y actualizar el estado de fugas.
+
+    Debe llamarse dentro de la transacción de la ingesta, antes del INSERT.
+    Las lecturas anteriores a la última procesada (lotes atrasados) no
+    cuentan consumo ni afectan a la detección.
+    """
+    by_device = {}
+    for reading in readings:
+        by_device.setdefault(reading.device_id, []).append(reading)
+
+    states = (
+        DeviceFlowState.objects.select_for_update(of=('self',))
+        .select_related('leak_alert', 'valve_session')
+        .in_bulk(list(by_device))
+    )
+    leak_after = timedelta(seconds=settings.LEAK_ALERT_AFTER)
+    new_states, changed_states = [], []
+    session_usage = {}  # pk de la sesión abierta -> [litros, lecturas]
+
+    for device_pk, device_readings in by_device.items():
+        state = states.get(device_pk)
+        if state is None:
+            state = _initial_state(device_pk)
+            new_states.append(state)
+        else:
+            changed_states.append(state)
+        valve_closed = state_cache.get_valve_state(device_readings[0].device) == 'closed'
+
+        for reading in sorted(device_readings, key=lambda r: r.timestamp):
+            if state.last_timestamp is not None and reading.timestamp < state.last_timestamp:
+                reading.volume_delta = 0.0
+                continue
+            reading.volume_delta = volume_delta(state.last_volume, reading.total_volume)
+            state.last_timestamp = reading.timestamp
+            state.last_volume = reading.total_volume
+            _detect_leak(state, reading, valve_closed, leak_after)
+
+            session = state.valve_session
+            if session is not None and reading.timestamp >= session.opened_at:
+                usage = session_usage.setdefault(session.pk, [0.0, 0])
+                usage[0] += reading.volume_delta
+                usage[1] += 1
+
+    if new_states:
+        DeviceFlowState.objects.bulk_create(new_states)
+    if changed_states:
+        DeviceFlowState.objects.bulk_update(
+            changed_states, ['last_timestamp', 'last_volume', 'leak_since', 'leak_alert']
+        )
+    for session_pk, (volume, count) in session_usage.items():
+        ValveSession.objects.filter(pk=session_pk).update(
+            volume=F('volume') + volume, readings=F('readings') + count
+        )
+
+
+def locked_state(device_pk):
+    """DeviceFlowState del dispositivo bloqueado para actualizar (creado si no existe)"""
+    state = (
+        DeviceFlowState.objects.select_for_update(of=('self',))
+        .select_related('valve_session', 'valve_control')
+        .filter(device_id=device_pk).first()
+    )
+    if state is None:
+        state = _initial_state(device_pk)
+        state.save(force_insert=True)
+    return state
+
+
+def _detect_leak(state, reading, valve_closed, leak_after):
+    if not valve_closed or reading.flow_rate < settings.LEAK_MIN_FLOW:
+        state.leak_since = None
+        if state.leak_alert is not None:
+            state.leak_alert.resolved_at = reading.timestamp
+            state.leak_alert.save(update_fields=['resolved_at'])
+            publish_device_event(state.device_id, 'alert', DeviceAlertSerializer(state.leak_alert).data)
+            state.leak_alert = None
+        return
+
+    if state.leak_since is None:
+        state.leak_since = reading.timestamp
+    elif state.leak_alert is None and reading.timestamp - state.leak_since >= leak_after:
+        minutes = (reading.timestamp - state.leak_since).total_seconds() / 60
+        state.leak_alert = DeviceAlert.objects.create(
+            device_id=state.device_id,
+            kind='leak',
+            message=f'Caudal de {reading.flow_rate:.2f} L/min durante {minutes:.0f} min con la válvula cerrada',
+            started_at=state.leak_since,
+        )
+        publish_device_event(state.device_id, 'alert', DeviceAlertSerializer(state.leak_alert).data)
@@ -0,0 +1,48 @@
+"""Ingesta de lecturas del sensor enviadas por los ESP32."""
+from collections import Counter
+
+from django.db import transaction
+
+from . import db_writer, flow, liveness, metrics, rollups, state_cache
+from .events import publish_device_event
+from .models import SensorReading
+from .serializers import SensorReadingSerializer
+
+
+def ingest_readings(readings):
+    """Guardar un conjunto de lecturas con un único INSERT.
+
+    `readings` es una lista de SensorReading sin guardar con `device` ya
+    resuelto. Devuelve las lecturas creadas (con `id` asignado).
+    """
+    if not readings:
+        return []
+    # Con SQLITE_EMBEDDED, en el hilo escritor
+    return db_writer.run(_ingest, readings)
+
+
+def _ingest(readings):
+    with transaction.atomic():
+        # Consumo por lectura y detección de fugas antes del INSERT
+        flow.process_readings(readings)
+        created = SensorReading.objects.bulk_create(readings)
+        rollups.update_rollups(created)
+
+    liveness.touch(reading.device_id for reading in readings)
+    for device_pk, count in Counter(reading.device_id for reading in created).items():
+        metrics.inc('sensor_readings_ingested_total', count, device=device_pk)
+
+    # Actualizar el caché y notificar a los streams solo con la lectura
+    # más reciente de cada dispositivo
+    newest = {}
+    for reading in created:
+        current = newest.get(reading.device_id)
+        if current is None or reading.timestamp >= current.timestamp:
+            newest[reading.device_id] = reading
+    for device_pk, reading in newest.items():
+        payload = SensorReadingSerializer(reading).data
+        state_cache.store_reading(device_pk, reading.timestamp, payload)
+        state_cache.bump_version(device_pk)
+        publish_device_event(device_pk, 'reading', payload)
+
+    return created
@@ -0,0 +1,109 @@
+"""Seguimiento de actividad (liveness) de los dispositivos.
+
+Cada contacto de un ESP32 actualiza una marca de tiempo en memoria y, como
+mucho una vez cada DEVICE_LIVENESS_FLUSH_INTERVAL segundos por proceso, en
+el caché de estado (compartido entre procesos con STATE_CACHE_BACKEND=file
+o db). La fila Device solo se escribe cuando el dispositivo pasa de offline
+a online o al revés: los dispositivos sin contacto durante
+DEVICE_OFFLINE_AFTER segundos se marcan como offline.
+
+`is_online` y `last_seen` de toda la API salen de aquí, no de la fila.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import Device
+
+_lock = threading.Lock()
+_last_seen = {}     # pk del dispositivo -> último contacto visto por este proceso
+_published_at = {}  # pk del dispositivo -> time.monotonic() de la última escritura en el caché
+_last_sweep = 0.0
+
+
+def _cache():
+    return caches['state']
+
+
+def _key(device_pk):
+    return f'last-seen:{device_pk}'
+
+
+def touch(device_pks, when=None):
+    """Registrar actividad de uno o varios dispositivos"""
+    when = when or timezone.now()
+    now = time.monotonic()
+    interval = settings.DEVICE_LIVENESS_FLUSH_INTERVAL
+    due = []
+
+    with _lock:
+        for pk in set(device_pks):
+            _last_seen[pk] = when
+            published_at = _published_at.get(pk)
+            if published_at is None or now - published_at >= interval:
+                due.append(pk)
+                _published_at[pk] = now
+
+    if due:
+        _cache().set_many({_key(pk): when for pk in due}, None)
+        # Un dispositivo que pasó a offline lleva más de DEVICE_OFFLINE_AFTER
+        # sin contacto, así que siempre entra aquí en su siguiente contacto.
+        # Solo se escribe la fila de los que vuelven a estar online.
+        offline = list(Device.objects.filter(pk__in=due, is_online=False).values_list('pk', flat=True))
+        if offline:
+            Device.objects.filter(pk__in=offline).update(is_online=True, last_seen=when)
+
+    sweep()
+
+
+def last_seen_many(devices):
+    """{pk: último contacto} de varios dispositivos (memoria, caché o base de datos)"""
+    cached = _cache().get_many([_key(device.pk) for device in devices])
+    with _lock:
+        local = {device.pk: _last_seen.get(device.pk) for device in devices}
+    result = {}
+    for device in devices:
+        seen = [ts for ts in (local[device.pk], cached.get(_key(device.pk)), device.last_seen) if ts]
+        result[device.pk] = max(seen) if seen else None
+    return result
+
+
+def last_seen(device):
+    """Último contacto conocido del dispositivo"""
+    return last_seen_many([device])[device.pk]
+
+
+def online(device, seen):
+    """Estado online con el último contacto `seen` (de last_seen_many)"""
+    if seen is None:
+        # Dispositivo sin contactos registrados: usar el valor guardado
+        return device.is_online
+    return timezone.now() - seen < timedelta(seconds=settings.DEVICE_OFFLINE_AFTER)
+
+
+def is_online(device):
+    """Estado online derivado de la ventana de inactividad"""
+    return online(device, last_seen(device))
+
+
+def sweep(force=False):
+    """Marcar como offline los dispositivos sin contacto reciente"""
+    global _last_sweep
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_sweep < settings.DEVICE_LIVENESS_FLUSH_INTERVAL:
+            return 0
+        _last_sweep = now
+
+    cutoff = timezone.now() - timedelta(seconds=settings.DEVICE_OFFLINE_AFTER)
+    devices = list(Device.objects.filter(is_online=True).only('id', 'is_online', 'last_seen'))
+    marked = 0
+    for pk, seen in last_seen_many(devices).items():
+        if seen is None or seen < cutoff:
+            # Guardar con la transición el último contacto conocido
+            marked += Device.objects.filter(pk=pk, is_online=True).update(is_online=False, last_seen=seen)
+    return marked
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import random
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from api import benchmark
+from api.models import Device
+
+IN_PROCESS_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-default'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-state', 'TIMEOUT': None},
+}
+
+
+class Command(BaseCommand):
+    help = 'Simula una flota de ESP32 y visores del dashboard y mide el rendimiento de la API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=20, help='Dispositivos ESP32 simulados')
+        parser.add_argument('--viewers', type=int, default=5, help='Visores del dashboard simulados')
+        parser.add_argument('--duration', type=float, default=30, help='Duración de la prueba en segundos')
+        parser.add_argument('--interval', type=float, default=5, help='Segundos entre ciclos de cada ESP32 (firmware: 5)')
+        parser.add_argument('--viewer-interval', type=float, default=3, help='Segundos entre consultas de cada visor')
+        parser.add_argument('--wait', type=float, default=0, help='Long-polling de get_pending_command (?wait=N)')
+        parser.add_argument('--command-ratio', type=float, default=0.05, help='Probabilidad de que un visor abra/cierre la válvula')
+        parser.add_argument('--concurrency', type=int, default=8, help='Hilos que envían peticiones')
+        parser.add_argument('--url', help='URL base de un servidor en marcha; por defecto se prueba en proceso')
+        parser.add_argument('--seed', type=int, help='Semilla aleatoria para repetir la simulación')
+        parser.add_argument('--output', help='Guardar los resultados en un archivo JSON')
+        parser.add_argument('--baseline', help='Comparar con resultados guardados con --output')
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+
+        if options['url']:
+            transport = benchmark.HttpTransport(options['url'])
+            device_pks = self._http_devices(transport, options['devices'])
+            recorder, elapsed = self._run(transport, device_pks, options)
+        else:
+            # En proceso: base de datos de prueba temporal y cachés en memoria,
+            # así no se tocan los datos ni el caché de estado reales
+            old_name = self._create_test_db()
+            # Los 404 de `latest` antes de la primera lectura son esperables
+            logging.getLogger('django.request').setLevel(logging.ERROR)
+            try:
+                with override_settings(CACHES=IN_PROCESS_CACHES):
+                    transport = benchmark.InProcessTransport()
+                    device_pks = self._local_devices(options['devices'])
+                    recorder, elapsed = self._run(transport, device_pks, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        results = {
+            'transport': transport.name,
+            'database': connection.vendor,
+            'options': {
+                name: options[name]
+                for name in ('devices', 'viewers', 'duration', 'interval', 'viewer_interval', 'wait', 'concurrency')
+            },
+            'elapsed': elapsed,
+            'lag_p95_ms': benchmark.percentile(sorted(recorder.lag), 95) * 1000,
+            'endpoints': recorder.summary(elapsed),
+        }
+        self._report(results)
+        if recorder.aborted:
+            for thread_name, error in recorder.aborted:
+                self.stderr.write(f"   ❌ {thread_name}: {error}")
+            raise CommandError(f'{len(recorder.aborted)} hilos terminaron con un error: los resultados no son válidos')
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                self._compare(results, json.load(baseline_file))
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"💾 Resultados guardados en {options['output']}"))
+
+    def _create_test_db(self):
+        if connection.vendor == 'sqlite':
+            # Archivo temporal en lugar de memoria para admitir varios hilos;
+            # destroy_test_db lo elimina al terminar
+            test_file = os.path.join(tempfile.gettempdir(), f'bench-{os.getpid()}.sqlite3')
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = test_file
+        old_name = connection.settings_dict['NAME']
+        self.stdout.write("🛠️  Creando base de datos de prueba...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name
+
+    def _local_devices(self, count):
+        devices = Device.objects.bulk_create([
+            Device(
+                device_id=f'SIM_{n:04d}', name=f'Simulado {n}',
+                ip_address=f'10.0.{n // 250}.{n % 250 + 1}',
+            )
+            for n in range(count)
+        ])
+        return {device.device_id: device.pk for device in devices}
+
+    def _http_devices(self, transport, count):
+        device_pks = {}
+        path = '/api/devices/'
+        while path:
+            status_code, body, _ = transport.request('GET', path)
+            if status_code != 200:
+                raise CommandError(f'No se pudo listar dispositivos en {transport.base_url} ({status_code})')
+            for device in body['results']:
+                device_pks[device['device_id']] = device['id']
+            path = body['next'] and body['next'].replace(transport.base_url, '', 1)
+
+        wanted = {}
+        for n in range(count):
+            device_id = f'SIM_{n:04d}'
+            if device_id not in device_pks:
+                status_code, body, _ = transport.request('POST', '/api/devices/', {
+                    'device_id': device_id, 'name': f'Simulado {n}',
+                    'ip_address': f'10.0.{n // 250}.{n % 250 + 1}',
+                })
+                if status_code != 201:
+                    raise CommandError(f'No se pudo registrar {device_id}: {body}')
+                device_pks[device_id] = body['id']
+            wanted[device_id] = device_pks[device_id]
+        return wanted
+
+    def _run(self, transport, device_pks, options):
+        actors = [
+            benchmark.VirtualDevice(device_id, options['interval'], options['wait'])
+            for device_id in device_pks
+        ]
+        actors += [
+            benchmark.Viewer(list(device_pks.values()), options['viewer_interval'], options['command_ratio'])
+            for _ in range(options['viewers'])
+        ]
+        self.stdout.write(
+            f"🚀 {options['devices']} ESP32 y {options['viewers']} visores durante {options['duration']:g} s "
+            f"({transport.name}, {options['concurrency']} hilos)..."
+        )
+        return benchmark.run(actors, transport, options['duration'], options['concurrency'])
+
+    def _report(self, results):
+        self.stdout.write("\n" + "="*96)
+        self.stdout.write(f"  RESULTADOS ({results['transport']}, {results['database']}) - {results['elapsed']:.1f} s")
+        self.stdout.write("="*96)
+        self.stdout.write(
+            f"  {'Endpoint':<28}{'Peticiones':>11}{'Errores':>9}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Consultas':>11}"
+        )
+        for endpoint, row in results['endpoints'].items():
+            queries = f"{row['queries']:.1f}" if row['queries'] is not None else 'n/d'
+            line = (
+                f"  {endpoint:<28}{row['requests']:>11}{row['errors']:>9}{row['rps']:>9.1f}"
+                f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{queries:>11}"
+            )
+            self.stdout.write(self.style.WARNING(line) if row['errors'] else line)
+        self.stdout.write("="*96)
+
+        lag = results['lag_p95_ms']
+        if lag > 1000:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  Retraso p95 de {lag:.0f} ms sobre lo programado: el servidor o los hilos no dan abasto"
+            ))
+        else:
+            self.stdout.write(f"⏱️  Retraso p95 sobre lo programado: {lag:.0f} ms")
+
+    def _compare(self, results, baseline):
+        self.stdout.write("\n📊 Comparación con la línea base (p95 y req/s)")
+        for endpoint, row in results['endpoints'].items():
+            before = baseline['endpoints'].get(endpoint)
+            if before is None:
+                continue
+            p95_change = _change(before['p95_ms'], row['p95_ms'])
+            rps_change = _change(before['rps'], row['rps'])
+            self.stdout.write(
+                f"   {endpoint:<28} p95 {before['p95_ms']:.1f} → {row['p95_ms']:.1f} ms ({p95_change})   "
+                f"req/s {before['rps']:.1f} → {row['rps']:.1f} ({rps_change})"
+            )
+
+
+def _change(before, after):
+    if not before:
+        return 'n/d'
+    return f'{(after - before) / before * 100:+.0f}%'
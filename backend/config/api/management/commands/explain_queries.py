@@ -0,0 +1,100 @@
+import re
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from api.models import Device, SensorReading
+
+# Recorridos completos u ordenaciones sobre las tablas de series temporales
+FULL_SCAN = re.compile(
+    r'(Seq Scan on api_(sensorreading|valvecontrol)|SCAN api_(sensorreading|valvecontrol)\b(?! USING)|TEMP B-TREE|Sort\b)'
+)
+
+
+class Command(BaseCommand):
+    help = 'Muestra el plan de ejecución (EXPLAIN) de las consultas de cada endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', type=int, help='ID (pk) del dispositivo; por defecto el primero')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (solo PostgreSQL)')
+
+    def handle(self, *args, **options):
+        device = Device.objects.filter(pk=options['device']) if options['device'] else Device.objects.order_by('pk')
+        device = device.first()
+        if device is None:
+            raise CommandError('No hay dispositivos registrados')
+
+        last_week = urlencode({
+            'device_id': device.pk,
+            'start_date': (timezone.now() - timedelta(days=7)).isoformat(),
+        })
+        endpoints = [
+            ('latest', f'/api/sensor-readings/latest/?device_id={device.pk}'),
+            ('status', f'/api/devices/{device.pk}/status/'),
+            ('fleet_status', '/api/devices/fleet_status/'),
+            ('stats', f'/api/sensor-readings/stats/?device_id={device.pk}'),
+            ('stats (7 días)', f'/api/sensor-readings/stats/?{last_week}'),
+            ('by_device', f'/api/valve-controls/by_device/?device_id={device.pk}'),
+            ('sensor-readings (lista)', '/api/sensor-readings/'),
+            ('valve-controls (lista)', '/api/valve-controls/'),
+        ]
+
+        self.stdout.write("\n" + "="*60)
+        self.stdout.write(f"  PLANES DE CONSULTA ({connection.vendor}) - dispositivo {device.device_id}")
+        self.stdout.write("="*60)
+
+        warnings = 0
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        for name, url in endpoints:
+            # Ejecutar el endpoint sin dejar cambios (p. ej. liveness)
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.get(url)
+                transaction.set_rollback(True)
+            self.stdout.write(f"\n▶ {name}  GET {url}  → {response.status_code}, {len(captured)} consultas")
+            # Agrupar consultas repetidas con distintos parámetros (N+1)
+            repeated = Counter(re.sub(r'\b\d+\b', '?', query['sql']) for query in captured.captured_queries)
+            explained = set()
+            for query in captured.captured_queries:
+                shape = re.sub(r'\b\d+\b', '?', query['sql'])
+                if shape in explained:
+                    continue
+                explained.add(shape)
+                if repeated[shape] > 1:
+                    self.stdout.write(self.style.WARNING(f"   ⚠️  Consulta repetida {repeated[shape]} veces"))
+                warnings += self._explain(query['sql'], options['analyze'])
+
+        # Listado de últimas lecturas de setup_esp32
+        self.stdout.write("\n▶ setup_esp32 (últimas 5 lecturas)")
+        queryset = SensorReading.objects.filter(device=device)[:5]
+        warnings += self._explain(str(queryset.query), options['analyze'], queryset=queryset)
+
+        self.stdout.write("\n" + "="*60)
+        if warnings:
+            self.stdout.write(self.style.WARNING(f"⚠️  {warnings} consultas con recorrido completo u ordenación"))
+        else:
+            self.stdout.write(self.style.SUCCESS("✅ Todas las consultas usan índices"))
+
+    def _explain(self, sql, analyze, queryset=None):
+        if not sql.lstrip().upper().startswith('SELECT'):
+            return 0
+        self.stdout.write(f"   SQL: {sql}")
+        explain_options = {'analyze': True} if analyze and connection.vendor == 'postgresql' else {}
+        if queryset is not None:
+            plan = queryset.explain(**explain_options)
+        else:
+            prefix = connection.ops.explain_query_prefix(**explain_options)
+            with connection.cursor() as cursor:
+                cursor.execute(f'{prefix} {sql}')
+                plan = '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+        flagged = bool(FULL_SCAN.search(plan))
+        for line in plan.splitlines():
+            style = self.style.WARNING if FULL_SCAN.search(line) else (lambda text: text)
+            self.stdout.write(style(f"      {line}"))
+        return int(flagged)
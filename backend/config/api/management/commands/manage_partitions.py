@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api import partitions
+
+
+class Command(BaseCommand):
+    help = 'Crea por adelantado las particiones mensuales de las lecturas (solo PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.READING_PARTITIONS_AHEAD,
+                            help='Meses creados por adelantado además del actual')
+        parser.add_argument('--convert', action='store_true',
+                            help='Particionar la tabla si aún no lo está (bloquea las lecturas mientras copia)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  Las particiones solo se usan con PostgreSQL (base de datos actual: {connection.vendor})"
+            ))
+            return
+        if options['ahead'] < 0:
+            raise CommandError('--ahead no puede ser negativo')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                if not options['convert']:
+                    raise CommandError(
+                        'La tabla de lecturas no está particionada: usar --convert'
+                    )
+                self.stdout.write('🔄 Particionando api_sensorreading (copia completa de la tabla)...')
+                partitions.partition_table(cursor, options['ahead'])
+
+            created = partitions.ensure_partitions(cursor, options['ahead'])
+            for name in created:
+                self.stdout.write(f"   ➕ {name}")
+            existing = partitions.list_partitions(cursor)
+
+        first, last = existing[0][1], existing[-1][2]
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {len(created)} particiones creadas; {len(existing)} meses cubiertos "
+            f"({first:%Y-%m} a {partitions.add_months(last, -1):%Y-%m})"
+        ))
@@ -0,0 +1,125 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from api.export import stream_csv
+from api.models import SensorReading
+from api import partitions, rollups, state_cache
+
+
+class Command(BaseCommand):
+    help = 'Archiva y elimina lecturas antiguas (los agregados por minuto/hora/día se conservan)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.READING_RETENTION_DAYS,
+                            help='Días con lecturas a resolución completa')
+        parser.add_argument('--device', type=int, help='ID (pk) del dispositivo; por defecto todos')
+        parser.add_argument('--archive-dir', default=settings.READING_ARCHIVE_DIR,
+                            help='Carpeta de los CSV comprimidos')
+        parser.add_argument('--no-archive', action='store_true', help='Eliminar sin archivar')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Lecturas eliminadas por transacción')
+        parser.add_argument('--pause', type=float, default=0, help='Segundos de espera entre lotes')
+        parser.add_argument('--dry-run', action='store_true', help='Mostrar qué se haría sin cambiar nada')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days debe ser al menos 1')
+
+        # Cortar en días completos: lo eliminado queda cubierto por DayRollup
+        cutoff = rollups.floor_bucket(timezone.now() - timedelta(days=options['days']), rollups.DAY)
+        readings = SensorReading.objects.filter(timestamp__lt=cutoff)
+        if options['device']:
+            readings = readings.filter(device_id=options['device'])
+
+        # Las lecturas que lleguen durante el proceso (id mayor) no se tocan
+        max_id = readings.aggregate(max_id=Max('id'))['max_id']
+        if max_id is None:
+            self.stdout.write(self.style.SUCCESS(f"✅ No hay lecturas anteriores a {cutoff:%Y-%m-%d}"))
+            return
+        readings = readings.filter(id__lte=max_id)
+
+        self.stdout.write(f"🗂️  Lecturas anteriores a {cutoff:%Y-%m-%d %H:%M} UTC (retención {options['days']} días)")
+        # Lo eliminado solo queda en los agregados: los días que no cuentan se calculan antes
+        missing = rollups.missing_days(readings)
+        if options['dry_run']:
+            if missing:
+                self.stdout.write(f"   📊 Se calcularían los agregados de {len(missing)} días sin agregados")
+            total = readings.count()
+            target = 'sin archivar' if options['no_archive'] else f"archivando en {options['archive_dir']}"
+            self.stdout.write(self.style.WARNING(
+                f"🔍 Simulación: se eliminarían {total} lecturas en lotes de {options['batch_size']} ({target})"
+            ))
+            return
+
+        if missing:
+            self.stdout.write(f"📊 Calculando los agregados de {len(missing)} días sin agregados...")
+            rollups.rebuild_days(missing, options['batch_size'])
+            if rollups.missing_days(readings):
+                raise CommandError('Los agregados no cubren las lecturas a eliminar: no se elimina nada')
+
+        archived = None
+        if not options['no_archive']:
+            archived = self._archive(readings, cutoff, options['archive_dir'])
+        deleted = 0
+        if not options['device'] and partitions.enabled():
+            deleted = self._drop_partitions(cutoff)
+        deleted += self._delete(readings, options['batch_size'], options['pause'])
+        state_cache.bump_all_versions()
+
+        if archived is not None and archived != deleted:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  Archivadas {archived} lecturas pero eliminadas {deleted} (¿se borraron datos en paralelo?)"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"✅ {deleted} lecturas eliminadas"))
+
+    def _archive(self, readings, cutoff, directory):
+        os.makedirs(directory, exist_ok=True)
+        name = f"lecturas-hasta-{cutoff:%Y%m%d}-{timezone.now():%Y%m%dT%H%M%S}.csv.gz"
+        path = os.path.join(directory, name)
+        self.stdout.write(f"📦 Archivando en {path}...")
+
+        rows = readings.order_by('timestamp', 'id')
+        # Escribir con otro nombre y renombrar: nunca queda un archivo a medias
+        partial = path + '.part'
+        with open(partial, 'wb') as archive:
+            for chunk in stream_csv(rows, chunk_size=settings.EXPORT_CHUNK_SIZE, compress=True):
+                archive.write(chunk)
+            archive.flush()
+            os.fsync(archive.fileno())
+        os.replace(partial, path)
+
+        archived = rows.count()
+        self.stdout.write(f"   {archived} lecturas archivadas ({os.path.getsize(path) / 1024:.0f} KB)")
+        return archived
+
+    def _drop_partitions(self, cutoff):
+        # Meses completos: DETACH + DROP de la partición, sin DELETE fila a fila
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                return 0
+            dropped = partitions.drop_partitions_before(cursor, cutoff)
+        if dropped:
+            self.stdout.write(f"   🗑️  {dropped} lecturas eliminadas con sus particiones mensuales")
+        return dropped
+
+    def _delete(self, readings, batch_size, pause):
+        # Lotes por el índice (timestamp, id): cada DELETE bloquea poco tiempo
+        ordered = readings.order_by('timestamp', 'id').values_list('id', flat=True)
+        deleted = 0
+        started = time.monotonic()
+        while True:
+            ids = list(ordered[:batch_size])
+            if not ids:
+                break
+            count, _ = SensorReading.objects.filter(id__in=ids).delete()
+            deleted += count
+            rate = deleted / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"   🗑️  {deleted} lecturas eliminadas ({rate:.0f}/s)...")
+            if pause:
+                time.sleep(pause)
+        return deleted
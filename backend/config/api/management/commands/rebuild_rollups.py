@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.flow import volume_delta
+from api.models import DeviceFlowState, SensorReading
+from api import rollups, state_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los agregados por minuto, hora y día a partir de las lecturas guardadas '
+        '(los días ya podados conservan sus agregados)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', type=int, help='ID (pk) del dispositivo; por defecto todos')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Lecturas procesadas por lote')
+        parser.add_argument(
+            '--deltas', action='store_true',
+            help='Recalcular también el consumo por lectura (volume_delta) detectando reinicios del contador'
+        )
+
+    def handle(self, *args, **options):
+        if options['device']:
+            device_pks = [options['device']]
+        else:
+            device_pks = SensorReading.objects.order_by('device_id').values_list('device_id', flat=True).distinct()
+
+        total = 0
+        with transaction.atomic():
+            for device_pk in list(device_pks):
+                # Solo el rango que aún tiene lecturas crudas: lo anterior ya se podó
+                start = rollups.rebuild_start(device_pk)
+                if start is None:
+                    continue
+                rollups.clear(device_pk, start)
+                total += self._rebuild(device_pk, start, options)
+
+        state_cache.bump_all_versions()
+        self.stdout.write(self.style.SUCCESS(f"✅ Agregados recalculados a partir de {total} lecturas"))
+
+    def _rebuild(self, device_pk, start, options):
+        readings = SensorReading.objects.filter(device_id=device_pk, timestamp__gte=start)
+        previous = None
+        if options['deltas']:
+            # Contador de la última lectura anterior al rango, si queda alguna
+            previous = (
+                SensorReading.objects.filter(device_id=device_pk, timestamp__lt=start)
+                .order_by('-timestamp', '-id').values_list('timestamp', 'total_volume').first()
+            )
+
+        batch = []
+        changed = []
+        last = None
+        total = 0
+        ordered = readings.order_by('timestamp', 'id').only(*rollups.READING_FIELDS)
+        for reading in ordered.iterator(chunk_size=options['batch_size']):
+            if options['deltas']:
+                delta = volume_delta(previous[1] if previous else None, reading.total_volume)
+                previous = last = (reading.timestamp, reading.total_volume)
+                if delta != reading.volume_delta:
+                    reading.volume_delta = delta
+                    changed.append(reading)
+            batch.append(reading)
+            if len(batch) >= options['batch_size']:
+                self._flush(batch, changed)
+                total += len(batch)
+                batch, changed = [], []
+                self.stdout.write(f"   📊 {total} lecturas del dispositivo {device_pk} procesadas...")
+        self._flush(batch, changed)
+        total += len(batch)
+
+        if last is not None:
+            # Continuar la ingesta desde la última lectura del dispositivo
+            timestamp, volume = last
+            DeviceFlowState.objects.update_or_create(
+                device_id=device_pk,
+                defaults={'last_timestamp': timestamp, 'last_volume': volume},
+            )
+        return total
+
+    def _flush(self, batch, changed):
+        if changed:
+            SensorReading.objects.bulk_update(changed, ['volume_delta'], batch_size=1000)
+        rollups.update_rollups(batch)
@@ -0,0 +1,239 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Cada proceso acumula contadores e histogramas en memoria. Con METRICS_DIR
+configurado, cada proceso vuelca periódicamente su copia a un archivo
+`<pid>.json` en esa carpeta y /metrics suma los archivos de todos los
+workers; sin METRICS_DIR solo se muestran las del proceso que responde.
+"""
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+# Segundos: desde una consulta al caché hasta un long-poll completo
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Duración de las peticiones por vista'),
+    'http_request_db_queries': ('histogram', 'Consultas a la base de datos por petición'),
+    'db_query_duration_seconds_total': ('counter', 'Tiempo en consultas a la base de datos por vista'),
+    'sensor_readings_ingested_total': ('counter', 'Lecturas guardadas por dispositivo'),
+    'device_commands_enqueued_total': ('counter', 'Comandos de válvula encolados por dispositivo'),
+    'device_commands_delivered_total': ('counter', 'Comandos de válvula entregados al ESP32 por dispositivo'),
+    'state_cache_requests_total': ('counter', 'Consultas al caché de último estado por resultado'),
+    'conditional_get_responses_total': ('counter', 'Respuestas con ETag por resultado'),
+}
+
+
+class Registry:
+    """Contadores e histogramas del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            self._counters[name, labels] += amount
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = {
+                    'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+                }
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """Copia serializable en JSON"""
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), dict(histogram, counts=list(histogram['counts']))]
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def labels(**values):
+    """Etiquetas en el orden dado, como tupla hashable"""
+    return tuple((key, str(value)) for key, value in values.items())
+
+
+def inc(name, amount=1, **label_values):
+    registry.inc(name, labels(**label_values), amount)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **label_values):
+    registry.observe(name, value, labels(**label_values), buckets)
+
+
+# [consultas, segundos] de la petición en curso. Las variables de contexto se
+# copian a los hilos de sync_to_async, así que también cuenta las vistas async.
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def _track_query(execute, sql, params, many, context):
+    totals = _request_queries.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - start
+
+
+def install_query_tracker(connection, **kwargs):
+    if _track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_query)
+
+
+connection_created.connect(install_query_tracker)
+
+
+def start_request():
+    """Empezar a contar consultas; devuelve el token para finish_request"""
+    return _request_queries.set([0, 0.0])
+
+
+def finish_request(token, view, method, status, duration):
+    totals = _request_queries.get()
+    _request_queries.reset(token)
+    observe('http_request_duration_seconds', duration, view=view, method=method, status=status)
+    observe('http_request_db_queries', totals[0], QUERY_BUCKETS, view=view)
+    inc('db_query_duration_seconds_total', totals[1], view=view)
+    flush()
+
+
+def _process_snapshot():
+    """Métricas propias más los contadores de otros módulos del proceso"""
+    from . import conditional, state_cache
+
+    snapshot = registry.snapshot()
+    cache = state_cache.stats()
+    etags = conditional.stats()
+    snapshot['counters'] += [
+        ['state_cache_requests_total', [['result', 'hit']], cache['hits']],
+        ['state_cache_requests_total', [['result', 'miss']], cache['misses']],
+        ['conditional_get_responses_total', [['result', 'not_modified']], etags['not_modified']],
+        ['conditional_get_responses_total', [['result', 'full']], etags['responses'] - etags['not_modified']],
+    ]
+    return snapshot
+
+
+def flush(force=False):
+    """Volcar las métricas del proceso a METRICS_DIR (como mucho cada METRICS_FLUSH_INTERVAL)"""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        _last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        # Escribir y renombrar: quien lea nunca ve un archivo a medias
+        partial = f'{path}.{threading.get_ident()}.tmp'
+        with open(partial, 'w') as snapshot_file:
+            json.dump(_process_snapshot(), snapshot_file)
+        os.replace(partial, path)
+    finally:
+        _flush_lock.release()
+
+
+atexit.register(flush, force=True)
+
+
+def _snapshots():
+    if not settings.METRICS_DIR:
+        return [_process_snapshot()]
+    flush(force=True)
+    snapshots = []
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as snapshot_file:
+                snapshots.append(json.load(snapshot_file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    # repr conserva todos los dígitos: con :g un contador grande pierde precisión
+    return repr(float(value))
+
+
+def render():
+    """Métricas de todos los procesos en formato de texto de Prometheus"""
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in _snapshots():
+        for name, pairs, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, pairs))] += value
+        for name, pairs, histogram in snapshot['histograms']:
+            key = (name, tuple(map(tuple, pairs)))
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = dict(histogram, counts=list(histogram['counts']))
+            else:
+                total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+                total['sum'] += histogram['sum']
+                total['count'] += histogram['count']
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for (metric, pairs), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_value(value)}')
+            continue
+        for (metric, pairs), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(pairs + (("le", f"{bound:g}"),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(pairs + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{name}_sum{_format_labels(pairs)} {_format_value(histogram["sum"])}')
+            lines.append(f'{name}_count{_format_labels(pairs)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
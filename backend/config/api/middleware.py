@@ -0,0 +1,71 @@
+"""Middlewares del proyecto."""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from . import metrics
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """WhiteNoise con soporte async.
+
+    El middleware original es solo síncrono: bajo ASGI obliga a ejecutar las
+    vistas async (long-polling) dentro de un hilo y las bloquea ahí.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class MetricsMiddleware:
+    """Duración y consultas a la BD de cada petición, por vista (ver api.metrics)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Conexiones abiertas antes de importar api.metrics (p. ej. en las pruebas)
+        for connection in connections.all(initialized_only=True):
+            metrics.install_query_tracker(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, start = metrics.start_request(), time.perf_counter()
+        response = self.get_response(request)
+        self._finish(token, request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        token, start = metrics.start_request(), time.perf_counter()
+        response = await self.get_response(request)
+        self._finish(token, request, response, start)
+        return response
+
+    def _finish(self, token, request, response, start):
+        # view_name de las acciones DRF: 'sensorreading-latest', 'device-status', ...
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.finish_request(token, view, request.method, response.status_code, time.perf_counter() - start)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_sensorreading_device_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, help_text='Último contacto del ESP32 (se vuelca periódicamente)', null=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_desired_state_to_queue(apps, schema_editor):
+    """Convertir los comandos pendientes del campo antiguo en DeviceCommand"""
+    Device = apps.get_model('api', 'Device')
+    DeviceCommand = apps.get_model('api', 'DeviceCommand')
+    now = django.utils.timezone.now()
+    DeviceCommand.objects.bulk_create([
+        DeviceCommand(
+            device=device,
+            action=device.desired_valve_state,
+            created_at=now,
+            expires_at=now + timedelta(seconds=settings.COMMAND_TTL),
+        )
+        for device in Device.objects.exclude(desired_valve_state='none')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_device_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceCommand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('open', 'Abrir'), ('closed', 'Cerrar')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('delivered', 'Entregado'), ('acked', 'Confirmado'), ('expired', 'Expirado')], default='pending', max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(help_text='Un comando pendiente no se entrega después de esta hora')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('acked_at', models.DateTimeField(blank=True, help_text='Confirmado por report_valve_state', null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commands', to='api.device')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['device', 'status', 'created_at'], name='api_command_queue_idx')],
+            },
+        ),
+        migrations.RunPython(move_desired_state_to_queue, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='device',
+            name='desired_valve_state',
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_devicecommand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Inicio del intervalo (UTC)')),
+                ('count', models.IntegerField(default=0)),
+                ('flow_sum', models.FloatField(default=0.0, help_text='Suma de caudales (L/min)')),
+                ('flow_min', models.FloatField()),
+                ('flow_max', models.FloatField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_volume', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_volume', models.FloatField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.device')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='api_dayrollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Inicio del intervalo (UTC)')),
+                ('count', models.IntegerField(default=0)),
+                ('flow_sum', models.FloatField(default=0.0, help_text='Suma de caudales (L/min)')),
+                ('flow_min', models.FloatField()),
+                ('flow_max', models.FloatField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_volume', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_volume', models.FloatField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.device')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='api_hourrollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MinuteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Inicio del intervalo (UTC)')),
+                ('count', models.IntegerField(default=0)),
+                ('flow_sum', models.FloatField(default=0.0, help_text='Suma de caudales (L/min)')),
+                ('flow_min', models.FloatField()),
+                ('flow_max', models.FloatField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_volume', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_volume', models.FloatField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.device')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('device', 'bucket'), name='api_minuterollup_unique')],
+            },
+        ),
+    ]
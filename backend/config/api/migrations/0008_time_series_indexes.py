@@ -0,0 +1,81 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_brin_index(apps, schema_editor):
+    """Índice BRIN sobre timestamp (solo PostgreSQL): barridos por rango de fechas"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS api_reading_ts_brin ON api_sensorreading USING brin ("timestamp")'
+    )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS api_reading_ts_brin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_reading_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='sensorreading',
+            options={'ordering': ['-timestamp', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='valvecontrol',
+            options={'ordering': ['-timestamp', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='devicecommand',
+            index=models.Index(fields=['device', '-created_at', '-id'], name='api_command_device_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['device', '-timestamp', '-id'], name='api_reading_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valvecontrol',
+            index=models.Index(fields=['device', '-timestamp', '-id'], name='api_valve_device_ts_idx'),
+        ),
+        # El índice de cada FK sobra una vez creados los compuestos
+        migrations.AlterField(
+            model_name='devicecommand',
+            name='device',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='commands', to='api.device'),
+        ),
+        migrations.AlterField(
+            model_name='sensorreading',
+            name='device',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.device'),
+        ),
+        migrations.AlterField(
+            model_name='valvecontrol',
+            name='device',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.device'),
+        ),
+        migrations.AlterField(
+            model_name='dayrollup',
+            name='device',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.device'),
+        ),
+        migrations.AlterField(
+            model_name='hourrollup',
+            name='device',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.device'),
+        ),
+        migrations.AlterField(
+            model_name='minuterollup',
+            name='device',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.device'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
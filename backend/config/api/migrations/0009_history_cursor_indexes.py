@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_time_series_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['-timestamp', '-id'], name='api_reading_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valvecontrol',
+            index=models.Index(fields=['device', 'status', '-timestamp', '-id'], name='api_valve_device_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='valvecontrol',
+            index=models.Index(fields=['-timestamp', '-id'], name='api_valve_ts_idx'),
+        ),
+    ]
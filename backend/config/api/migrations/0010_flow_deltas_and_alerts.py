@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_history_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dayrollup',
+            name='consumed',
+            field=models.FloatField(default=0.0, help_text='Litros consumidos (suma de volume_delta)'),
+        ),
+        migrations.AddField(
+            model_name='hourrollup',
+            name='consumed',
+            field=models.FloatField(default=0.0, help_text='Litros consumidos (suma de volume_delta)'),
+        ),
+        migrations.AddField(
+            model_name='minuterollup',
+            name='consumed',
+            field=models.FloatField(default=0.0, help_text='Litros consumidos (suma de volume_delta)'),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='volume_delta',
+            field=models.FloatField(default=0.0, help_text='Litros consumidos desde la lectura anterior (contando reinicios del contador)'),
+        ),
+        migrations.CreateModel(
+            name='DeviceAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('leak', 'Posible fuga')], max_length=20)),
+                ('message', models.CharField(max_length=255)),
+                ('started_at', models.DateTimeField(help_text='Primera lectura de la anomalía')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='api.device')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeviceFlowState',
+            fields=[
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='flow_state', serialize=False, to='api.device')),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('last_volume', models.FloatField(blank=True, null=True)),
+                ('leak_since', models.DateTimeField(blank=True, help_text='Inicio del caudal continuo con la válvula cerrada', null=True)),
+                ('leak_alert', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.devicealert')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='devicealert',
+            index=models.Index(fields=['device', '-created_at', '-id'], name='api_alert_device_idx'),
+        ),
+    ]
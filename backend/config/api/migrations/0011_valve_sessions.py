@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_flow_deltas_and_alerts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deviceflowstate',
+            name='valve_control',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.valvecontrol'),
+        ),
+        migrations.CreateModel(
+            name='ValveSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('opened_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.IntegerField(blank=True, help_text='Duración en segundos (al cerrarse)', null=True)),
+                ('volume', models.FloatField(default=0.0, help_text='Litros consumidos con la válvula abierta')),
+                ('readings', models.IntegerField(default=0, help_text='Lecturas recibidas durante la sesión')),
+                ('device', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='valve_sessions', to='api.device')),
+            ],
+            options={
+                'ordering': ['-opened_at', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='deviceflowstate',
+            name='valve_session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.valvesession'),
+        ),
+        migrations.AddIndex(
+            model_name='valvesession',
+            index=models.Index(fields=['device', '-opened_at', '-id'], name='api_session_device_idx'),
+        ),
+    ]
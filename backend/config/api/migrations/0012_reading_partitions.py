@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:10
+
+from django.db import migrations
+
+# La conversión a tabla particionada no es parte del esquema: la hace
+# `manage_partitions --convert` (build.sh con READING_PARTITIONS=True).
+# Al deshacer esta migración la tabla vuelve a ser la normal que esperan
+# las migraciones anteriores. SQL fijo: no depende de api.partitions.
+UNPARTITION_SQL = """
+DO $$
+DECLARE
+    next_id bigint;
+    statements text[];
+    statement text;
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('api_sensorreading')
+    ) THEN
+        RETURN;
+    END IF;
+
+    -- Comprobaciones pendientes de las FK diferidas: impedirían el DROP TABLE
+    SET CONSTRAINTS ALL IMMEDIATE;
+    LOCK TABLE api_sensorreading IN ACCESS EXCLUSIVE MODE;
+    CREATE TABLE api_sensorreading_new (LIKE api_sensorreading INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+    ALTER TABLE api_sensorreading_new ALTER COLUMN id DROP DEFAULT;
+    INSERT INTO api_sensorreading_new SELECT * FROM api_sensorreading;
+
+    -- Índices (salvo la PK) y claves foráneas, para recrearlos en la tabla nueva
+    SELECT array_agg(replace(indexdef, ' ON ONLY ', ' ON ')) INTO statements
+    FROM pg_indexes
+    WHERE schemaname = current_schema() AND tablename = 'api_sensorreading'
+      AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = 'api_sensorreading'::regclass);
+    SELECT statements || array_agg(
+        format('ALTER TABLE api_sensorreading ADD CONSTRAINT %I %s', conname, pg_get_constraintdef(oid))
+    ) INTO statements
+    FROM pg_constraint WHERE conrelid = 'api_sensorreading'::regclass AND contype = 'f';
+    SELECT COALESCE(MAX(id), 0) + 1 INTO next_id FROM api_sensorreading;
+
+    DROP TABLE api_sensorreading;
+    ALTER TABLE api_sensorreading_new RENAME TO api_sensorreading;
+    EXECUTE format(
+        'ALTER TABLE api_sensorreading ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (START WITH %s)', next_id
+    );
+    ALTER TABLE api_sensorreading ADD CONSTRAINT api_sensorreading_pkey PRIMARY KEY (id);
+    FOREACH statement IN ARRAY COALESCE(statements, '{}') LOOP
+        EXECUTE statement;
+    END LOOP;
+END
+$$;
+"""
+
+
+def unpartition_readings(apps, schema_editor):
+    """Volver a una tabla api_sensorreading normal si está particionada (solo PostgreSQL)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(UNPARTITION_SQL, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_valve_sessions'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, unpartition_readings),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_reading_partitions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='devicecommand',
+            name='expires_at',
+            field=models.DateTimeField(help_text='Vencimiento: sin entregar desde la creación, o sin confirmar desde la entrega'),
+        ),
+    ]
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncDay
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+DAY = timedelta(days=1)
+LEVELS = [
+    ('DayRollup', DAY),
+    ('HourRollup', timedelta(hours=1)),
+    ('MinuteRollup', timedelta(minutes=1)),
+]
+# api.flow.RESET_TOLERANCE al escribir la migración
+RESET_TOLERANCE = 0.01
+
+
+def volume_delta(previous, current):
+    if previous is None:
+        return 0.0
+    if current < previous - RESET_TOLERANCE:
+        return current
+    return max(current - previous, 0.0)
+
+
+def floor_bucket(ts, size):
+    ts = ts.astimezone(dt_timezone.utc)
+    return ts - (ts - EPOCH) % size
+
+
+def group(readings, size):
+    groups = {}
+    for reading in readings:
+        bucket = floor_bucket(reading.timestamp, size)
+        row = groups.get(bucket)
+        if row is None:
+            groups[bucket] = {
+                'count': 1,
+                'flow_sum': reading.flow_rate,
+                'flow_min': reading.flow_rate,
+                'flow_max': reading.flow_rate,
+                'first_timestamp': reading.timestamp,
+                'first_volume': reading.total_volume,
+                'last_timestamp': reading.timestamp,
+                'last_volume': reading.total_volume,
+                'consumed': reading.volume_delta,
+            }
+            continue
+        row['count'] += 1
+        row['flow_sum'] += reading.flow_rate
+        row['consumed'] += reading.volume_delta
+        row['flow_min'] = min(row['flow_min'], reading.flow_rate)
+        row['flow_max'] = max(row['flow_max'], reading.flow_rate)
+        # Lecturas en orden (timestamp, id): la última del bucket es la más reciente
+        row['last_timestamp'] = reading.timestamp
+        row['last_volume'] = reading.total_volume
+    return groups
+
+
+def backfill_deltas(apps, schema_editor):
+    """Consumo por lectura de las lecturas guardadas antes de 0010 (volume_delta quedó en 0)"""
+    SensorReading = apps.get_model('api', 'SensorReading')
+    device_pks = SensorReading.objects.order_by('device_id').values_list('device_id', flat=True).distinct()
+    for device_pk in list(device_pks):
+        readings = (
+            SensorReading.objects.filter(device_id=device_pk)
+            .order_by('timestamp', 'id').only('id', 'timestamp', 'total_volume', 'volume_delta')
+        )
+        previous = None
+        changed = []
+        for reading in readings.iterator(chunk_size=5000):
+            delta = volume_delta(previous, reading.total_volume)
+            previous = reading.total_volume
+            if delta != reading.volume_delta:
+                reading.volume_delta = delta
+                changed.append(reading)
+            if len(changed) >= 1000:
+                SensorReading.objects.bulk_update(changed, ['volume_delta'])
+                changed = []
+        SensorReading.objects.bulk_update(changed, ['volume_delta'])
+
+
+def backfill_rollups(apps, schema_editor):
+    """Agregados de las lecturas guardadas antes de 0007 (los días que DayRollup no cuenta)"""
+    SensorReading = apps.get_model('api', 'SensorReading')
+    DayRollup = apps.get_model('api', 'DayRollup')
+
+    raw = (
+        SensorReading.objects.order_by()
+        .annotate(day=TruncDay('timestamp', tzinfo=dt_timezone.utc))
+        .values('device_id', 'day')
+        .annotate(count=Count('id'))
+    )
+    rolled = {(row.device_id, row.bucket): row.count for row in DayRollup.objects.all()}
+    for row in raw:
+        device_pk, day = row['device_id'], row['day']
+        if rolled.get((device_pk, day), 0) >= row['count']:
+            continue
+        readings = list(
+            SensorReading.objects.filter(device_id=device_pk, timestamp__gte=day, timestamp__lt=day + DAY)
+            .order_by('timestamp', 'id')
+        )
+        for name, size in LEVELS:
+            model = apps.get_model('api', name)
+            model.objects.filter(device_id=device_pk, bucket__gte=day, bucket__lt=day + DAY).delete()
+            model.objects.bulk_create(
+                [model(device_id=device_pk, bucket=bucket, **values) for bucket, values in group(readings, size).items()],
+                batch_size=1000,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_command_expiry'),
+    ]
+
+    operations = [
+        # Primero los consumos: los agregados suman volume_delta
+        migrations.RunPython(backfill_deltas, migrations.RunPython.noop),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
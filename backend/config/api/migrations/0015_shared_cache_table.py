@@ -0,0 +1,22 @@
+from django.core.management import call_command
+from django.db import migrations
+
+# Tabla del caché `default` (settings.CACHES): la versión compartida del
+# registro de dispositivos vive ahí, así que tiene que existir tras `migrate`
+SHARED_CACHE_TABLE = 'api_shared_cache'
+
+
+def create_shared_cache_table(apps, schema_editor):
+    """Crear la tabla del caché compartido si no existe (createcachetable ya la omite)"""
+    call_command('createcachetable', SHARED_CACHE_TABLE, database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_backfill_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_shared_cache_table, migrations.RunPython.noop),
+    ]
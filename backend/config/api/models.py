@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Device(models.Model):
     """Modelo para dispositivos ESP32"""
@@ -6,14 +7,12 @@ class Device(models.Model):
     device_id = models.CharField(max_length=100, unique=True)
     ip_address = models.GenericIPAddressField()
     is_online = models.BooleanField(default=False)
-    
-    # Campos para control remoto de válvula (arquitectura inversa)
-    desired_valve_state = models.CharField(
-        max_length=10,
-        choices=[('open', 'Open'), ('closed', 'Closed'), ('none', 'None')],
-        default='none',
-        help_text='Estado deseado de la válvula (comando pendiente para ESP32)'
+    last_seen = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Último contacto del ESP32 (se vuelca periódicamente)'
     )
+    
+    # Estado reportado por el ESP32; los comandos pendientes están en DeviceCommand
     current_valve_state = models.CharField(
         max_length=10,
         choices=[('open', 'Open'), ('closed', 'Closed'), ('unknown', 'Unknown')],
@@ -35,13 +34,21 @@ class ValveControl(models.Model):
         ('closed', 'Cerrada'),
     ]
 
-    device = models.ForeignKey(Device, on_delete=models.CASCADE)
+    # Sin índice propio: lo cubre el índice compuesto (device, -timestamp, -id)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, db_index=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
     timestamp = models.DateTimeField(auto_now_add=True)
     duration = models.IntegerField(null=True, blank=True, help_text="Duración en segundos")
 
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            # Historial por dispositivo, del más reciente al más antiguo
+            models.Index(fields=['device', '-timestamp', '-id'], name='api_valve_device_ts_idx'),
+            models.Index(fields=['device', 'status', '-timestamp', '-id'], name='api_valve_device_status_idx'),
+            # Listado global paginado por cursor
+            models.Index(fields=['-timestamp', '-id'], name='api_valve_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device.name} - {self.status}"
@@ -49,13 +56,158 @@ class ValveControl(models.Model):
 
 class SensorReading(models.Model):
     """Modelo para lecturas del sensor YF-S201"""
-    device = models.ForeignKey(Device, on_delete=models.CASCADE)
+    # Sin índice propio: lo cubre el índice compuesto (device, -timestamp, -id)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, db_index=False)
     flow_rate = models.FloatField(help_text="Caudal en L/min")
     total_volume = models.FloatField(default=0.0, help_text="Volumen total acumulado en litros")
-    timestamp = models.DateTimeField(auto_now_add=True)
+    volume_delta = models.FloatField(
+        default=0.0,
+        help_text='Litros consumidos desde la lectura anterior (contando reinicios del contador)'
+    )
+    # Por defecto la hora de recepción; las lecturas en lote traen la hora del dispositivo
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            # Última lectura / rangos por dispositivo sin ordenar todo su historial.
+            # En PostgreSQL la migración 0008 añade además un índice BRIN sobre timestamp.
+            models.Index(fields=['device', '-timestamp', '-id'], name='api_reading_device_ts_idx'),
+            # Listado global paginado por cursor
+            models.Index(fields=['-timestamp', '-id'], name='api_reading_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.name} - {self.flow_rate} L/min - Total: {self.total_volume} L"
+
+class DeviceCommand(models.Model):
+    """Cola de comandos de válvula para un ESP32 (se entregan en orden)"""
+    ACTION_CHOICES = [
+        ('open', 'Abrir'),
+        ('closed', 'Cerrar'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('delivered', 'Entregado'),
+        ('acked', 'Confirmado'),
+        ('expired', 'Expirado'),
+    ]
+
+    # Sin índice propio: lo cubren los índices compuestos de Meta
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='commands', db_index=False)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(
+        help_text='Vencimiento: sin entregar desde la creación, o sin confirmar desde la entrega'
+    )
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    acked_at = models.DateTimeField(null=True, blank=True, help_text='Confirmado por report_valve_state')
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['device', 'status', 'created_at'], name='api_command_queue_idx'),
+            models.Index(fields=['device', '-created_at', '-id'], name='api_command_device_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.name} - {self.action} ({self.status})"
+
+
+class ReadingRollup(models.Model):
+    """Agregado de las lecturas de un dispositivo en un intervalo de tiempo"""
+    # Sin índice propio: lo cubre la restricción única (device, bucket)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, db_index=False)
+    bucket = models.DateTimeField(help_text='Inicio del intervalo (UTC)')
+    count = models.IntegerField(default=0)
+    flow_sum = models.FloatField(default=0.0, help_text='Suma de caudales (L/min)')
+    flow_min = models.FloatField()
+    flow_max = models.FloatField()
+    first_timestamp = models.DateTimeField()
+    first_volume = models.FloatField()
+    last_timestamp = models.DateTimeField()
+    last_volume = models.FloatField()
+    consumed = models.FloatField(default=0.0, help_text='Litros consumidos (suma de volume_delta)')
+
+    class Meta:
+        abstract = True
+        ordering = ['-bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'bucket'], name='%(app_label)s_%(class)s_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.name} - {self.bucket} ({self.count} lecturas)"
+
+
+class MinuteRollup(ReadingRollup):
+    """Lecturas agregadas por minuto"""
+
+
+class HourRollup(ReadingRollup):
+    """Lecturas agregadas por hora"""
+
+
+class DayRollup(ReadingRollup):
+    """Lecturas agregadas por día (UTC)"""
+
+
+class DeviceAlert(models.Model):
+    """Alerta de un dispositivo (p. ej. caudal con la válvula cerrada)"""
+    KIND_CHOICES = [
+        ('leak', 'Posible fuga'),
+    ]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='alerts', db_index=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    message = models.CharField(max_length=255)
+    started_at = models.DateTimeField(help_text='Primera lectura de la anomalía')
+    created_at = models.DateTimeField(default=timezone.now)
+    resolved_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['device', '-created_at', '-id'], name='api_alert_device_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.name} - {self.get_kind_display()} ({self.started_at})"
+
+
+class ValveSession(models.Model):
+    """Intervalo con la válvula abierta y el agua consumida durante él"""
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='valve_sessions', db_index=False)
+    opened_at = models.DateTimeField()
+    closed_at = models.DateTimeField(null=True, blank=True)
+    duration = models.IntegerField(null=True, blank=True, help_text='Duración en segundos (al cerrarse)')
+    volume = models.FloatField(default=0.0, help_text='Litros consumidos con la válvula abierta')
+    readings = models.IntegerField(default=0, help_text='Lecturas recibidas durante la sesión')
+
+    class Meta:
+        ordering = ['-opened_at', '-id']
+        indexes = [
+            models.Index(fields=['device', '-opened_at', '-id'], name='api_session_device_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.name} - {self.opened_at} ({self.volume:.1f} L)"
+
+
+class DeviceFlowState(models.Model):
+    """Estado de la ingesta de un dispositivo para calcular consumos y detectar fugas"""
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, primary_key=True, related_name='flow_state')
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    last_volume = models.FloatField(null=True, blank=True)
+    leak_since = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Inicio del caudal continuo con la válvula cerrada'
+    )
+    leak_alert = models.ForeignKey(DeviceAlert, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Sesión abierta (válvula abierta) y fila de ValveControl del último cambio de estado
+    valve_session = models.ForeignKey(ValveSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    valve_control = models.ForeignKey(ValveControl, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
 
     def __str__(self):
-        return f"{self.device.name} - {self.flow_rate} L/min - Total: {self.total_volume} L"
\ No newline at end of file
+        return f"{self.device.name} - {self.last_timestamp}"
@@ -0,0 +1,70 @@
+"""Formato binario compacto para lotes de lecturas del ESP32.
+
+Cabecera de 13 bytes (little-endian) seguida de `count` registros de 10 bytes:
+
+    cabecera: magic b'WR' | versión u8 (1) | pk del dispositivo u32
+              | timestamp base u32 (segundos Unix) | count u16
+    registro: desfase u16 (segundos) | flow_rate f32 | total_volume f32
+
+Con timestamp base 0 (ESP32 sin hora NTP) el desfase es la antigüedad de la
+lectura: se resta a la hora de recepción. Una lectura ocupa 10 bytes frente
+a los ~60 del JSON equivalente.
+"""
+import math
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .serializers import reading_timestamp_error
+
+MAGIC = b'WR'
+VERSION = 1
+HEADER = struct.Struct('<2sBIIH')
+RECORD = struct.Struct('<Hff')
+
+PackedBatch = namedtuple('PackedBatch', ['device', 'readings'])
+
+
+def pack_readings(device_pk, readings, base_timestamp=0):
+    """Codificar (desfase, flow_rate, total_volume) en el formato binario"""
+    body = b''.join(RECORD.pack(*reading) for reading in readings)
+    return HEADER.pack(MAGIC, VERSION, device_pk, base_timestamp, len(readings)) + body
+
+
+class PackedReadingsParser(BaseParser):
+    """Decodifica un lote binario en PackedBatch(device, [(timestamp, flow, volume)])"""
+    media_type = 'application/x-water-readings'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        payload = stream.read() if stream is not None else b''
+        if len(payload) < HEADER.size:
+            raise ParseError('Lote binario incompleto')
+        magic, version, device_pk, base_timestamp, count = HEADER.unpack_from(payload)
+        if magic != MAGIC or version != VERSION:
+            raise ParseError('Formato binario no reconocido')
+        if not count or count > settings.SENSOR_BATCH_MAX_SIZE:
+            raise ParseError(f'El lote debe tener entre 1 y {settings.SENSOR_BATCH_MAX_SIZE} lecturas')
+        if len(payload) != HEADER.size + count * RECORD.size:
+            raise ParseError(f'Se esperaban {count} lecturas de {RECORD.size} bytes')
+
+        if base_timestamp:
+            base, sign = datetime.fromtimestamp(base_timestamp, dt_timezone.utc), 1
+        else:
+            base, sign = timezone.now(), -1
+
+        readings = []
+        for offset, flow_rate, total_volume in RECORD.iter_unpack(payload[HEADER.size:]):
+            if not (math.isfinite(flow_rate) and math.isfinite(total_volume)) or flow_rate < 0 or total_volume < 0:
+                raise ParseError('Valores de caudal o volumen inválidos')
+            timestamp = base + sign * timedelta(seconds=offset)
+            error = reading_timestamp_error(timestamp)
+            if error:
+                raise ParseError(error)
+            # f32 no tiene más precisión que la que envía el sensor
+            readings.append((timestamp, round(flow_rate, 3), round(total_volume, 3)))
+        return PackedBatch(device_pk, readings)
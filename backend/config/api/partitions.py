@@ -0,0 +1,207 @@
+"""Particiones mensuales de api_sensorreading en PostgreSQL (READING_PARTITIONS).
+
+`manage_partitions --convert` (build.sh con READING_PARTITIONS=True)
+convierte la tabla de lecturas en una tabla particionada por rango de `timestamp`, con una partición por
+mes (`api_sensorreading_pAAAAMM`) y una partición DEFAULT para lecturas
+fuera de rango (p. ej. un ESP32 con la hora mal). La clave primaria pasa a
+ser (id, timestamp), como exige PostgreSQL; para Django sigue siendo `id`.
+
+- `manage_partitions` crea por adelantado las particiones de los próximos meses.
+- `prune_readings` elimina los meses completos con DETACH + DROP de su
+  partición en lugar de un DELETE masivo.
+- Las consultas con rango de fechas solo leen las particiones de ese rango.
+
+En SQLite (o sin READING_PARTITIONS) la tabla es la normal y nada cambia.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+TABLE = 'api_sensorreading'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def enabled():
+    return settings.READING_PARTITIONS and connection.vendor == 'postgresql'
+
+
+def month_start(ts):
+    """Inicio (UTC) del mes que contiene `ts`"""
+    ts = ts.astimezone(dt_timezone.utc)
+    return datetime(ts.year, ts.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(start, months):
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y%m}'
+
+
+def recent(queryset):
+    """Las lecturas del mes en curso si la tabla está particionada, si no ninguna.
+
+    Para buscar primero en la última partición: `recent(qs).first() or qs.first()`.
+    """
+    if not enabled():
+        return queryset.none()
+    return queryset.filter(timestamp__gte=month_start(timezone.now()))
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [TABLE]
+    )
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor):
+    """[(nombre, inicio, fin)] de las particiones mensuales, en orden"""
+    cursor.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+        """,
+        [TABLE],
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        if name == DEFAULT_PARTITION:
+            continue
+        start = datetime.strptime(name.rsplit('_p', 1)[1], '%Y%m').replace(tzinfo=dt_timezone.utc)
+        partitions.append((name, start, add_months(start, 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _table_definition(cursor):
+    """Índices (salvo la PK) y claves foráneas de la tabla, para recrearlos"""
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))
+        """,
+        [TABLE, TABLE],
+    )
+    # Los índices de una tabla particionada se definen "ON ONLY" la tabla padre
+    indexes = [row[0].replace(' ON ONLY ', ' ON ') for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [TABLE],
+    )
+    return indexes, cursor.fetchall()
+
+
+def _rebuild(cursor, partition_clause, primary_key, id_default, before_copy=None):
+    """Copiar la tabla a una nueva con otra definición y sustituirla (en la transacción en curso)"""
+    # Las FK de Django son DEFERRABLE: con lecturas ya escritas en la transacción, sus
+    # comprobaciones pendientes impedirían el DROP TABLE
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+    cursor.execute(
+        f'CREATE TABLE {TABLE}_new (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) {partition_clause}'
+    )
+    # El id era IDENTITY o serial: la secuencia se recrea al final
+    cursor.execute(f'ALTER TABLE {TABLE}_new ALTER COLUMN id DROP DEFAULT')
+    if before_copy:
+        before_copy(f'{TABLE}_new')
+    cursor.execute(f'INSERT INTO {TABLE}_new SELECT * FROM {TABLE}')
+    indexes, foreign_keys = _table_definition(cursor)
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {TABLE}')
+    next_id = cursor.fetchone()[0]
+
+    cursor.execute(f'DROP TABLE {TABLE}')
+    cursor.execute(f'ALTER TABLE {TABLE}_new RENAME TO {TABLE}')
+    for statement in id_default:
+        cursor.execute(statement.format(table=TABLE, next_id=int(next_id)))
+    cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ({primary_key})')
+    # Los índices se crean con los datos ya copiados: más rápido que mantenerlos fila a fila
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+def partition_table(cursor, months_ahead):
+    """Convertir la tabla de lecturas en particionada por mes, conservando los datos"""
+
+    def create_partitions(parent):
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {parent} DEFAULT')
+        # Un mes por cada mes con lecturas, más el actual y los próximos
+        cursor.execute(f"""SELECT DISTINCT date_trunc('month', "timestamp" AT TIME ZONE 'UTC') FROM {TABLE}""")
+        months = {row[0].replace(tzinfo=dt_timezone.utc) for row in cursor.fetchall()}
+        current = month_start(timezone.now())
+        months.update(add_months(current, offset) for offset in range(months_ahead + 1))
+        for start in sorted(months):
+            cursor.execute(
+                f'CREATE TABLE {partition_name(start)} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)',
+                [start, add_months(start, 1)],
+            )
+
+    _rebuild(
+        cursor,
+        partition_clause='PARTITION BY RANGE ("timestamp")',
+        primary_key='id, "timestamp"',
+        id_default=[
+            'CREATE SEQUENCE {table}_id_seq START WITH {next_id} OWNED BY {table}.id',
+            "ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')",
+        ],
+        before_copy=create_partitions,
+    )
+
+
+def unpartition_table(cursor):
+    """Volver a una tabla normal con los mismos datos (como al deshacer la migración 0012)"""
+    _rebuild(
+        cursor,
+        partition_clause='',
+        primary_key='id',
+        id_default=['ALTER TABLE {table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {next_id})'],
+    )
+
+
+def ensure_partitions(cursor, months_ahead):
+    """Crear las particiones del mes en curso y los `months_ahead` siguientes. Devuelve las creadas"""
+    existing = {name for name, _, _ in list_partitions(cursor)}
+    current = month_start(timezone.now())
+    created = []
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        name = partition_name(start)
+        if name in existing:
+            continue
+        end = add_months(start, 1)
+        # Las lecturas del mes que ya cayeron en DEFAULT pasan a la partición nueva
+        cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """,
+            [start, end],
+        )
+        cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', [start, end])
+        created.append(name)
+    return created
+
+
+def drop_partitions_before(cursor, cutoff):
+    """Eliminar las particiones que terminan antes de `cutoff`. Devuelve las lecturas eliminadas"""
+    deleted = 0
+    for name, _, end in list_partitions(cursor):
+        if end > cutoff:
+            break
+        cursor.execute(f'SELECT COUNT(*) FROM {name}')
+        deleted += cursor.fetchone()[0]
+        # Solo metadatos: sin DELETE fila a fila ni VACUUM posterior
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+    return deleted
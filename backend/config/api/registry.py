@@ -0,0 +1,104 @@
+"""Registro en memoria `device_id` -> dispositivo para los endpoints de los ESP32.
+
+Cada petición de un ESP32 trae su `device_id` y antes necesitaba una
+consulta solo para obtener la clave primaria. Cada proceso guarda aquí los
+dispositivos ya vistos (LRU de DEVICE_REGISTRY_SIZE entradas). Guardar o
+eliminar un Device sube una versión en el caché `default` (en la BD,
+compartido por todos los procesos) y cada proceso la comprueba como mucho cada DEVICE_REGISTRY_CHECK_INTERVAL segundos: tras
+renombrar o eliminar un dispositivo, otro proceso puede usar el dato
+anterior durante ese tiempo.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import state_cache
+from .models import Device
+
+# En el orden de los campos del modelo: Model.from_db asigna los valores en ese orden
+FIELDS = ('id', 'name', 'device_id')
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # device_id -> (pk, name)
+_version = None
+_checked_at = 0.0
+
+
+def _instance(device_id, entry):
+    """Device con id, device_id y name; el resto de campos se carga si se usa"""
+    pk, name = entry
+    return Device.from_db(DEFAULT_DB_ALIAS, FIELDS, (pk, name, device_id))
+
+
+def _check_version():
+    """Vaciar el registro si otro proceso cambió algún dispositivo"""
+    global _version, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.DEVICE_REGISTRY_CHECK_INTERVAL:
+        return
+    version = state_cache.registry_version()
+    with _lock:
+        if version != _version:
+            _entries.clear()
+            _version = version
+        _checked_at = now
+
+
+def _remember(device):
+    with _lock:
+        _entries[device.device_id] = (device.pk, device.name)
+        _entries.move_to_end(device.device_id)
+        while len(_entries) > settings.DEVICE_REGISTRY_SIZE:
+            _entries.popitem(last=False)
+
+
+def _cached(device_ids):
+    found = {}
+    with _lock:
+        for device_id in device_ids:
+            entry = _entries.get(device_id)
+            if entry is not None:
+                _entries.move_to_end(device_id)
+                found[device_id] = _instance(device_id, entry)
+    return found
+
+
+def lookup_many(device_ids):
+    """{device_id: Device} de los dispositivos existentes, con una consulta como mucho"""
+    _check_version()
+    found = _cached(device_ids)
+    missing = set(device_ids) - set(found)
+    if missing:
+        for device in Device.objects.only(*FIELDS).filter(device_id__in=missing):
+            _remember(device)
+            found[device.device_id] = device
+    return found
+
+
+def lookup(device_id):
+    """Device con ese device_id, o None"""
+    return lookup_many([device_id]).get(device_id)
+
+
+async def alookup(device_id):
+    """Igual que lookup desde una vista async"""
+    if time.monotonic() - _checked_at >= settings.DEVICE_REGISTRY_CHECK_INTERVAL:
+        # La versión está en el caché de BD
+        await sync_to_async(_check_version)()
+    device = _cached([device_id]).get(device_id)
+    if device is None:
+        device = await Device.objects.only(*FIELDS).filter(device_id=device_id).afirst()
+        if device is not None:
+            _remember(device)
+    return device
+
+
+def invalidate():
+    """Vaciar el registro de todos los procesos (al guardar o eliminar un Device)"""
+    state_cache.bump_registry_version()
+    with _lock:
+        _entries.clear()
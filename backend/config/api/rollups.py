@@ -0,0 +1,254 @@
+"""Agregados por minuto, hora y día de las lecturas del sensor.
+
+La ingesta los mantiene de forma incremental y `stats` responde con los
+buckets más gruesos que caben en el rango pedido, leyendo lecturas crudas
+solo en los bordes que no completan un minuto.
+
+Tras `prune_readings` los agregados son la única copia de los días podados:
+solo se recalculan los días que aún tienen lecturas crudas.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DateTimeField, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Greatest, Least, TruncDay
+
+from .models import DayRollup, HourRollup, MinuteRollup, SensorReading
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+DAY = timedelta(days=1)
+
+# Campos de la lectura que usan los agregados
+READING_FIELDS = ('device_id', 'flow_rate', 'total_volume', 'volume_delta', 'timestamp')
+
+# De mayor a menor resolución temporal
+LEVELS = [
+    (DayRollup, DAY),
+    (HourRollup, timedelta(hours=1)),
+    (MinuteRollup, timedelta(minutes=1)),
+]
+
+
+def floor_bucket(ts, size):
+    """Inicio (UTC) del bucket de tamaño `size` que contiene `ts`"""
+    ts = ts.astimezone(dt_timezone.utc)
+    return ts - (ts - EPOCH) % size
+
+
+def _ceil_bucket(ts, size):
+    start = floor_bucket(ts, size)
+    return start if start == ts else start + size
+
+
+def _group(readings, size):
+    """Agregar en memoria las lecturas por (dispositivo, bucket)"""
+    groups = {}
+    for reading in readings:
+        key = (reading.device_id, floor_bucket(reading.timestamp, size))
+        flow = float(reading.flow_rate)
+        volume = float(reading.total_volume)
+        delta = float(reading.volume_delta)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {
+                'count': 1,
+                'flow_sum': flow,
+                'flow_min': flow,
+                'flow_max': flow,
+                'first_timestamp': reading.timestamp,
+                'first_volume': volume,
+                'last_timestamp': reading.timestamp,
+                'last_volume': volume,
+                'consumed': delta,
+            }
+            continue
+        group['count'] += 1
+        group['flow_sum'] += flow
+        group['consumed'] += delta
+        group['flow_min'] = min(group['flow_min'], flow)
+        group['flow_max'] = max(group['flow_max'], flow)
+        if reading.timestamp < group['first_timestamp']:
+            group['first_timestamp'] = reading.timestamp
+            group['first_volume'] = volume
+        if reading.timestamp >= group['last_timestamp']:
+            group['last_timestamp'] = reading.timestamp
+            group['last_volume'] = volume
+    return groups
+
+
+def _merge(model, device_pk, bucket, group):
+    """Sumar un grupo de lecturas al bucket existente; devuelve filas actualizadas"""
+    first_ts = Value(group['first_timestamp'], output_field=DateTimeField())
+    last_ts = Value(group['last_timestamp'], output_field=DateTimeField())
+    return model.objects.filter(device_id=device_pk, bucket=bucket).update(
+        count=F('count') + group['count'],
+        flow_sum=F('flow_sum') + group['flow_sum'],
+        consumed=F('consumed') + group['consumed'],
+        flow_min=Least('flow_min', Value(group['flow_min'], output_field=FloatField())),
+        flow_max=Greatest('flow_max', Value(group['flow_max'], output_field=FloatField())),
+        # Las expresiones leen los valores previos de la fila
+        first_volume=Case(
+            When(first_timestamp__gt=first_ts, then=Value(group['first_volume'])),
+            default=F('first_volume'),
+        ),
+        first_timestamp=Least('first_timestamp', first_ts),
+        last_volume=Case(
+            When(last_timestamp__lte=last_ts, then=Value(group['last_volume'])),
+            default=F('last_volume'),
+        ),
+        last_timestamp=Greatest('last_timestamp', last_ts),
+    )
+
+
+def update_rollups(readings):
+    """Incorporar lecturas recién guardadas a los agregados de cada nivel"""
+    for model, size in LEVELS:
+        for (device_pk, bucket), group in _group(readings, size).items():
+            if _merge(model, device_pk, bucket, group):
+                continue
+            try:
+                with transaction.atomic():
+                    model.objects.create(device_id=device_pk, bucket=bucket, **group)
+            except IntegrityError:
+                # Otro proceso creó el bucket entre medio
+                _merge(model, device_pk, bucket, group)
+
+
+def clear(device_pk, start, end=None):
+    """Borrar los agregados del dispositivo en [start, end) en todos los niveles"""
+    for model, _ in LEVELS:
+        _range(model.objects.filter(device_id=device_pk), 'bucket', start, end).delete()
+
+
+def rebuild_start(device_pk):
+    """Primer día desde el que se pueden recalcular los agregados (None si no hay lecturas).
+
+    Es el primer día con lecturas crudas; si ese día quedó a medio podar
+    (prune_readings interrumpido), su agregado tiene más lecturas que la
+    tabla y se conserva.
+    """
+    first = SensorReading.objects.filter(device_id=device_pk).aggregate(first=Min('timestamp'))['first']
+    if first is None:
+        return None
+    day = floor_bucket(first, DAY)
+    raw = SensorReading.objects.filter(device_id=device_pk, timestamp__gte=day, timestamp__lt=day + DAY).count()
+    rolled = DayRollup.objects.filter(device_id=device_pk, bucket=day).values_list('count', flat=True).first()
+    return day + DAY if (rolled or 0) > raw else day
+
+
+def missing_days(readings):
+    """[(pk, día)] con lecturas de `readings` que los agregados diarios no cuentan"""
+    raw = {
+        (row['device_id'], row['day']): row['count']
+        for row in readings.order_by()
+        .annotate(day=TruncDay('timestamp', tzinfo=dt_timezone.utc))
+        .values('device_id', 'day')
+        .annotate(count=Count('id'))
+    }
+    if not raw:
+        return []
+    days = [day for _, day in raw]
+    rolled = {
+        (row['device_id'], row['bucket']): row['count']
+        for row in DayRollup.objects.filter(
+            device_id__in={pk for pk, _ in raw}, bucket__gte=min(days), bucket__lte=max(days)
+        ).values('device_id', 'bucket', 'count')
+    }
+    return sorted(key for key, count in raw.items() if rolled.get(key, 0) < count)
+
+
+def rebuild_days(days, batch_size=5000):
+    """Recalcular desde las lecturas crudas los agregados de esos (pk, día)"""
+    for device_pk, day in days:
+        with transaction.atomic():
+            clear(device_pk, day, day + DAY)
+            readings = SensorReading.objects.filter(
+                device_id=device_pk, timestamp__gte=day, timestamp__lt=day + DAY
+            ).only(*READING_FIELDS)
+            batch = []
+            for reading in readings.iterator(chunk_size=batch_size):
+                batch.append(reading)
+                if len(batch) >= batch_size:
+                    update_rollups(batch)
+                    batch = []
+            update_rollups(batch)
+
+
+def _plan(lo, hi, level=0):
+    """Dividir [lo, hi) en rangos de buckets completos y bordes de lecturas crudas.
+
+    Devuelve una lista ordenada de (modelo, inicio, fin); modelo None indica
+    lecturas crudas. None como inicio o fin significa rango abierto.
+    """
+    if level == len(LEVELS):
+        return [(None, lo, hi)] if lo is None or hi is None or lo < hi else []
+
+    model, size = LEVELS[level]
+    start = _ceil_bucket(lo, size) if lo is not None else None
+    end = floor_bucket(hi, size) if hi is not None else None
+    if start is not None and end is not None and start >= end:
+        return _plan(lo, hi, level + 1)
+
+    parts = []
+    if lo is not None:
+        parts += _plan(lo, start, level + 1)
+    parts.append((model, start, end))
+    if hi is not None:
+        parts += _plan(end, hi, level + 1)
+    return parts
+
+
+def _range(queryset, field, start, end):
+    if start is not None:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def summarize(device_pk, start=None, end=None):
+    """Estadísticas de caudal de un dispositivo en [start, end)"""
+    totals = {'count': 0, 'flow_sum': 0.0, 'flow_min': None, 'flow_max': None, 'consumed': 0.0}
+    latest_part = None
+
+    for model, lo, hi in _plan(start, end):
+        if model is None:
+            queryset = _range(SensorReading.objects.filter(device_id=device_pk), 'timestamp', lo, hi)
+            part = queryset.aggregate(
+                count=Count('id'), flow_sum=Sum('flow_rate'),
+                flow_min=Min('flow_rate'), flow_max=Max('flow_rate'),
+                consumed=Sum('volume_delta'),
+            )
+        else:
+            queryset = _range(model.objects.filter(device_id=device_pk), 'bucket', lo, hi)
+            part = queryset.aggregate(
+                count=Sum('count'), flow_sum=Sum('flow_sum'),
+                flow_min=Min('flow_min'), flow_max=Max('flow_max'),
+                consumed=Sum('consumed'),
+            )
+        if not part['count']:
+            continue
+        totals['count'] += part['count']
+        totals['flow_sum'] += part['flow_sum']
+        totals['consumed'] += part['consumed']
+        totals['flow_min'] = part['flow_min'] if totals['flow_min'] is None else min(totals['flow_min'], part['flow_min'])
+        totals['flow_max'] = part['flow_max'] if totals['flow_max'] is None else max(totals['flow_max'], part['flow_max'])
+        latest_part = (model, queryset)
+
+    # Volumen acumulado al final del rango: última parte con datos
+    current_volume = 0
+    if latest_part is not None:
+        model, queryset = latest_part
+        if model is None:
+            current_volume = queryset.order_by('-timestamp').values_list('total_volume', flat=True).first()
+        else:
+            current_volume = queryset.order_by('-bucket').values_list('last_volume', flat=True).first()
+
+    return {
+        'count': totals['count'],
+        'avg_flow_rate': totals['flow_sum'] / totals['count'] if totals['count'] else None,
+        'min_flow_rate': totals['flow_min'],
+        'max_flow_rate': totals['flow_max'],
+        'current_volume': current_volume,
+        'consumed_volume': totals['consumed'],
+    }
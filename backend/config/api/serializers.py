@@ -1,10 +1,42 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Device, ValveControl, SensorReading
+from . import liveness
+from .models import DeviceAlert, Device, ValveControl, ValveSession, SensorReading
+
+
+class DeviceListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        devices = list(data.all() if hasattr(data, 'all') else data)
+        # Último contacto de todos con una sola lectura del caché
+        self.child.seen = liveness.last_seen_many(devices)
+        return super().to_representation(devices)
+
 
 class DeviceSerializer(serializers.ModelSerializer):
+    # Derivados de la actividad reciente (api.liveness), igual que fleet_status
+    is_online = serializers.SerializerMethodField()
+    last_seen = serializers.SerializerMethodField()
+
     class Meta:
         model = Device
-        fields = ['id', 'name', 'device_id', 'ip_address', 'is_online', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'device_id', 'ip_address', 'is_online', 'last_seen', 'created_at', 'updated_at']
+        list_serializer_class = DeviceListSerializer
+
+    def _seen(self, device):
+        seen = getattr(self, 'seen', None)
+        if seen is None or device.pk not in seen:
+            return liveness.last_seen(device)
+        return seen[device.pk]
+
+    def get_is_online(self, device):
+        return liveness.online(device, self._seen(device))
+
+    def get_last_seen(self, device):
+        seen = self._seen(device)
+        return serializers.DateTimeField().to_representation(seen) if seen else None
 
 
 class ValveControlSerializer(serializers.ModelSerializer):
@@ -15,9 +47,65 @@ class ValveControlSerializer(serializers.ModelSerializer):
         fields = ['id', 'device', 'device_name', 'status', 'timestamp', 'duration']
 
 
+class ValveControlCompactSerializer(serializers.ModelSerializer):
+    """Registro de válvula sin datos del dispositivo (van aparte en la respuesta compacta)"""
+
+    class Meta:
+        model = ValveControl
+        fields = ['id', 'device', 'status', 'timestamp', 'duration']
+
+
 class SensorReadingSerializer(serializers.ModelSerializer):
     device_name = serializers.CharField(source='device.name', read_only=True)
 
     class Meta:
         model = SensorReading
-        fields = ['id', 'device', 'device_name', 'flow_rate', 'total_volume', 'timestamp']
\ No newline at end of file
+        fields = ['id', 'device', 'device_name', 'flow_rate', 'total_volume', 'volume_delta', 'timestamp']
+        read_only_fields = ['volume_delta', 'timestamp']
+
+
+class SensorReadingCompactSerializer(serializers.ModelSerializer):
+    """Lectura sin datos del dispositivo (van aparte en la respuesta compacta)"""
+
+    class Meta:
+        model = SensorReading
+        fields = ['id', 'device', 'flow_rate', 'total_volume', 'timestamp']
+
+
+def reading_timestamp_error(timestamp):
+    """Motivo para rechazar la hora de una lectura enviada por el ESP32, o None.
+
+    Una lectura en el futuro quedaría como la última del dispositivo y las
+    siguientes se tomarían como desordenadas (sin consumo ni alertas).
+    """
+    now = timezone.now()
+    if timestamp > now + timedelta(seconds=settings.READING_MAX_CLOCK_SKEW):
+        return 'La hora de la lectura está en el futuro (¿reloj del ESP32 sin sincronizar?)'
+    if timestamp < now - timedelta(days=settings.READING_MAX_AGE_DAYS):
+        return f'La lectura tiene más de {settings.READING_MAX_AGE_DAYS} días'
+    return None
+
+
+class SensorReadingBatchItemSerializer(serializers.Serializer):
+    """Lectura individual dentro de un lote enviado por el ESP32"""
+    device_id = serializers.CharField(max_length=100)
+    flow_rate = serializers.FloatField()
+    total_volume = serializers.FloatField(default=0.0)
+    # Hora de la lectura según el dispositivo (opcional, por defecto la de recepción)
+    timestamp = serializers.DateTimeField(required=False)
+
+    def validate_timestamp(self, value):
+        error = reading_timestamp_error(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+class DeviceAlertSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeviceAlert
+        fields = ['id', 'device', 'kind', 'message', 'started_at', 'created_at', 'resolved_at']
+
+class ValveSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ValveSession
+        fields = ['id', 'device', 'opened_at', 'closed_at', 'duration', 'volume', 'readings']
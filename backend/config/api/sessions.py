@@ -0,0 +1,47 @@
+"""Sesiones de válvula: cuánto tiempo estuvo abierta y cuánta agua pasó.
+
+Cada cambio de estado reportado por el ESP32 cierra el intervalo anterior:
+rellena `duration` en la fila de ValveControl del cambio previo y, si la
+válvula se cierra, cierra la ValveSession abierta. Al abrirse se crea una
+sesión nueva. La ingesta (flow.process_readings) suma a la sesión abierta
+el consumo de cada lectura, así que el endpoint de sesiones solo lee filas
+ya calculadas.
+"""
+from django.db import transaction
+
+from .flow import locked_state
+from .models import ValveControl, ValveSession
+
+
+def valve_state_changed(device_pk, valve_state, control):
+    """Cerrar el intervalo anterior y abrir una sesión si `valve_state` es 'open'.
+
+    `control` es la fila de ValveControl recién creada para este cambio.
+    """
+    now = control.timestamp
+    with transaction.atomic():
+        state = locked_state(device_pk)
+
+        previous = state.valve_control
+        if previous is not None:
+            ValveControl.objects.filter(pk=previous.pk).update(
+                duration=_seconds(previous.timestamp, now)
+            )
+
+        session = state.valve_session
+        if session is not None:
+            ValveSession.objects.filter(pk=session.pk).update(
+                closed_at=now, duration=_seconds(session.opened_at, now)
+            )
+            session = None
+        if valve_state == 'open':
+            session = ValveSession.objects.create(device_id=device_pk, opened_at=now)
+
+        state.valve_session = session
+        state.valve_control = control
+        state.save(update_fields=['valve_session', 'valve_control'])
+    return session
+
+
+def _seconds(start, end):
+    return max(int((end - start).total_seconds()), 0)
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import registry, state_cache
+from .models import Device
+
+
+@receiver(post_delete, sender=Device)
+def forget_device_state(sender, instance, **kwargs):
+    """Eliminar del caché el estado de un dispositivo borrado"""
+    state_cache.invalidate(instance.pk)
+    registry.invalidate()
+
+
+@receiver(post_save, sender=Device)
+def bump_device_version(sender, instance, **kwargs):
+    """Un cambio del dispositivo (nombre, estado...) invalida sus ETags"""
+    state_cache.bump_version(instance.pk)
+    # device_id o nombre pueden haber cambiado
+    registry.invalidate()
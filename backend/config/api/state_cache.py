@@ -0,0 +1,252 @@
+"""Caché del último estado de cada dispositivo.
+
+Guarda la última lectura del sensor y el estado reportado de la válvula en
+el caché `state` de Django (memoria local por defecto; archivo o BD con
+STATE_CACHE_BACKEND para compartirlo entre procesos). La ingesta y
+report_valve_state lo escriben, y `latest`/`status` lo leen sin consultar
+la tabla de lecturas.
+
+También guarda una versión por dispositivo que suben las escrituras
+(lecturas, válvula, comandos) para calcular ETags sin consultar los datos.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import partitions
+from .models import SensorReading
+from .serializers import SensorReadingSerializer
+
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0}
+
+# Marca para dispositivos sin lecturas (evita repetir la consulta)
+NO_READING = {'timestamp': None, 'payload': None}
+
+
+def _cache():
+    return caches['state']
+
+
+def _reading_key(device_pk):
+    return f'latest-reading:{device_pk}'
+
+
+def _valve_key(device_pk):
+    return f'valve-state:{device_pk}'
+
+
+def _version_key(scope):
+    return f'version:{scope}'
+
+
+def _deadline_key(device_pk):
+    return f'command-deadline:{device_pk}'
+
+
+def _count(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def get_latest_reading(device_pk):
+    """Última lectura serializada del dispositivo, o None si no tiene"""
+    entry = _cache().get(_reading_key(device_pk))
+    if entry is not None:
+        _count('hits')
+        return entry['payload']
+
+    _count('misses')
+    readings = SensorReading.objects.filter(device_id=device_pk).select_related('device')
+    # Con particiones, primero solo la del mes en curso
+    reading = partitions.recent(readings).first() or readings.first()
+    if reading is None:
+        _cache().set(_reading_key(device_pk), NO_READING, None)
+        return None
+    payload = dict(SensorReadingSerializer(reading).data)
+    store_reading(device_pk, reading.timestamp, payload)
+    return payload
+
+
+def get_latest_readings(device_pks):
+    """Última lectura de varios dispositivos: {pk: payload o None}.
+
+    Una lectura del caché para todos y, para los que falten, una sola
+    consulta con ROW_NUMBER() por dispositivo.
+    """
+    cache = _cache()
+    entries = cache.get_many([_reading_key(pk) for pk in device_pks])
+    result = {}
+    missing = []
+    for pk in device_pks:
+        entry = entries.get(_reading_key(pk))
+        if entry is None:
+            missing.append(pk)
+        else:
+            result[pk] = entry['payload']
+    _count('hits', len(result))
+    _count('misses', len(missing))
+    if not missing:
+        return result
+
+    found = _latest_by_device(partitions.recent(SensorReading.objects.filter(device_id__in=missing)))
+    older = [pk for pk in missing if pk not in found]
+    if older:
+        found.update(_latest_by_device(SensorReading.objects.filter(device_id__in=older)))
+    entries = {}
+    for pk in missing:
+        reading = found.get(pk)
+        if reading is None:
+            result[pk] = None
+            entries[_reading_key(pk)] = NO_READING
+        else:
+            result[pk] = dict(SensorReadingSerializer(reading).data)
+            entries[_reading_key(pk)] = {'timestamp': reading.timestamp, 'payload': result[pk]}
+    cache.set_many(entries, None)
+    return result
+
+
+def _latest_by_device(readings):
+    latest = (
+        readings
+        .annotate(rank=Window(
+            RowNumber(),
+            partition_by=F('device_id'),
+            order_by=[F('timestamp').desc(), F('id').desc()],
+        ))
+        .filter(rank=1)
+        .select_related('device')
+    )
+    return {reading.device_id: reading for reading in latest}
+
+
+def store_reading(device_pk, timestamp, payload):
+    """Guardar una lectura si es más reciente que la que hay en caché"""
+    cache = _cache()
+    entry = cache.get(_reading_key(device_pk))
+    if entry is not None and entry['timestamp'] is not None and entry['timestamp'] > timestamp:
+        # Lectura atrasada (p. ej. un lote con datos offline)
+        return
+    cache.set(_reading_key(device_pk), {'timestamp': timestamp, 'payload': dict(payload)}, None)
+
+
+def get_valve_state(device):
+    """Estado de la válvula reportado por el ESP32"""
+    state = _cache().get(_valve_key(device.pk))
+    if state is not None:
+        _count('hits')
+        return state
+    _count('misses')
+    _cache().set(_valve_key(device.pk), device.current_valve_state, None)
+    return device.current_valve_state
+
+
+def get_valve_states(devices):
+    """Estado de la válvula de varios dispositivos: {pk: estado}"""
+    cache = _cache()
+    states = cache.get_many([_valve_key(device.pk) for device in devices])
+    result = {}
+    missing = {}
+    for device in devices:
+        state = states.get(_valve_key(device.pk))
+        if state is None:
+            state = missing[_valve_key(device.pk)] = device.current_valve_state
+        result[device.pk] = state
+    _count('hits', len(devices) - len(missing))
+    _count('misses', len(missing))
+    if missing:
+        cache.set_many(missing, None)
+    return result
+
+
+def store_valve_state(device_pk, state):
+    _cache().set(_valve_key(device_pk), state, None)
+
+
+def _incr(key, cache=None):
+    cache = cache or _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Sin versión previa (caché vaciado): empezar en un valor nuevo
+        # para no repetir una versión que un cliente ya tenga
+        if not cache.add(key, time.time_ns(), None):
+            cache.incr(key)
+
+
+def bump_version(device_pk, command_deadline=None):
+    """Marcar que cambiaron los datos del dispositivo (y de la flota).
+
+    `command_deadline` es la hora en que vence un comando pendiente: a
+    partir de ella el estado deseado cambia sin que nadie escriba.
+    """
+    _incr(_version_key(device_pk))
+    _incr(_version_key('fleet'))
+    if command_deadline is not None:
+        _cache().set(_deadline_key(device_pk), command_deadline, None)
+
+
+def bump_all_versions():
+    """Invalidar todas las versiones (tras tareas de mantenimiento sobre los datos)"""
+    _incr(_version_key('epoch'))
+
+
+def data_version(device_pk=None):
+    """Versión de los datos de un dispositivo, o de toda la flota sin device_pk"""
+    scope = 'fleet' if device_pk is None else device_pk
+    keys = [_version_key(scope), _version_key('epoch')]
+    if device_pk is not None:
+        keys.append(_deadline_key(device_pk))
+    values = _cache().get_many(keys)
+    for key in keys[:2]:
+        if key not in values:
+            _incr(key)
+            values[key] = _cache().get(key)
+    version = f"{values[keys[1]]}.{values[keys[0]]}"
+    deadline = values.get(keys[2]) if device_pk is not None else None
+    if deadline is not None and timezone.now() >= deadline:
+        version += '.expired'
+    return version
+
+
+def _shared_cache():
+    # El registro vive en cada proceso: su versión va en el caché compartido
+    # (BD), no en `state`, que por defecto es memoria local de cada proceso
+    return caches['default']
+
+
+def bump_registry_version():
+    """Invalidar el registro de dispositivos (api.registry) en todos los procesos"""
+    _incr(_version_key('registry'), _shared_cache())
+
+
+def registry_version():
+    key = _version_key('registry')
+    cache = _shared_cache()
+    version = cache.get(key)
+    if version is None:
+        _incr(key, cache)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(device_pk):
+    """Olvidar el estado del dispositivo (p. ej. al eliminarlo)"""
+    _cache().delete_many([_reading_key(device_pk), _valve_key(device_pk)])
+    _incr(_version_key('fleet'))
+
+
+def stats():
+    """Aciertos y fallos del caché en este proceso"""
+    with _lock:
+        hits, misses = _counters['hits'], _counters['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
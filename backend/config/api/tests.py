@@ -1,3 +1,1195 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+
+from config import urls as config_urls
+from . import (
+    benchmark, commands, conditional, db_writer, ingestion, liveness, metrics, partitions, registry, rollups,
+    state_cache, views, write_behind,
+)
+from . import urls as api_urls
+from .models import (
+    DayRollup, Device, DeviceAlert, DeviceCommand, MinuteRollup, SensorReading, ValveControl, ValveSession,
+)
+from .parsers import PackedReadingsParser, pack_readings
+from .views import report_valve_state
+
+
+class QueryCountTests(TestCase):
+    """Número de consultas por endpoint (regresiones N+1)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.devices = [
+            Device.objects.create(device_id=f'ESP32_{i:03d}', name=f'Sensor {i}', ip_address=f'192.168.1.{i + 10}')
+            for i in range(3)
+        ]
+        readings, controls = [], []
+        for device in cls.devices:
+            for i in range(40):
+                readings.append(SensorReading(
+                    device=device, flow_rate=1.5, total_volume=i,
+                    timestamp=now - timedelta(seconds=i),
+                ))
+                controls.append(ValveControl(
+                    device=device, status='open' if i % 2 else 'closed',
+                    timestamp=now - timedelta(seconds=i),
+                ))
+        SensorReading.objects.bulk_create(readings)
+        ValveControl.objects.bulk_create(controls)
+
+    def setUp(self):
+        caches['state'].clear()
+
+    def assertQueries(self, num, url):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_sensor_readings_list(self):
+        data = self.assertQueries(1, '/api/sensor-readings/?page_size=100')
+        self.assertEqual(len(data['results']), 100)
+        self.assertIn('device_name', data['results'][0])
+
+    def test_sensor_readings_list_compact(self):
+        data = self.assertQueries(2, '/api/sensor-readings/?page_size=100&compact=1')
+        self.assertNotIn('device_name', data['results'][0])
+        self.assertEqual(len(data['devices']), 3)
+
+    def test_sensor_reading_detail(self):
+        reading = SensorReading.objects.first()
+        self.assertQueries(1, f'/api/sensor-readings/{reading.pk}/')
+
+    def test_valve_controls_list(self):
+        data = self.assertQueries(1, '/api/valve-controls/?page_size=100')
+        self.assertEqual(len(data['results']), 100)
+
+    def test_valve_controls_by_device(self):
+        device = self.devices[0]
+        data = self.assertQueries(1, f'/api/valve-controls/by_device/?device_id={device.pk}')
+        self.assertEqual({row['device_name'] for row in data['results']}, {device.name})
+
+    def test_valve_controls_by_device_compact(self):
+        device = self.devices[0]
+        data = self.assertQueries(2, f'/api/valve-controls/by_device/?device_id={device.pk}&compact=1')
+        self.assertEqual(list(data['devices']), [str(device.pk)])
+
+    @override_settings(DEVICE_REGISTRY_CHECK_INTERVAL=60)
+    def test_device_lookup_is_cached(self):
+        url = f'/api/devices/get_pending_command/?device_id={self.devices[0].device_id}'
+        self.client.get(url)
+        # Solo la consulta de comandos pendientes: device_id -> pk sale del registro
+        self.assertQueries(1, url)
+
+    def test_latest_is_cached(self):
+        url = f'/api/sensor-readings/latest/?device_id={self.devices[0].pk}'
+        self.client.get(url)
+        self.assertQueries(0, url)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Con pocas filas PostgreSQL prefiere Seq Scan a los índices')
+class QueryPlanTests(TestCase):
+    """explain_queries: los endpoints de historial usan los índices (dispositivo, timestamp)"""
+
+    EXPECTED_INDEXES = {
+        'latest': 'api_reading_device_ts_idx',
+        'stats (7 días)': 'api_reading_device_ts_idx',
+        'by_device': 'api_valve_device_ts_idx',
+        'sensor-readings (lista)': 'api_reading_ts_idx',
+        'valve-controls (lista)': 'api_valve_ts_idx',
+        'setup_esp32 (últimas 5 lecturas)': 'api_reading_device_ts_idx',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        devices = [
+            Device.objects.create(device_id=f'ESP32_PLAN{i}', name=f'Plan {i}', ip_address=f'192.168.1.{i + 60}')
+            for i in range(3)
+        ]
+        cls.device = devices[0]
+        SensorReading.objects.bulk_create([
+            SensorReading(device=device, flow_rate=1.0, total_volume=i, timestamp=now - timedelta(minutes=i))
+            for device in devices for i in range(50)
+        ])
+        ValveControl.objects.bulk_create([
+            ValveControl(device=device, status='open', timestamp=now - timedelta(minutes=i))
+            for device in devices for i in range(50)
+        ])
+
+    def test_history_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command('explain_queries', device=self.device.pk, stdout=out)
+        sections = {}
+        for section in out.getvalue().split('\n▶ ')[1:]:
+            title, _, plan = section.partition('\n')
+            sections[title.split('  GET ')[0]] = plan
+        for name, index in self.EXPECTED_INDEXES.items():
+            self.assertIn(f'USING INDEX {index}', sections[name], name)
+        # Ningún recorrido completo de las tablas de series temporales
+        self.assertNotRegex(out.getvalue(), r'SCAN api_(sensorreading|valvecontrol)\b(?! USING)')
+
+
+class PackedReadingsTests(TestCase):
+    """Lotes binarios en /api/sensor-readings/batch/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = Device.objects.create(device_id='ESP32_BIN', name='Binario', ip_address='192.168.1.20')
+
+    def post(self, payload):
+        return self.client.post(
+            '/api/sensor-readings/batch/', payload, content_type=PackedReadingsParser.media_type
+        )
+
+    def test_creates_readings(self):
+        base = int(timezone.now().timestamp()) - 60
+        payload = pack_readings(self.device.pk, [(0, 5.25, 100.5), (5, 6.0, 101.0)], base_timestamp=base)
+        response = self.post(payload)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['created'], 2)
+        readings = list(SensorReading.objects.filter(device=self.device).order_by('timestamp'))
+        self.assertEqual([r.flow_rate for r in readings], [5.25, 6.0])
+        self.assertEqual((readings[1].timestamp - readings[0].timestamp).total_seconds(), 5)
+
+    def test_relative_offsets_without_clock(self):
+        response = self.post(pack_readings(self.device.pk, [(30, 1.0, 1.0), (0, 2.0, 2.0)]))
+        self.assertEqual(response.status_code, 201, response.content)
+        newest = SensorReading.objects.filter(device=self.device).first()
+        self.assertEqual(newest.flow_rate, 2.0)
+
+    def test_rejects_truncated_payload(self):
+        payload = pack_readings(self.device.pk, [(0, 1.0, 1.0)])
+        self.assertEqual(self.post(payload[:-1]).status_code, 400)
+
+    def test_unknown_device(self):
+        self.assertEqual(self.post(pack_readings(9999, [(0, 1.0, 1.0)])).status_code, 404)
+
+    def test_rejects_timestamps_out_of_bounds(self):
+        future = int((timezone.now() + timedelta(days=1)).timestamp())
+        self.assertEqual(self.post(pack_readings(self.device.pk, [(0, 1.0, 1.0)], base_timestamp=future)).status_code, 400)
+        # Reloj del ESP32 sin sincronizar (arranca en 1970)
+        self.assertEqual(self.post(pack_readings(self.device.pk, [(0, 1.0, 1.0)], base_timestamp=3600)).status_code, 400)
+        self.assertFalse(SensorReading.objects.filter(device=self.device).exists())
+
+
+@override_settings(DEVICE_REGISTRY_CHECK_INTERVAL=60)
+class JsonBatchTests(TestCase):
+    """Lotes JSON en /api/sensor-readings/batch/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = Device.objects.create(device_id='ESP32_LOTE', name='Lote', ip_address='192.168.1.21')
+
+    def setUp(self):
+        caches['state'].clear()
+
+    def post(self, readings):
+        return self.client.post('/api/sensor-readings/batch/', {'readings': readings}, content_type='application/json')
+
+    def reading(self, **values):
+        return {'device_id': self.device.device_id, 'flow_rate': 1.5, 'total_volume': 10.0, **values}
+
+    def test_all_valid(self):
+        # Todas en el mismo minuto: los agregados hacen una consulta por bucket
+        start = rollups.floor_bucket(timezone.now() - timedelta(minutes=2), timedelta(minutes=1))
+        readings = [
+            self.reading(total_volume=10.0 + i, timestamp=(start + timedelta(seconds=i)).isoformat())
+            for i in range(5)
+        ]
+        self.post(readings[:2])
+        # Estado de flujo (leer y guardar), inserción y un merge por nivel, dentro de un
+        # savepoint; el dispositivo sale del registro. No crece con el tamaño del lote
+        with self.assertNumQueries(8):
+            response = self.post(readings[2:])
+        self.assertEqual(response.status_code, 201, response.content)
+        data = response.json()
+        self.assertEqual((data['created'], data['errors']), (3, 0))
+        self.assertEqual([row['status'] for row in data['results']], ['created'] * 3)
+        self.assertEqual(SensorReading.objects.filter(device=self.device).count(), 5)
+
+    def test_mixed_batch(self):
+        future = (timezone.now() + timedelta(hours=1)).isoformat()
+        old = (timezone.now() - timedelta(days=365)).isoformat()
+        response = self.post([
+            self.reading(),
+            {'device_id': self.device.device_id},
+            self.reading(timestamp=future),
+            self.reading(timestamp=old),
+            self.reading(device_id='ESP32_NO_EXISTE'),
+        ])
+        self.assertEqual(response.status_code, 207, response.content)
+        data = response.json()
+        self.assertEqual((data['created'], data['errors']), (1, 4))
+        results = data['results']
+        self.assertEqual([row['status'] for row in results], ['created'] + ['error'] * 4)
+        self.assertIn('flow_rate', results[1]['errors'])
+        self.assertIn('timestamp', results[2]['errors'])
+        self.assertIn('timestamp', results[3]['errors'])
+        self.assertIn('device_id', results[4]['errors'])
+        self.assertEqual(SensorReading.objects.filter(device=self.device).count(), 1)
+
+    def test_all_invalid(self):
+        response = self.post([{'flow_rate': 'x'}, self.reading(device_id='ESP32_NO_EXISTE')])
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.json()['created'], 0)
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_unknown_device(self):
+        response = self.post([self.reading(device_id='ESP32_NO_EXISTE')])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('no encontrado', response.json()['results'][0]['errors']['device_id'][0])
+
+    def test_timestamp_defaults_to_now(self):
+        before = timezone.now()
+        response = self.post([self.reading()])
+        self.assertEqual(response.status_code, 201, response.content)
+        reading = SensorReading.objects.get(device=self.device)
+        self.assertGreaterEqual(reading.timestamp, before)
+        self.assertLessEqual(reading.timestamp, timezone.now())
+
+    def test_future_reading_does_not_pin_flow_state(self):
+        self.post([self.reading(total_volume=10.0)])
+        future = (timezone.now() + timedelta(days=30)).isoformat()
+        self.post([self.reading(total_volume=500.0, timestamp=future)])
+        self.post([self.reading(total_volume=12.0)])
+        latest = SensorReading.objects.filter(device=self.device).first()
+        self.assertEqual((latest.total_volume, latest.volume_delta), (12.0, 2.0))
+
+
+class HistoryPaginationTests(TestCase):
+    """Paginación por cursor (timestamp, id) de los historiales"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = Device.objects.create(device_id='ESP32_PAG', name='Páginas', ip_address='192.168.1.22')
+        now = timezone.now()
+        # Grupos de 5 lecturas con el mismo timestamp: los cortes de página caen dentro de un grupo
+        SensorReading.objects.bulk_create([
+            SensorReading(device=cls.device, flow_rate=1.0, total_volume=i, timestamp=now - timedelta(seconds=i // 5))
+            for i in range(23)
+        ])
+
+    def setUp(self):
+        caches['state'].clear()
+
+    def test_pages_have_no_duplicates_or_gaps(self):
+        expected = list(SensorReading.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        seen = []
+        url = f'/api/sensor-readings/?device_id={self.device.pk}&page_size=4'
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 4)
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor(self):
+        for cursor in ('no-es-base64!', base64.urlsafe_b64encode(b'ayer|uno').decode()):
+            response = self.client.get('/api/sensor-readings/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_invalid_device_id(self):
+        for url in (
+            '/api/sensor-readings/?device_id=abc',
+            '/api/sensor-readings/export/?device_id=abc',
+            '/api/valve-controls/?device_id=abc',
+            '/api/valve-controls/by_device/?device_id=abc',
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('device_id', response.json()['error'])
+
+
+class ExportTests(TestCase):
+    """Exportación CSV por streaming"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = Device.objects.create(device_id='ESP32_EXP', name='Export', ip_address='192.168.1.30')
+        now = timezone.now()
+        SensorReading.objects.bulk_create([
+            SensorReading(device=cls.device, flow_rate=i, total_volume=i * 2, timestamp=now - timedelta(minutes=i))
+            for i in range(25)
+        ])
+
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if response['Content-Type'] == 'application/gzip':
+            content = gzip.decompress(content)
+        return list(csv.reader(io.StringIO(content.decode())))
+
+    @override_settings(EXPORT_CHUNK_SIZE=10)
+    def test_csv_in_chronological_order(self):
+        rows = self.read_csv(self.client.get(f'/api/sensor-readings/export/?device_id={self.device.pk}'))
+        self.assertEqual(rows[0], ['id', 'device_id', 'timestamp', 'flow_rate', 'total_volume'])
+        self.assertEqual(len(rows), 26)
+        self.assertEqual([row[3] for row in rows[1:3]], ['24.0', '23.0'])
+
+    def test_gzip_and_date_filter(self):
+        start = (timezone.now() - timedelta(minutes=9, seconds=30)).isoformat()
+        response = self.client.get('/api/sensor-readings/export/', {'compress': 'gzip', 'start_date': start})
+        self.assertEqual(len(self.read_csv(response)), 11)
+
+
+class FlowProcessingTests(TestCase):
+    """Consumo por lectura con reinicios del contador y alertas de fuga"""
+
+    def setUp(self):
+        caches['state'].clear()
+        self.device = Device.objects.create(
+            device_id='ESP32_FLOW', name='Flujo', ip_address='192.168.1.40', current_valve_state='closed'
+        )
+
+    def post_batch(self, readings):
+        start = timezone.now() - timedelta(minutes=30)
+        items = [
+            {'device_id': 'ESP32_FLOW', 'flow_rate': flow, 'total_volume': volume,
+             'timestamp': (start + timedelta(minutes=minute)).isoformat()}
+            for minute, flow, volume in readings
+        ]
+        response = self.client.post('/api/sensor-readings/batch/', {'readings': items}, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_consumed_volume_across_counter_reset(self):
+        self.post_batch([(0, 0, 10.0), (1, 0, 11.0), (2, 0, 12.5)])
+        # El ESP32 se reinició: el contador vuelve a empezar
+        self.post_batch([(3, 0, 0.5), (4, 0, 2.0)])
+        deltas = list(SensorReading.objects.order_by('timestamp').values_list('volume_delta', flat=True))
+        self.assertEqual(deltas, [0.0, 1.0, 1.5, 0.5, 1.5])
+        stats = self.client.get(f'/api/sensor-readings/stats/?device_id={self.device.pk}').json()
+        self.assertEqual(stats['consumed_volume'], 4.5)
+
+    @override_settings(LEAK_ALERT_AFTER=120)
+    def test_leak_alert_raised_and_resolved(self):
+        self.post_batch([(0, 2.0, 1.0), (1, 2.0, 3.0)])
+        self.assertFalse(DeviceAlert.objects.exists())
+        self.post_batch([(2, 2.0, 5.0), (3, 0.0, 5.0)])
+        alert = DeviceAlert.objects.get()
+        self.assertEqual(alert.kind, 'leak')
+        self.assertIsNotNone(alert.resolved_at)
+        active = self.client.get(f'/api/devices/{self.device.pk}/alerts/?active=1').json()
+        self.assertEqual(active['results'], [])
+
+
+class CommandQueueTests(TestCase):
+    """Cola de comandos: entrega atómica y parámetro ?wait= del long-polling"""
+
+    def setUp(self):
+        self.device = Device.objects.create(device_id='ESP32_CMD', name='Cmd', ip_address='192.168.1.46')
+
+    def test_invalid_wait_rejected(self):
+        for wait in ('nan', 'inf', '-inf', 'abc'):
+            response = self.client.get(f'/api/devices/get_pending_command/?device_id=ESP32_CMD&wait={wait}')
+            self.assertEqual(response.status_code, 400, wait)
+        # Negativo: sin espera
+        response = self.client.get('/api/devices/get_pending_command/?device_id=ESP32_CMD&wait=-5')
+        self.assertEqual(response.json()['command'], 'none')
+
+    async def test_claim_delivers_once(self):
+        command = await sync_to_async(commands.enqueue)(self.device, 'open')
+        # Las dos consultas ven el mismo pendiente; solo un UPDATE condicional lo gana
+        first, second = await asyncio.gather(
+            commands.aclaim_next(self.device.pk), commands.aclaim_next(self.device.pk)
+        )
+        claimed = [c for c in (first, second) if c is not None]
+        self.assertEqual([c.pk for c in claimed], [command.pk])
+        await command.arefresh_from_db()
+        self.assertEqual(command.status, 'delivered')
+
+    def test_delivered_command_expires(self):
+        command = commands.enqueue(self.device, 'open')
+        async_to_sync(commands.aclaim_next)(self.device.pk)
+        self.assertEqual(commands.desired_state(self.device), 'open')
+
+        # Sin confirmación durante COMMAND_TTL: deja de ser el estado deseado
+        DeviceCommand.objects.filter(pk=command.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(commands.desired_state(self.device), 'none')
+        annotated = Device.objects.annotate(desired=commands.desired_state_annotation()).get(pk=self.device.pk)
+        self.assertEqual(annotated.desired, 'none')
+        commands.enqueue(self.device, 'closed')
+        command.refresh_from_db()
+        self.assertEqual(command.status, 'expired')
+
+    def test_report_supersedes_delivered_command(self):
+        command = commands.enqueue(self.device, 'open')
+        async_to_sync(commands.aclaim_next)(self.device.pk)
+        # El ESP32 reporta el estado contrario: el comando entregado queda superado
+        commands.acknowledge(self.device.pk, 'closed')
+        command.refresh_from_db()
+        self.assertEqual(command.status, 'expired')
+        self.assertEqual(commands.desired_state(self.device), 'none')
+
+
+class ValveSessionTests(TestCase):
+    """Sesiones de válvula abierta cerradas por los reportes del ESP32"""
+
+    def setUp(self):
+        caches['state'].clear()
+        self.device = Device.objects.create(
+            device_id='ESP32_SESSION', name='Sesión', ip_address='192.168.1.45', current_valve_state='closed'
+        )
+
+    def report(self, valve_state):
+        response = self.client.post('/api/devices/report_valve_state/', {
+            'device_id': 'ESP32_SESSION', 'valve_state': valve_state,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def post_reading(self, total_volume):
+        response = self.client.post('/api/sensor-readings/', {
+            'device_id': 'ESP32_SESSION', 'flow_rate': 3.0, 'total_volume': total_volume,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_session_volume_and_durations(self):
+        self.post_reading(10.0)
+        self.report('open')
+        # Repetir el estado no abre otra sesión
+        self.report('open')
+        self.post_reading(12.0)
+        self.post_reading(15.5)
+        self.report('closed')
+        self.post_reading(16.0)
+
+        session = ValveSession.objects.get()
+        self.assertIsNotNone(session.closed_at)
+        self.assertIsNotNone(session.duration)
+        self.assertEqual((session.volume, session.readings), (5.5, 2))
+        durations = list(ValveControl.objects.order_by('id').values_list('duration', flat=True))
+        self.assertIsNotNone(durations[0])
+        self.assertEqual(durations[-1], None)
+
+        data = self.client.get(f'/api/devices/{self.device.pk}/sessions/').json()
+        self.assertEqual([row['volume'] for row in data['results']], [5.5])
+        data = self.client.get(f'/api/devices/{self.device.pk}/sessions/?open=1').json()
+        self.assertEqual(data['results'], [])
+
+
+class FleetStatusTests(TestCase):
+    """Estado de toda la flota en /api/devices/fleet_status/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.devices = [
+            Device.objects.create(device_id=f'ESP32_F{i}', name=f'Flota {i}', ip_address=f'192.168.2.{i + 1}')
+            for i in range(5)
+        ]
+        SensorReading.objects.bulk_create([
+            SensorReading(device=device, flow_rate=i, total_volume=10 * i + n, timestamp=timezone.now() - timedelta(minutes=n))
+            for i, device in enumerate(cls.devices[:4]) for n in range(3)
+        ])
+
+    def setUp(self):
+        caches['state'].clear()
+        # El barrido de liveness está limitado en el tiempo: que no cuente aquí
+        liveness.sweep(force=True)
+
+    def test_latest_reading_per_device(self):
+        # Caché vacío: dispositivos + lecturas con una consulta de ventana
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/devices/fleet_status/')
+        rows = {row['device_id']: row for row in response.json()['devices']}
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows['ESP32_F2']['total_volume'], 20)
+        self.assertIsNone(rows['ESP32_F4']['reading_timestamp'])
+        self.assertEqual(rows['ESP32_F0']['desired_valve_state'], 'none')
+
+        # Con el caché caliente solo se consulta la tabla de dispositivos
+        with self.assertNumQueries(1):
+            self.client.get('/api/devices/fleet_status/')
+
+    def test_etag_not_modified(self):
+        response = self.client.get('/api/devices/fleet_status/')
+        etag = response['ETag']
+        response = self.client.get('/api/devices/fleet_status/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        SensorReading.objects.create(device=self.devices[4], flow_rate=1, total_volume=1)
+        caches['state'].clear()
+        response = self.client.get('/api/devices/fleet_status/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(DEVICE_REGISTRY_CHECK_INTERVAL=0)
+class RegistryTests(TestCase):
+    """Registro device_id -> dispositivo: invalidación al guardar o eliminar"""
+
+    def setUp(self):
+        self.device = Device.objects.create(device_id='ESP32_REG', name='Registro', ip_address='192.168.1.97')
+        self.assertEqual(registry.lookup('ESP32_REG').name, 'Registro')
+
+    def test_save_and_delete_invalidate(self):
+        self.device.name = 'Renombrado'
+        self.device.save()
+        self.assertEqual(registry.lookup('ESP32_REG').name, 'Renombrado')
+        self.device.delete()
+        self.assertIsNone(registry.lookup('ESP32_REG'))
+
+    def test_change_in_other_process(self):
+        # Otro proceso guarda el dispositivo: su señal sube la versión compartida
+        Device.objects.filter(pk=self.device.pk).update(name='Otro proceso')
+        with self.assertNumQueries(1):
+            self.assertEqual(registry.lookup('ESP32_REG').name, 'Registro')
+        state_cache.bump_registry_version()
+        self.assertEqual(registry.lookup('ESP32_REG').name, 'Otro proceso')
+        # La versión no está en el caché de estado (memoria de cada proceso)
+        self.assertIsNone(caches['state'].get('version:registry'))
+
+    def test_shared_cache_table_created_by_migration(self):
+        # Sin la tabla que crea `createcachetable` en los tests: la tiene que crear `migrate`
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE api_shared_cache')
+        migration = importlib.import_module('api.migrations.0015_shared_cache_table')
+        migration.create_shared_cache_table(None, mock.Mock(connection=connection))
+        version = state_cache.registry_version()
+        self.client.post('/api/devices/', {
+            'device_id': 'ESP32_NUEVO', 'name': 'Nuevo', 'ip_address': '192.168.1.98',
+        }, content_type='application/json')
+        self.assertGreater(caches['default'].get('version:registry'), version)
+        response = self.client.get('/api/devices/get_pending_command/?device_id=ESP32_NUEVO')
+        self.assertEqual(response.status_code, 200, response.content)
+
+
+class LivenessTests(TestCase):
+    """Actividad de los dispositivos: caché en cada contacto, BD solo en las transiciones"""
+
+    def setUp(self):
+        caches['state'].clear()
+        self.device = Device.objects.create(device_id='ESP32_LIVE', name='Live', ip_address='192.168.1.47')
+
+    @override_settings(DEVICE_LIVENESS_FLUSH_INTERVAL=0)
+    def test_row_written_only_on_transitions(self):
+        liveness.touch([self.device.pk])
+        self.device.refresh_from_db()
+        self.assertTrue(self.device.is_online)
+        first_seen = self.device.last_seen
+
+        with CaptureQueriesContext(connection) as queries:
+            liveness.touch([self.device.pk])
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE')])
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.last_seen, first_seen)
+
+        with override_settings(DEVICE_OFFLINE_AFTER=0):
+            self.assertEqual(liveness.sweep(force=True), 1)
+        self.device.refresh_from_db()
+        self.assertFalse(self.device.is_online)
+
+    def test_endpoints_agree(self):
+        liveness.touch([self.device.pk])
+        # La fila puede ir por detrás: todos los endpoints usan api.liveness
+        Device.objects.filter(pk=self.device.pk).update(is_online=False, last_seen=None)
+        status_data = self.client.get(f'/api/devices/{self.device.pk}/status/').json()
+        detail = self.client.get(f'/api/devices/{self.device.pk}/').json()
+        listed = self.client.get('/api/devices/').json()['results'][0]
+        fleet = self.client.get('/api/devices/fleet_status/').json()['devices'][0]
+        self.assertEqual(
+            [status_data['is_online'], detail['is_online'], listed['is_online'], fleet['is_online']],
+            [True] * 4,
+        )
+        self.assertIsNotNone(detail['last_seen'])
+
+
+@override_settings(CONDITIONAL_GET=True)
+class ConditionalGetTests(TestCase):
+    """ETag / 304 en los endpoints de lectura"""
+
+    def setUp(self):
+        caches['state'].clear()
+        self.device = Device.objects.create(device_id='ESP32_ETAG', name='ETag', ip_address='192.168.1.50')
+        self.post_reading(1.0)
+
+    def post_reading(self, flow_rate):
+        response = self.client.post('/api/sensor-readings/', {
+            'device_id': 'ESP32_ETAG', 'flow_rate': flow_rate, 'total_volume': 10,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def get_twice(self, url):
+        """Devuelve la segunda respuesta, enviando el ETag de la primera"""
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        return first, self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_not_modified_without_queries(self):
+        for url in (
+            f'/api/sensor-readings/latest/?device_id={self.device.pk}',
+            f'/api/sensor-readings/stats/?device_id={self.device.pk}',
+            f'/api/valve-controls/by_device/?device_id={self.device.pk}',
+            f'/api/sensor-readings/?device_id={self.device.pk}',
+        ):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_new_reading_changes_etag(self):
+        url = f'/api/sensor-readings/latest/?device_id={self.device.pk}'
+        first, second = self.get_twice(url)
+        self.assertEqual(second.status_code, 304)
+        self.post_reading(2.0)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['flow_rate'], 2.0)
+
+    def test_command_changes_status(self):
+        url = f'/api/devices/{self.device.pk}/status/'
+        first, second = self.get_twice(url)
+        self.assertEqual(second.status_code, 304)
+        self.client.post(f'/api/devices/{self.device.pk}/open_valve/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.json()['desired_valve_state'], 'open')
+
+    def test_valve_report_changes_etag(self):
+        urls = (f'/api/devices/{self.device.pk}/status/', f'/api/valve-controls/by_device/?device_id={self.device.pk}')
+        etags = {}
+        for url in urls:
+            first, second = self.get_twice(url)
+            self.assertEqual(second.status_code, 304)
+            etags[url] = first['ETag']
+        response = self.client.post('/api/devices/report_valve_state/', {
+            'device_id': 'ESP32_ETAG', 'valve_state': 'open',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[urls[0]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['current_valve_state'], 'open')
+        response = self.client.get(urls[1], HTTP_IF_NONE_MATCH=etags[urls[1]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    @override_settings(CONDITIONAL_GET=False)
+    def test_disabled_with_process_local_versions(self):
+        url = f'/api/sensor-readings/latest/?device_id={self.device.pk}'
+        with self.settings(CONDITIONAL_GET=True):
+            etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        # fleet_status calcula el ETag a partir del contenido: sigue siendo válido
+        etag = self.client.get('/api/devices/fleet_status/')['ETag']
+        self.assertEqual(self.client.get('/api/devices/fleet_status/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_not_modified_ratio(self):
+        before = conditional.stats()
+        self.get_twice(f'/api/sensor-readings/latest/?device_id={self.device.pk}')
+        after = conditional.stats()
+        self.assertEqual(after['responses'] - before['responses'], 2)
+        self.assertEqual(after['not_modified'] - before['not_modified'], 1)
+        self.assertIn('conditional_get', self.client.get('/api/devices/cache_stats/').json())
+
+
+class BenchmarkTests(TestCase):
+    """Simulador de flota: errores y hilos caídos cuentan en los resultados"""
+
+    class Transport:
+        name = 'prueba'
+
+        def request(self, method, path, data=None):
+            if path == '/bloqueada':
+                raise OperationalError('database is locked')
+            return 200, {}, 1
+
+        def close(self):
+            pass
+
+    class Actor:
+        interval = 0.02
+
+        def __init__(self, endpoint, path):
+            self.endpoint, self.path = endpoint, path
+
+        def step(self, call):
+            call(self.endpoint, 'GET', self.path)
+
+    class Broken:
+        interval = 0.02
+
+        def step(self, call):
+            raise RuntimeError('fallo del actor')
+
+    def test_error_accounting(self):
+        actors = [self.Actor('ok', '/ok'), self.Actor('bloqueada', '/bloqueada')]
+        recorder, elapsed = benchmark.run(actors, self.Transport(), duration=0.2, concurrency=2)
+        rows = recorder.summary(elapsed)
+        self.assertEqual(rows['ok']['errors'], 0)
+        self.assertGreater(rows['bloqueada']['requests'], 0)
+        self.assertEqual(rows['bloqueada']['errors'], rows['bloqueada']['requests'])
+        self.assertEqual(recorder.aborted, [])
+
+        recorder, _ = benchmark.run([self.Broken()], self.Transport(), duration=0.2, concurrency=2)
+        self.assertTrue(recorder.aborted)
+        self.assertIn('RuntimeError: fallo del actor', recorder.aborted[0][1])
+
+    def test_in_process_exception_is_500(self):
+        Device.objects.create(device_id='ESP32_BENCH', name='Bench', ip_address='192.168.1.94')
+        with mock.patch('api.views.ingest_readings', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('django.request', 'ERROR'):
+            status_code, _, _ = benchmark.InProcessTransport().request('POST', '/api/sensor-readings/', {
+                'device_id': 'ESP32_BENCH', 'flow_rate': 1.0, 'total_volume': 1.0,
+            })
+        self.assertEqual(status_code, 500)
+
+
+class MetricsTests(TestCase):
+    """Endpoint /metrics e instrumentación por vista"""
+
+    def setUp(self):
+        metrics.registry = metrics.Registry()
+        self.device = Device.objects.create(device_id='ESP32_METRICS', name='Métricas', ip_address='192.168.1.60')
+
+    def post_reading(self):
+        response = self.client.post('/api/sensor-readings/', {
+            'device_id': 'ESP32_METRICS', 'flow_rate': 1.5, 'total_volume': 10,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_request_and_ingestion_metrics(self):
+        self.post_reading()
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{view="sensorreading-list",method="POST",status="201"} 1', body
+        )
+        self.assertIn(f'sensor_readings_ingested_total{{device="{self.device.pk}"}} 1', body)
+        # La ingesta hace consultas y se cuentan en la petición
+        self.assertNotIn('http_request_db_queries_bucket{view="sensorreading-list",le="0"} 1', body)
+        self.assertIn('http_request_db_queries_count{view="sensorreading-list"} 1', body)
+
+    @override_settings(METRICS_TOKEN='secreto')
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(response.status_code, 200)
+
+    def test_aggregates_process_files(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.post_reading()
+            metrics.flush(force=True)
+            # Otro worker con sus propias lecturas
+            other = metrics.Registry()
+            other.inc('sensor_readings_ingested_total', metrics.labels(device=self.device.pk), 4)
+            with open(f'{directory}/1.json', 'w') as snapshot_file:
+                json.dump(other.snapshot(), snapshot_file)
+            body = self.client.get('/metrics').content.decode()
+        self.assertIn(f'sensor_readings_ingested_total{{device="{self.device.pk}"}} 5', body)
+
+    def test_large_values_keep_precision(self):
+        metrics.inc('sensor_readings_ingested_total', 123456789, device=self.device.pk)
+        metrics.observe('http_request_duration_seconds', 1234.5678901, view='x', method='GET', status='200')
+        body = metrics.render()
+        self.assertIn(f'sensor_readings_ingested_total{{device="{self.device.pk}"}} 123456789.0\n', body)
+        self.assertIn('http_request_duration_seconds_sum{view="x",method="GET",status="200"} 1234.5678901\n', body)
+
+
+def reload_urls():
+    """Volver a construir las URLs tras cambiar ASYNC_DEVICE_VIEWS"""
+    importlib.reload(api_urls)
+    importlib.reload(config_urls)
+    clear_url_caches()
+
+
+@override_settings(ASYNC_DEVICE_VIEWS=True)
+class AsyncDeviceViewsTests(TestCase):
+    """Vistas async de los ESP32 y su vuelta a DRF para el resto de peticiones"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        reload_urls()
+        cls.addClassCleanup(reload_urls)
+
+    def setUp(self):
+        self.device = Device.objects.create(device_id='ESP32_ASYNC', name='Async', ip_address='192.168.1.70')
+
+    async def test_report_valve_state_acknowledges_command(self):
+        command = await sync_to_async(commands.enqueue)(self.device, 'closed')
+        await DeviceCommand.objects.filter(pk=command.pk).aupdate(status='delivered')
+        self.assertIs(resolve('/api/devices/report_valve_state/').func, report_valve_state)
+        response = await self.async_client.post('/api/devices/report_valve_state/', {
+            'device_id': 'ESP32_ASYNC', 'valve_state': 'closed',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        await command.arefresh_from_db()
+        self.assertEqual(command.status, 'acked')
+        await self.device.arefresh_from_db()
+        self.assertEqual(self.device.current_valve_state, 'closed')
+        self.assertEqual(await ValveControl.objects.filter(device=self.device).acount(), 1)
+
+    async def test_unknown_device(self):
+        response = await self.async_client.post('/api/devices/report_valve_state/', {
+            'device_id': 'NO_EXISTE', 'valve_state': 'open',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_other_requests_use_viewset(self):
+        # Formulario y `device` en lugar de device_id: los atiende DRF
+        response = await self.async_client.post('/api/sensor-readings/', {
+            'device': self.device.pk, 'flow_rate': 2.5,
+        })
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.get('/api/sensor-readings/')
+        self.assertEqual(len(response.json()['results']), 1)
+
+    async def test_stream_requires_asgi(self):
+        # Con WSGI no se abre el stream: el frontend vuelve al polling
+        response = await sync_to_async(self.client.get)('/api/stream/')
+        self.assertEqual(response.status_code, 501)
+
+        response = await self.async_client.get('/api/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = aiter(response.streaming_content)
+        self.assertTrue((await anext(content)).startswith(b'retry:'))
+        await content.aclose()
+
+
+@override_settings(INGEST_WRITE_BEHIND=True, INGEST_FLUSH_INTERVAL=0.5)
+class WriteBehindTests(TestCase):
+    """Ingesta diferida con spool local"""
+
+    def setUp(self):
+        caches['state'].clear()
+        self.device = Device.objects.create(device_id='ESP32_WB', name='Buffer', ip_address='192.168.1.80')
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.spool_dir = spool.name
+        # Sin hilo de volcado: las pruebas vuelcan a mano
+        self.buffer = write_behind.WriteBehindBuffer(self.spool_dir, max_rows=2, flush_rows=100, flush_interval=60)
+        self.buffer.open()
+        write_behind._buffer = self.buffer
+
+    def tearDown(self):
+        write_behind._buffer = None
+        self.buffer._spool[1].close()
+
+    def post_reading(self, total_volume):
+        return self.client.post('/api/sensor-readings/', {
+            'device_id': 'ESP32_WB', 'flow_rate': 1.0, 'total_volume': total_volume,
+        }, content_type='application/json')
+
+    def test_acknowledged_before_insert(self):
+        self.assertEqual(self.post_reading(10).status_code, 201)
+        self.assertEqual(self.post_reading(12).status_code, 201)
+        self.assertFalse(SensorReading.objects.exists())
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            list(SensorReading.objects.order_by('timestamp').values_list('volume_delta', flat=True)), [0.0, 2.0]
+        )
+        # Solo queda el spool activo, vacío
+        [name] = os.listdir(self.spool_dir)
+        self.assertEqual(os.path.getsize(os.path.join(self.spool_dir, name)), 0)
+
+    def test_full_buffer_returns_429(self):
+        self.post_reading(10)
+        self.post_reading(11)
+        response = self.post_reading(12)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_recovers_orphan_spool(self):
+        reading = SensorReading(device=self.device, flow_rate=1.0, total_volume=5.0)
+        with open(os.path.join(self.spool_dir, '999999-0.flushing'), 'w') as spool_file:
+            # La última línea quedó a medias al caer el proceso
+            spool_file.write(write_behind._encode(reading) + '{"device": ')
+        self.assertEqual(self.buffer.recover(), 1)
+        self.assertEqual(SensorReading.objects.get().total_volume, 5.0)
+        self.assertEqual(len(os.listdir(self.spool_dir)), 1)
+
+
+class SeriesTests(TestCase):
+    """Serie reducida para gráficas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = Device.objects.create(device_id='ESP32_SERIE', name='Serie', ip_address='192.168.1.90')
+        cls.end = timezone.now().replace(second=0, microsecond=0)
+        cls.start = cls.end - timedelta(hours=10)
+        # Una lectura por minuto durante 10 horas, con un pico de 50 L/min
+        readings = [
+            SensorReading(
+                device=cls.device, flow_rate=50.0 if i == 300 else 2.0 + i % 3, total_volume=i,
+                timestamp=cls.start + timedelta(minutes=i),
+            )
+            for i in range(600)
+        ]
+        rollups.update_rollups(SensorReading.objects.bulk_create(readings))
+
+    def get_series(self, **params):
+        response = self.client.get('/api/sensor-readings/series/', {
+            'device_id': self.device.pk,
+            'start_date': self.start.isoformat(),
+            'end_date': self.end.isoformat(),
+            **params,
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_lttb_keeps_ends_and_peak(self):
+        data = self.get_series(points=100)
+        self.assertEqual(data['source'], 'minute')
+        self.assertEqual(len(data['timestamps']), 100)
+        self.assertEqual(data['timestamps'][0], int(self.start.timestamp() * 1000))
+        self.assertEqual(data['total_volume'][-1], 599)
+        self.assertIn(50.0, data['flow_rate'])
+
+    def test_minmax_from_rollups(self):
+        data = self.get_series(points=8, method='minmax')
+        # 10 horas / 8 puntos: basta con los agregados por hora
+        self.assertEqual(data['source'], 'hour')
+        self.assertLessEqual(len(data['timestamps']), 8)
+        self.assertEqual(max(data['flow_rate']), 50.0)
+        self.assertEqual(min(data['flow_rate']), 2.0)
+
+    def test_short_range_uses_raw_readings(self):
+        data = self.get_series(points=1000)
+        self.assertEqual(data['source'], 'raw')
+        self.assertEqual(len(data['timestamps']), 600)
+
+    def test_invalid_points(self):
+        response = self.client.get('/api/sensor-readings/series/', {'device_id': self.device.pk, 'points': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RollupRebuildTests(TestCase):
+    """rebuild_rollups: agregados iguales a las lecturas crudas sin perder los días podados"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = Device.objects.create(device_id='ESP32_ROLLUP', name='Rollup', ip_address='192.168.1.95')
+        cls.first_day = rollups.floor_bucket(timezone.now(), rollups.DAY) - 3 * rollups.DAY
+        # Tres días con una lectura cada 30 minutos y sin agregados (datos anteriores a 0007)
+        SensorReading.objects.bulk_create([
+            SensorReading(
+                device=cls.device, flow_rate=1.0 + i % 5, total_volume=i * 0.5, volume_delta=0.5,
+                timestamp=cls.first_day + timedelta(minutes=30 * i),
+            )
+            for i in range(144)
+        ])
+
+    def rebuild(self):
+        call_command('rebuild_rollups', stdout=io.StringIO())
+
+    def assertMatchesRaw(self, start):
+        readings = SensorReading.objects.filter(device=self.device, timestamp__gte=start)
+        for model, size in rollups.LEVELS:
+            expected = {}
+            for reading in readings:
+                bucket = rollups.floor_bucket(reading.timestamp, size)
+                count, flow_sum, consumed = expected.get(bucket, (0, 0.0, 0.0))
+                expected[bucket] = (count + 1, flow_sum + reading.flow_rate, consumed + reading.volume_delta)
+            actual = {
+                row.bucket: (row.count, row.flow_sum, row.consumed)
+                for row in model.objects.filter(device=self.device, bucket__gte=start)
+            }
+            self.assertEqual(actual, expected, model.__name__)
+
+    def test_rebuild_matches_raw(self):
+        self.rebuild()
+        self.assertMatchesRaw(self.first_day)
+        stats = rollups.summarize(self.device.pk)
+        self.assertEqual((stats['count'], stats['consumed_volume']), (144, 72.0))
+
+    def test_migration_backfills_deltas_before_rollups(self):
+        # Lecturas anteriores a 0010: volume_delta en 0 y un reinicio del contador
+        device = Device.objects.create(device_id='ESP32_OLD', name='Antiguo', ip_address='192.168.1.96')
+        day = self.first_day
+        SensorReading.objects.bulk_create([
+            SensorReading(device=device, flow_rate=1.0, total_volume=volume, timestamp=day + timedelta(minutes=i))
+            for i, volume in enumerate([1.0, 3.0, 2.995, 0.5, 2.0])
+        ])
+        migration = importlib.import_module('api.migrations.0014_backfill_rollups')
+        migration.backfill_deltas(django_apps, None)
+        migration.backfill_rollups(django_apps, None)
+        deltas = list(SensorReading.objects.filter(device=device).order_by('timestamp').values_list('volume_delta', flat=True))
+        self.assertEqual(deltas, [0.0, 2.0, 0.0, 0.5, 1.5])
+        self.assertEqual(DayRollup.objects.get(device=device, bucket=day).consumed, 4.0)
+
+    def test_rebuild_keeps_pruned_days(self):
+        self.rebuild()
+        # Podar el primer día: solo queda en sus agregados
+        SensorReading.objects.filter(timestamp__lt=self.first_day + rollups.DAY).delete()
+        self.rebuild()
+        self.assertEqual(DayRollup.objects.get(device=self.device, bucket=self.first_day).count, 48)
+        self.assertEqual(MinuteRollup.objects.filter(device=self.device, bucket__lt=self.first_day + rollups.DAY).count(), 48)
+        self.assertMatchesRaw(self.first_day + rollups.DAY)
+        self.assertEqual(rollups.summarize(self.device.pk)['count'], 144)
+
+
+class PruneReadingsTests(TestCase):
+    """prune_readings calcula los agregados que faltan antes de eliminar"""
+
+    def test_prune_builds_missing_rollups(self):
+        device = Device.objects.create(device_id='ESP32_PRUNE', name='Poda', ip_address='192.168.1.96')
+        old_day = rollups.floor_bucket(timezone.now(), rollups.DAY) - 100 * rollups.DAY
+        recent = timezone.now() - timedelta(hours=1)
+        # Lecturas antiguas sin agregados y una reciente con ellos
+        SensorReading.objects.bulk_create([
+            SensorReading(device=device, flow_rate=2.0, total_volume=i, volume_delta=1.0,
+                          timestamp=old_day + timedelta(hours=i))
+            for i in range(30)
+        ])
+        rollups.update_rollups(SensorReading.objects.bulk_create([
+            SensorReading(device=device, flow_rate=4.0, total_volume=30, volume_delta=1.0, timestamp=recent),
+        ]))
+
+        call_command('prune_readings', '--days', '90', '--no-archive', stdout=io.StringIO())
+
+        self.assertEqual(SensorReading.objects.filter(device=device).count(), 1)
+        self.assertEqual(
+            list(DayRollup.objects.filter(device=device, bucket__lt=recent - rollups.DAY).values_list('count', flat=True)),
+            [6, 24],
+        )
+        stats = rollups.summarize(device.pk)
+        self.assertEqual((stats['count'], stats['consumed_volume'], stats['max_flow_rate']), (31, 31.0, 4.0))
+
+
+class PartitionTests(TestCase):
+    """Particiones mensuales: límites de los meses y tabla normal fuera de PostgreSQL"""
+
+    def test_month_bounds(self):
+        start = partitions.month_start(datetime(2025, 12, 31, 23, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.partition_name(start), 'api_sensorreading_p202512')
+        self.assertEqual(partitions.add_months(start, 1), datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.add_months(start, -12).year, 2024)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Comprueba la tabla normal fuera de PostgreSQL')
+    @override_settings(READING_PARTITIONS=True)
+    def test_plain_table_on_sqlite(self):
+        self.assertFalse(partitions.enabled())
+        with self.assertNumQueries(0):
+            self.assertIsNone(partitions.recent(SensorReading.objects.all()).first())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Las particiones solo existen en PostgreSQL')
+@override_settings(READING_PARTITIONS=True)
+class PostgresPartitionTests(TestCase):
+    """Conversión, meses por adelantado, poda por partición y vuelta atrás de 0012"""
+
+    def test_partition_prune_and_revert(self):
+        device = Device.objects.create(device_id='ESP32_PG', name='Particiones', ip_address='192.168.1.98')
+        current = partitions.month_start(timezone.now())
+        old = partitions.add_months(current, -3)
+        SensorReading.objects.bulk_create(
+            [SensorReading(device=device, flow_rate=1.0, total_volume=i, timestamp=old + timedelta(days=i))
+             for i in range(3)]
+            + [SensorReading(device=device, flow_rate=2.0, total_volume=3, timestamp=timezone.now())]
+        )
+
+        with connection.cursor() as cursor:
+            partitions.partition_table(cursor, 1)
+            self.assertTrue(partitions.is_partitioned(cursor))
+            names = [name for name, _, _ in partitions.list_partitions(cursor)]
+            self.assertEqual(names, [partitions.partition_name(old)] + [
+                partitions.partition_name(partitions.add_months(current, offset)) for offset in range(2)
+            ])
+            created = partitions.ensure_partitions(cursor, 2)
+            self.assertEqual(created, [partitions.partition_name(partitions.add_months(current, 2))])
+
+        # El id sigue generándose y `recent` solo lee el mes en curso
+        reading = SensorReading.objects.create(device=device, flow_rate=3.0, total_volume=4)
+        self.assertEqual(partitions.recent(SensorReading.objects.filter(device=device)).count(), 2)
+
+        with connection.cursor() as cursor:
+            self.assertEqual(partitions.drop_partitions_before(cursor, partitions.add_months(old, 1)), 3)
+            cursor.execute(importlib.import_module('api.migrations.0012_reading_partitions').UNPARTITION_SQL)
+            self.assertFalse(partitions.is_partitioned(cursor))
+        self.assertEqual(SensorReading.objects.filter(device=device).count(), 2)
+        self.assertGreater(SensorReading.objects.create(device=device, flow_rate=1.0, total_volume=5).pk, reading.pk)
+
+
+@override_settings(SQLITE_EMBEDDED=True)
+class DbWriterTests(TestCase):
+    """Hilo escritor de SQLite (SQLITE_EMBEDDED)"""
+
+    def test_writer_thread(self):
+        self.assertEqual(db_writer.submit(lambda: threading.current_thread().name).result(), 'sqlite-writer')
+
+    def test_inline_inside_transaction(self):
+        # Cada prueba va dentro de una transacción: el escritor no vería sus datos
+        self.assertIs(db_writer.run(threading.current_thread), threading.current_thread())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'El hilo escritor solo se usa con SQLite')
+@override_settings(SQLITE_EMBEDDED=True)
+class DbWriterCommitTests(TransactionTestCase):
+    """Hilo escritor con transacciones reales: visibilidad y escrituras de los endpoints"""
+
+    def setUp(self):
+        caches['state'].clear()
+        self.device = Device.objects.create(device_id='ESP32_WRITER', name='Escritor', ip_address='192.168.1.99')
+
+    def test_write_visible_to_other_threads(self):
+        def create():
+            return threading.current_thread().name, ValveControl.objects.create(device=self.device, status='open').pk
+
+        thread_name, pk = db_writer.run(create)
+        self.assertEqual(thread_name, 'sqlite-writer')
+        # Confirmado al volver: lo ven este hilo y cualquier otro
+        self.assertTrue(ValveControl.objects.filter(pk=pk).exists())
+        seen = []
+
+        def read():
+            seen.append(ValveControl.objects.filter(pk=pk).exists())
+            connection.close()
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join()
+        self.assertEqual(seen, [True])
+
+    def test_nested_run_is_inline(self):
+        def outer():
+            return threading.current_thread(), db_writer.run(threading.current_thread)
+
+        # Sin ejecutar en línea, el escritor se esperaría a sí mismo
+        writer, inner = db_writer.submit(outer).result(timeout=5)
+        self.assertIs(inner, writer)
+        self.assertEqual(writer.name, 'sqlite-writer')
+
+    def test_endpoints_write_through_writer(self):
+        threads = []
+
+        def recording(fn):
+            def wrapper(*args):
+                threads.append(threading.current_thread().name)
+                return fn(*args)
+            return wrapper
+
+        with mock.patch('api.ingestion._ingest', recording(ingestion._ingest)), \
+                mock.patch('api.views.save_valve_report', recording(views.save_valve_report)):
+            response = self.client.post('/api/sensor-readings/', {
+                'device_id': 'ESP32_WRITER', 'flow_rate': 1.0, 'total_volume': 2.0,
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 201, response.content)
+            response = self.client.post('/api/devices/report_valve_state/', {
+                'device_id': 'ESP32_WRITER', 'valve_state': 'open',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(threads, ['sqlite-writer', 'sqlite-writer'])
+        self.assertEqual(SensorReading.objects.filter(device=self.device).count(), 1)
+        self.assertEqual(Device.objects.get(pk=self.device.pk).current_valve_state, 'open')
@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DeviceViewSet, ValveControlViewSet, SensorReadingViewSet
+from .views import (
+    DeviceViewSet, ValveControlViewSet, SensorReadingViewSet, get_pending_command, report_valve_state,
+    sensor_readings, stream,
+)
 
 router = DefaultRouter()
 router.register(r'devices', DeviceViewSet)
@@ -8,5 +12,18 @@ router.register(r'valve-controls', ValveControlViewSet)
 router.register(r'sensor-readings', SensorReadingViewSet)
 
 urlpatterns = [
+    # Vista async (long-polling) del ESP32; va antes del router
+    path('devices/get_pending_command/', get_pending_command, name='device-get-pending-command'),
+    path('stream/', stream, name='stream'),
+]
+
+if settings.ASYNC_DEVICE_VIEWS:
+    # Versiones async de los endpoints que llaman los ESP32 (para ASGI)
+    urlpatterns += [
+        path('sensor-readings/', sensor_readings, name='sensorreading-list'),
+        path('devices/report_valve_state/', report_valve_state, name='device-report-valve-state'),
+    ]
+
+urlpatterns += [
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
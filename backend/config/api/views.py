@@ -1,37 +1,178 @@
+import asyncio
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import Throttled, ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django.shortcuts import get_object_or_404
-from django.db.models import Avg, Max, Min, Count
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import quote_etag
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 import requests
+import hashlib
 import json
-from .models import Device, ValveControl, SensorReading
-from .serializers import DeviceSerializer, ValveControlSerializer, SensorReadingSerializer
+import math
+from .models import Device, DeviceAlert, ValveControl, ValveSession, SensorReading
+from .serializers import (
+    DeviceSerializer, DeviceAlertSerializer, ValveControlSerializer, SensorReadingSerializer,
+    SensorReadingBatchItemSerializer, SensorReadingCompactSerializer,
+    ValveControlCompactSerializer, ValveSessionSerializer,
+)
+from .export import astream_csv, stream_csv
+from .ingestion import ingest_readings
+from .pagination import TimestampCursorPagination
+from .parsers import PackedBatch, PackedReadingsParser
+from . import (
+    commands, conditional, db_writer, liveness, metrics, registry, rollups, series, sessions,
+    state_cache, write_behind,
+)
+from .events import FLEET_CHANNEL, broker, device_channel, publish_device_event
+
+
+def parse_datetime_param(value):
+    """Convertir un parámetro de fecha (ISO 8601) a datetime con zona horaria"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_device_pk(value):
+    """Parámetro ?device_id= de los historiales (id numérico del dispositivo), o None"""
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({'error': 'device_id debe ser el id numérico del dispositivo'})
+
+
+def filter_history(queryset, params):
+    """Filtros de historial: ?device_id=, ?start_date=, ?end_date= (inclusivos)"""
+    device_id = parse_device_pk(params.get('device_id'))
+    if device_id is not None:
+        queryset = queryset.filter(device_id=device_id)
+    try:
+        start = parse_datetime_param(params.get('start_date'))
+        end = parse_datetime_param(params.get('end_date'))
+    except ValueError:
+        raise ValidationError({'error': 'Formato de fecha inválido (usar ISO 8601)'})
+    if start:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end:
+        queryset = queryset.filter(timestamp__lte=end)
+    return queryset
+
+
+class HistoryListMixin:
+    """Listado de historial paginado, con representación compacta opcional.
+
+    Con ?compact=1 cada fila lleva solo el id del dispositivo y los datos de
+    los dispositivos de la página van una vez en `devices`.
+    """
+    compact_serializer_class = None
+
+    def is_compact(self):
+        return self.request.query_params.get('compact') in ('1', 'true')
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'by_device') and self.is_compact():
+            return self.compact_serializer_class
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        # Con ?device_id= basta la versión de ese dispositivo
+        version = state_cache.data_version(parse_device_pk(request.query_params.get('device_id')))
+        return conditional.respond(
+            request, conditional.make_etag(request, version),
+            lambda: self.history_response(self.filter_queryset(self.get_queryset()))
+        )
+
+    def history_response(self, queryset):
+        if self.is_compact():
+            # Los datos del dispositivo se cargan aparte, una vez por página
+            queryset = queryset.select_related(None)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        if self.is_compact():
+            device_ids = {row.device_id for row in page}
+            response.data['devices'] = {
+                device['id']: device
+                for device in Device.objects.filter(pk__in=device_ids).values('id', 'name', 'device_id')
+            }
+        return response
+
+
+def save_valve_report(device_pk, valve_state):
+    """Guardar un reporte de válvula del ESP32 (en el hilo escritor con SQLITE_EMBEDDED)"""
+    # Solo cambia (y avisa) si el estado guardado era otro
+    changed = Device.objects.filter(pk=device_pk).exclude(current_valve_state=valve_state).update(
+        current_valve_state=valve_state,
+        updated_at=timezone.now()
+    )
+    # Registrar en historial
+    control = ValveControl.objects.create(device_id=device_pk, status=valve_state)
+    if changed:
+        sessions.valve_state_changed(device_pk, valve_state, control)
+        publish_device_event(device_pk, 'valve_state', {'current_valve_state': valve_state})
+    valve_state_reported(device_pk, valve_state)
+    # Nueva fila de historial (y quizá otro estado): invalidar los ETag del dispositivo.
+    # Al final, para que nadie guarde con la versión nueva el estado anterior
+    state_cache.bump_version(device_pk)
+
+
+def valve_state_reported(device_pk, valve_state):
+    """Caché, liveness y confirmación de comandos tras un reporte del ESP32"""
+    state_cache.store_valve_state(device_pk, valve_state)
+    liveness.touch([device_pk])
+    # Confirmar los comandos entregados que ya se ejecutaron
+    commands.acknowledge(device_pk, valve_state)
 
 
 class DeviceViewSet(viewsets.ModelViewSet):
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
 
+    def get_queryset(self):
+        # Aplicar la ventana de inactividad antes de leer is_online
+        liveness.sweep()
+        return super().get_queryset()
+
     @action(detail=True, methods=['post'])
     def open_valve(self, request, pk=None):
         """Solicitar apertura de válvula (arquitectura inversa)"""
         device = self.get_object()
         
-        if not device.is_online:
+        if not liveness.is_online(device):
             return Response(
                 {'error': 'Dispositivo no conectado'},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
-        # Guardar comando pendiente en base de datos
-        device.desired_valve_state = 'open'
-        device.save()
+        # Encolar comando (despierta al ESP32 si está en long-polling)
+        command = commands.enqueue(device, 'open')
         
         return Response({
             'message': 'Comando de apertura registrado. El ESP32 lo ejecutará en breve.',
             'device_id': device.device_id,
-            'desired_state': 'open'
+            'desired_state': 'open',
+            'command_id': command.id
         })
 
     @action(detail=True, methods=['post'])
@@ -39,52 +180,22 @@ class DeviceViewSet(viewsets.ModelViewSet):
         """Solicitar cierre de válvula (arquitectura inversa)"""
         device = self.get_object()
         
-        if not device.is_online:
+        if not liveness.is_online(device):
             return Response(
                 {'error': 'Dispositivo no conectado'},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
-        # Guardar comando pendiente en base de datos
-        device.desired_valve_state = 'closed'
-        device.save()
+        # Encolar comando (despierta al ESP32 si está en long-polling)
+        command = commands.enqueue(device, 'closed')
         
         return Response({
             'message': 'Comando de cierre registrado. El ESP32 lo ejecutará en breve.',
             'device_id': device.device_id,
-            'desired_state': 'closed'
+            'desired_state': 'closed',
+            'command_id': command.id
         })
     
-    @action(detail=False, methods=['get'])
-    def get_pending_command(self, request):
-        """ESP32 consulta comandos pendientes (polling)"""
-        device_id = request.query_params.get('device_id')
-        if not device_id:
-            return Response(
-                {'error': 'device_id es requerido'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            device = Device.objects.get(device_id=device_id)
-            command = device.desired_valve_state
-            
-            # Si hay comando pendiente, limpiarlo después de enviarlo
-            if command != 'none':
-                device.desired_valve_state = 'none'
-                device.save()
-                
-            return Response({
-                'command': command,
-                'device_id': device_id,
-                'timestamp': device.updated_at
-            })
-        except Device.DoesNotExist:
-            return Response(
-                {'error': 'Dispositivo no encontrado'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-    
     @action(detail=False, methods=['post'])
     def report_valve_state(self, request):
         """ESP32 reporta el estado actual de la válvula"""
@@ -97,97 +208,292 @@ class DeviceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            device = Device.objects.get(device_id=device_id)
-            device.current_valve_state = valve_state
-            device.is_online = True  # Marcar como online al recibir reporte
-            device.save()
-            
-            # Registrar en historial
-            ValveControl.objects.create(
-                device=device,
-                status=valve_state
-            )
-            
-            return Response({
-                'message': 'Estado de válvula actualizado',
-                'current_state': valve_state
-            })
-        except Device.DoesNotExist:
+        device = registry.lookup(device_id)
+        if device is None:
             return Response(
                 {'error': 'Dispositivo no encontrado'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+        db_writer.run(save_valve_report, device.pk, valve_state)
+
+        return Response({
+            'message': 'Estado de válvula actualizado',
+            'current_state': valve_state
+        })
+
     @action(detail=True, methods=['get'])
     def status(self, request, pk=None):
         """Obtener estado del dispositivo"""
         device = self.get_object()
-        
-        # Obtener última lectura del sensor
-        latest_reading = SensorReading.objects.filter(device=device).first()
+        is_online = liveness.is_online(device)
+        etag = conditional.make_etag(request, state_cache.data_version(device.pk), is_online)
+        return conditional.respond(request, etag, lambda: self._status_response(device, is_online))
+
+    def _status_response(self, device, is_online):
+        # Obtener última lectura del sensor (desde el caché de estado)
+        latest_reading = state_cache.get_latest_reading(device.pk)
         
         return Response({
             'id': device.id,
             'name': device.name,
             'device_id': device.device_id,
-            'is_online': device.is_online,
-            'current_valve_state': device.current_valve_state,
-            'desired_valve_state': device.desired_valve_state,
-            'flow_rate': latest_reading.flow_rate if latest_reading else 0,
-            'total_volume': latest_reading.total_volume if latest_reading else 0
+            'is_online': is_online,
+            'current_valve_state': state_cache.get_valve_state(device),
+            'desired_valve_state': commands.desired_state(device),
+            'flow_rate': latest_reading['flow_rate'] if latest_reading else 0,
+            'total_volume': latest_reading['total_volume'] if latest_reading else 0
         })
 
+    @action(detail=False, methods=['get'])
+    def fleet_status(self, request):
+        """Estado de todos los dispositivos en una sola respuesta (con ETag)"""
+        devices = list(
+            self.get_queryset()
+            .annotate(desired_valve_state=commands.desired_state_annotation())
+            .order_by('id')
+        )
+        readings = state_cache.get_latest_readings([device.pk for device in devices])
+        valve_states = state_cache.get_valve_states(devices)
+        seen = liveness.last_seen_many(devices)
+
+        data = {'devices': []}
+        for device in devices:
+            reading = readings[device.pk]
+            data['devices'].append({
+                'id': device.id,
+                'name': device.name,
+                'device_id': device.device_id,
+                'ip_address': device.ip_address,
+                'created_at': device.created_at,
+                'is_online': liveness.online(device, seen[device.pk]),
+                'last_seen': seen[device.pk],
+                'current_valve_state': valve_states[device.pk],
+                'desired_valve_state': device.desired_valve_state,
+                'flow_rate': reading['flow_rate'] if reading else 0,
+                'total_volume': reading['total_volume'] if reading else 0,
+                'reading_timestamp': reading['timestamp'] if reading else None,
+            })
+
+        # El estado online depende de la hora: ETag a partir del contenido
+        content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+        etag = quote_etag(hashlib.md5(content).hexdigest())
+        return conditional.respond(request, etag, lambda: Response(data))
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Aciertos/fallos del caché de último estado y respuestas 304 (en este proceso)"""
+        return Response({**state_cache.stats(), 'conditional_get': conditional.stats()})
+
+    @action(detail=True, methods=['get'])
+    def alerts(self, request, pk=None):
+        """Alertas del dispositivo (?active=1 para solo las no resueltas)"""
+        alerts = DeviceAlert.objects.filter(device_id=pk)
+        if request.query_params.get('active') in ('1', 'true'):
+            alerts = alerts.filter(resolved_at__isnull=True)
+        page = self.paginate_queryset(alerts)
+        serializer = DeviceAlertSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def sessions(self, request, pk=None):
+        """Sesiones de válvula abierta con su duración y consumo (?open=1 para la abierta)"""
+        valve_sessions = ValveSession.objects.filter(device_id=pk)
+        if request.query_params.get('open') in ('1', 'true'):
+            valve_sessions = valve_sessions.filter(closed_at__isnull=True)
+        page = self.paginate_queryset(valve_sessions)
+        serializer = ValveSessionSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
 
-class ValveControlViewSet(viewsets.ModelViewSet):
-    queryset = ValveControl.objects.all()
+class ValveControlViewSet(HistoryListMixin, viewsets.ModelViewSet):
+    queryset = ValveControl.objects.select_related('device')
     serializer_class = ValveControlSerializer
+    compact_serializer_class = ValveControlCompactSerializer
+    pagination_class = TimestampCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_history(queryset, self.request.query_params)
+            valve_status = self.request.query_params.get('status')
+            if valve_status:
+                queryset = queryset.filter(status=valve_status)
+        return queryset
 
     @action(detail=False, methods=['get'])
     def by_device(self, request):
         """Obtener historial de válvula por dispositivo"""
-        device_id = request.query_params.get('device_id')
-        if not device_id:
+        device_id = parse_device_pk(request.query_params.get('device_id'))
+        if device_id is None:
             return Response(
                 {'error': 'device_id es requerido'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        controls = ValveControl.objects.filter(device_id=device_id)
-        serializer = self.get_serializer(controls, many=True)
-        return Response(serializer.data)
+        controls = self.get_queryset().filter(device_id=device_id)
+        etag = conditional.make_etag(request, state_cache.data_version(device_id))
+        return conditional.respond(request, etag, lambda: self.history_response(controls))
 
 
-class SensorReadingViewSet(viewsets.ModelViewSet):
-    queryset = SensorReading.objects.all()
+class SensorReadingViewSet(HistoryListMixin, viewsets.ModelViewSet):
+    queryset = SensorReading.objects.select_related('device')
     serializer_class = SensorReadingSerializer
+    compact_serializer_class = SensorReadingCompactSerializer
+    pagination_class = TimestampCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_history(queryset, self.request.query_params)
+        return queryset
 
     def create(self, request, *args, **kwargs):
         """Crear nueva lectura del sensor (usado por ESP32)"""
         # Permite enviar device_id en lugar de device
         if 'device_id' in request.data and 'device' not in request.data:
-            try:
-                device = Device.objects.get(device_id=request.data['device_id'])
-                # Marcar dispositivo como online al recibir datos
-                device.is_online = True
-                device.save()
-                
-                # Crear copia mutable de request.data
-                data = request.data.copy()
-                data['device'] = device.id
-                # Usar el serializer directamente con los datos modificados
-                serializer = self.get_serializer(data=data)
-                serializer.is_valid(raise_exception=True)
-                self.perform_create(serializer)
-                headers = self.get_success_headers(serializer.data)
-                return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
-            except Device.DoesNotExist:
+            device = registry.lookup(request.data['device_id'])
+            if device is None:
                 return Response(
                     {'error': f'Dispositivo con device_id={request.data["device_id"]} no encontrado'},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            serializer = SensorReadingBatchItemSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            reading = SensorReading(
+                device=device,
+                flow_rate=serializer.validated_data['flow_rate'],
+                total_volume=serializer.validated_data['total_volume'],
+            )
+            self.store_reading(reading)
+            return Response(SensorReadingSerializer(reading).data, status=status.HTTP_201_CREATED)
         return super().create(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        reading = SensorReading(**serializer.validated_data)
+        self.store_reading(reading)
+        serializer.instance = reading
+
+    def store_reading(self, reading):
+        if settings.INGEST_WRITE_BEHIND:
+            try:
+                write_behind.get_buffer().submit([reading])
+            except write_behind.BufferFull as exc:
+                raise Throttled(wait=settings.INGEST_FLUSH_INTERVAL, detail=str(exc))
+        else:
+            # Misma ruta que los lotes: liveness, agregados y eventos en vivo
+            ingest_readings([reading])
+
+    @action(detail=False, methods=['post'],
+            parser_classes=api_settings.DEFAULT_PARSER_CLASSES + [PackedReadingsParser])
+    def batch(self, request):
+        """Crear varias lecturas en una sola petición (ESP32 con buffer offline)"""
+        if isinstance(request.data, PackedBatch):
+            return self._packed_batch(request.data)
+
+        items = request.data.get('readings') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'Se requiere una lista de lecturas'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.SENSOR_BATCH_MAX_SIZE:
+            return Response(
+                {'error': f'Máximo {settings.SENSOR_BATCH_MAX_SIZE} lecturas por lote'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # 1. Validar cada lectura por separado
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = SensorReadingBatchItemSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'status': 'error', 'errors': serializer.errors}
+
+        # 2. Resolver todos los dispositivos del lote con una sola consulta
+        device_ids = {data['device_id'] for _, data in valid}
+        devices = registry.lookup_many(device_ids)
+
+        now = timezone.now()
+        positions = []
+        readings = []
+        for index, data in valid:
+            device = devices.get(data['device_id'])
+            if device is None:
+                results[index] = {
+                    'index': index,
+                    'status': 'error',
+                    'errors': {'device_id': [f'Dispositivo con device_id={data["device_id"]} no encontrado']}
+                }
+                continue
+            positions.append(index)
+            readings.append(SensorReading(
+                device=device,
+                flow_rate=data['flow_rate'],
+                total_volume=data['total_volume'],
+                timestamp=data.get('timestamp') or now,
+            ))
+
+        # 3. Insertar todo el lote de una vez
+        created = ingest_readings(readings)
+        for index, reading in zip(positions, created):
+            results[index] = {'index': index, 'status': 'created', 'id': reading.id}
+
+        errors = len(items) - len(created)
+        if not created:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+
+        return Response({
+            'created': len(created),
+            'errors': errors,
+            'results': results
+        }, status=response_status)
+
+    def _packed_batch(self, batch):
+        """Lote binario (application/x-water-readings): ya validado por el parser"""
+        device = Device.objects.only('id', 'name', 'current_valve_state').filter(pk=batch.device).first()
+        if device is None:
+            return Response(
+                {'error': f'Dispositivo con id={batch.device} no encontrado'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        created = ingest_readings([
+            SensorReading(device=device, flow_rate=flow_rate, total_volume=total_volume, timestamp=timestamp)
+            for timestamp, flow_rate, total_volume in batch.readings
+        ])
+        return Response({
+            'created': len(created),
+            'errors': 0,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Exportar lecturas en CSV por streaming (?device_id=, fechas, ?compress=gzip)"""
+        compress = request.query_params.get('compress') == 'gzip'
+        readings = filter_history(SensorReading.objects.all(), request.query_params).order_by('timestamp', 'id')
+
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+        if isinstance(request._request, ASGIRequest):
+            content = astream_csv(readings, chunk_size, compress)
+        else:
+            content = stream_csv(readings, chunk_size, compress)
+
+        filename = f"lecturas-{request.query_params.get('device_id') or 'todas'}-{timezone.now():%Y%m%d}.csv"
+        if compress:
+            response = StreamingHttpResponse(content, content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=False, methods=['get'])
     def latest(self, request):
         """Obtener última lectura del sensor"""
@@ -198,10 +504,13 @@ class SensorReadingViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        reading = SensorReading.objects.filter(device_id=device_id).first()
+        etag = conditional.make_etag(request, state_cache.data_version(device_id))
+        return conditional.respond(request, etag, lambda: self._latest_response(device_id))
+
+    def _latest_response(self, device_id):
+        reading = state_cache.get_latest_reading(device_id)
         if reading:
-            serializer = self.get_serializer(reading)
-            return Response(serializer.data)
+            return Response(reading)
         return Response({'error': 'Sin lecturas'}, status=status.HTTP_404_NOT_FOUND)
 
     @action(detail=False, methods=['get'])
@@ -217,32 +526,300 @@ class SensorReadingViewSet(viewsets.ModelViewSet):
         # Filtrar por rango de fechas si se proporciona
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
+        try:
+            start = parse_datetime_param(start_date)
+            end = parse_datetime_param(end_date)
+        except ValueError:
+            return Response(
+                {'error': 'Formato de fecha inválido (usar ISO 8601)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        readings = SensorReading.objects.filter(device_id=device_id)
-        
-        if start_date:
-            readings = readings.filter(timestamp__gte=start_date)
-        if end_date:
-            readings = readings.filter(timestamp__lte=end_date)
-        
-        stats = readings.aggregate(
-            avg_flow_rate=Avg('flow_rate'),
-            max_flow_rate=Max('flow_rate'),
-            min_flow_rate=Min('flow_rate'),
-            total_readings=Count('id'),
-            max_volume=Max('total_volume')
+        etag = conditional.make_etag(request, state_cache.data_version(device_id))
+        return conditional.respond(
+            request, etag,
+            lambda: self._stats_response(device_id, start, end, start_date, end_date)
+        )
+
+    @action(detail=False, methods=['get'])
+    def series(self, request):
+        """Serie de caudal y volumen reducida a ?points=N puntos (LTTB o min/max) para gráficas"""
+        device_id = request.query_params.get('device_id')
+        if not device_id:
+            return Response(
+                {'error': 'device_id es requerido'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            points = int(request.query_params.get('points', settings.SERIES_DEFAULT_POINTS))
+        except ValueError:
+            points = 0
+        if not 3 <= points <= settings.SERIES_MAX_POINTS:
+            return Response(
+                {'error': f'points debe estar entre 3 y {settings.SERIES_MAX_POINTS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        method = request.query_params.get('method', 'lttb')
+        if method not in series.METHODS:
+            return Response(
+                {'error': f'method debe ser uno de: {", ".join(series.METHODS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            start = parse_datetime_param(request.query_params.get('start_date'))
+            end = parse_datetime_param(request.query_params.get('end_date'))
+        except ValueError:
+            return Response(
+                {'error': 'Formato de fecha inválido (usar ISO 8601)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Por defecto, las últimas 24 horas
+        end = end or timezone.now()
+        start = start or end - timedelta(days=1)
+
+        etag = conditional.make_etag(request, state_cache.data_version(device_id))
+        return conditional.respond(request, etag, lambda: Response({
+            'device_id': device_id,
+            'method': method,
+            'period_start': start,
+            'period_end': end,
+            **series.build_series(device_id, start, end, points, method),
+        }))
+
+    def _stats_response(self, device_id, start, end, start_date, end_date):
+        # Responder desde los agregados por día/hora/minuto; end_date es inclusivo
+        stats = rollups.summarize(
+            device_id,
+            start=start,
+            end=end + timedelta(microseconds=1) if end else None
         )
-        
-        # Obtener última lectura para volumen actual
-        latest = readings.first()
         
         return Response({
             'device_id': device_id,
-            'current_volume': latest.total_volume if latest else 0,
+            'current_volume': stats['current_volume'],
+            'consumed_volume': round(stats['consumed_volume'], 3),
             'avg_flow_rate': round(stats['avg_flow_rate'] or 0, 2),
             'max_flow_rate': round(stats['max_flow_rate'] or 0, 2),
             'min_flow_rate': round(stats['min_flow_rate'] or 0, 2),
-            'total_readings': stats['total_readings'],
+            'total_readings': stats['count'],
             'period_start': start_date,
             'period_end': end_date
-        })
\ No newline at end of file
+        })
+
+
+@require_GET
+async def get_pending_command(request):
+    """ESP32 consulta comandos pendientes (polling, o long-polling con ?wait=N)"""
+    device_id = request.GET.get('device_id')
+    if not device_id:
+        return JsonResponse(
+            {'error': 'device_id es requerido'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    # nan o inf esperarían para siempre
+    if not math.isfinite(wait):
+        return JsonResponse(
+            {'error': 'wait debe ser un número de segundos'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    wait = min(max(wait, 0), settings.COMMAND_LONGPOLL_MAX_WAIT)
+
+    device = await registry.alookup(device_id)
+    if device is None:
+        return JsonResponse(
+            {'error': 'Dispositivo no encontrado'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    await sync_to_async(liveness.touch)([device.pk])
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    # Suscribirse antes de consultar para no perder un aviso intermedio
+    with broker.subscribe(device_channel(device.pk)) as subscription:
+        while True:
+            command = await commands.aclaim_next(device.pk)
+            remaining = deadline - loop.time()
+            if command is not None or remaining <= 0:
+                break
+            # Volver a consultar periódicamente por si el comando llegó
+            # a través de otro proceso worker
+            try:
+                await subscription.get(timeout=min(remaining, settings.COMMAND_LONGPOLL_RECHECK))
+            except asyncio.TimeoutError:
+                pass
+
+    if command is None:
+        return JsonResponse({
+            'command': 'none',
+            'device_id': device_id,
+            'timestamp': timezone.now()
+        })
+    return JsonResponse({
+        'command': command.action,
+        'command_id': command.id,
+        'device_id': device_id,
+        'timestamp': command.created_at
+    })
+
+
+# Vistas DRF síncronas para lo que las vistas async no atienden
+sensor_reading_list = SensorReadingViewSet.as_view(
+    {'get': 'list', 'post': 'create'}, basename='sensorreading', detail=False
+)
+device_report_valve_state = DeviceViewSet.as_view(
+    {'post': 'report_valve_state'}, basename='device', detail=False
+)
+
+
+def _json_body(request):
+    """Cuerpo JSON como dict, o None si no lo es"""
+    if request.content_type != 'application/json':
+        return None
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@csrf_exempt
+async def sensor_readings(request):
+    """Lecturas del ESP32 (POST con device_id) sin pasar por un hilo de DRF.
+
+    El resto (GET del historial, POST con `device`, formularios) lo atiende
+    SensorReadingViewSet como siempre.
+    """
+    data = _json_body(request) if request.method == 'POST' else None
+    if data is None or 'device_id' not in data or 'device' in data:
+        return await sync_to_async(sensor_reading_list)(request)
+
+    serializer = SensorReadingBatchItemSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    device = await registry.alookup(data['device_id'])
+    if device is None:
+        return JsonResponse(
+            {'error': f'Dispositivo con device_id={data["device_id"]} no encontrado'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    reading = SensorReading(
+        device=device,
+        flow_rate=serializer.validated_data['flow_rate'],
+        total_volume=serializer.validated_data['total_volume'],
+    )
+    if settings.INGEST_WRITE_BEHIND:
+        # Solo escribe el spool: no necesita el hilo de la conexión a la BD
+        try:
+            await sync_to_async(write_behind.get_buffer().submit, thread_sensitive=False)([reading])
+        except write_behind.BufferFull as exc:
+            return JsonResponse(
+                {'error': str(exc)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(math.ceil(settings.INGEST_FLUSH_INTERVAL))}
+            )
+    else:
+        # La ingesta es una transacción (estado de flujo, agregados): un solo salto a hilo
+        await db_writer.arun(ingest_readings, [reading])
+    return JsonResponse(SensorReadingSerializer(reading).data, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+async def report_valve_state(request):
+    """ESP32 reporta el estado actual de la válvula (versión async)"""
+    data = _json_body(request)
+    if data is None:
+        return await sync_to_async(device_report_valve_state)(request)
+
+    device_id = data.get('device_id')
+    valve_state = data.get('valve_state')
+    if not device_id or not valve_state:
+        return JsonResponse(
+            {'error': 'device_id y valve_state son requeridos'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    device = await registry.alookup(device_id)
+    if device is None:
+        return JsonResponse(
+            {'error': 'Dispositivo no encontrado'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    # Las escrituras de un reporte van juntas en un solo salto a hilo
+    await db_writer.arun(save_valve_report, device.pk, valve_state)
+
+    return JsonResponse({
+        'message': 'Estado de válvula actualizado',
+        'current_state': valve_state
+    })
+
+
+def _sse_message(event):
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    return f'event: {event["type"]}\ndata: {data}\n\n'
+
+
+@require_GET
+async def stream(request):
+    """Stream SSE con lecturas y cambios de válvula (?device_id=<id> o toda la flota).
+
+    Solo con ASGI (daphne): con WSGI Django consume el generador entero antes
+    de responder y el worker queda ocupado para siempre. Se responde 501 y el
+    frontend vuelve al polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'El stream SSE requiere un servidor ASGI (daphne)'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+
+    device_pk = request.GET.get('device_id')
+    if device_pk:
+        if not await Device.objects.filter(pk=device_pk).aexists():
+            return JsonResponse(
+                {'error': 'Dispositivo no encontrado'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        channel = device_channel(device_pk)
+    else:
+        channel = FLEET_CHANNEL
+
+    subscription = broker.subscribe(channel)
+
+    async def events():
+        try:
+            yield f'retry: {settings.SSE_RETRY_MS}\n\n'
+            while True:
+                try:
+                    event = await subscription.get(timeout=settings.SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Comentario para mantener viva la conexión tras proxies
+                    yield ': keepalive\n\n'
+                    continue
+                yield _sse_message(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+def metrics_view(request):
+    """Métricas en formato de texto de Prometheus"""
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return JsonResponse(
+            {'error': 'Token de métricas inválido'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,268 @@
+"""Ingesta diferida (write-behind) de lecturas individuales.
+
+Con INGEST_WRITE_BEHIND activo, POST /api/sensor-readings/ no inserta la
+lectura: la escribe en un archivo de spool local, la deja en memoria y
+responde. Un hilo la guarda junto con las demás con ingest_readings cada
+INGEST_FLUSH_INTERVAL segundos o al juntar INGEST_FLUSH_ROWS lecturas.
+
+El spool hace que una lectura confirmada al ESP32 no se pierda: cada proceso
+escribe en su propio archivo bloqueado con flock. Al volcar, el archivo se
+renombra a `.flushing` y se borra cuando las lecturas están en la BD. Los
+archivos que ningún proceso tiene bloqueados (el proceso murió) se vuelven a
+ingerir al arrancar. Un corte justo entre el INSERT y el borrado puede
+repetir lecturas: la entrega es al menos una vez.
+"""
+import atexit
+import fcntl
+import itertools
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .ingestion import ingest_readings
+from .models import Device, SensorReading
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """El buffer llegó a INGEST_BUFFER_MAX_ROWS lecturas sin volcar"""
+
+
+def _encode(reading):
+    return json.dumps({
+        'device': reading.device_id,
+        'flow_rate': reading.flow_rate,
+        'total_volume': reading.total_volume,
+        'timestamp': reading.timestamp.isoformat(),
+    }) + '\n'
+
+
+def _lock(spool_file, blocking=True):
+    """flock exclusivo; False si otro proceso ya lo tiene"""
+    try:
+        fcntl.flock(spool_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        return False
+    return True
+
+
+class Segment:
+    """Lecturas ya retiradas del buffer y el archivo de spool que las respalda"""
+
+    def __init__(self, path, spool_file, readings):
+        self.path = path
+        self.spool_file = spool_file
+        self.readings = readings
+
+    def discard(self):
+        os.unlink(self.path)
+        self.spool_file.close()
+
+
+class WriteBehindBuffer:
+    def __init__(self, spool_dir, max_rows, flush_rows, flush_interval, fsync=True):
+        self.spool_dir = spool_dir
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._pending = []   # lecturas aún en el spool activo
+        self._segments = []  # Segment pendientes de guardar (en orden)
+        self._rows = 0       # pending + segmentos, para la contrapresión
+        self._sequence = itertools.count()
+        self._spool = None
+        self._thread = None
+        self._stopping = False
+
+    def _spool_path(self, suffix):
+        return os.path.join(self.spool_dir, f'{os.getpid()}-{next(self._sequence)}.{suffix}')
+
+    def open(self):
+        """Abrir un spool nuevo para las siguientes lecturas"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self._spool_path('spool')
+        spool_file = open(path, 'a')
+        _lock(spool_file)
+        self._spool = (path, spool_file)
+
+    def start(self):
+        """Abrir el spool y arrancar el hilo de volcado (que antes recupera los huérfanos)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.open()
+            self._thread = threading.Thread(target=self._run, name='ingest-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, readings):
+        """Guardar en el spool y encolar lecturas sin guardar (device ya resuelto)"""
+        with self._lock:
+            if self._stopping:
+                raise BufferFull('El servidor se está deteniendo')
+            if self._rows + len(readings) > self.max_rows:
+                raise BufferFull(f'Buffer de ingesta lleno ({self.max_rows} lecturas)')
+            spool_file = self._spool[1]
+            spool_file.write(''.join(_encode(reading) for reading in readings))
+            spool_file.flush()
+            if self.fsync:
+                os.fsync(spool_file.fileno())
+            self._pending.extend(readings)
+            self._rows += len(readings)
+            if len(self._pending) >= self.flush_rows:
+                self._wakeup.notify()
+
+    def size(self):
+        with self._lock:
+            return self._rows
+
+    def _rotate(self):
+        """Cerrar el spool activo como segmento y abrir uno nuevo (con _lock)"""
+        if not self._pending:
+            return
+        path, spool_file = self._spool
+        segment_path = path[:-len('.spool')] + '.flushing'
+        # El flock sigue con el archivo abierto tras el renombrado
+        os.rename(path, segment_path)
+        self._segments.append(Segment(segment_path, spool_file, self._pending))
+        self._pending = []
+        self.open()
+
+    def flush(self):
+        """Guardar en la BD todo lo encolado. Devuelve las lecturas guardadas"""
+        with self._flush_lock:
+            with self._lock:
+                self._rotate()
+                segments = list(self._segments)
+            saved = 0
+            for segment in segments:
+                queued = len(segment.readings)
+                try:
+                    ingest_readings(segment.readings)
+                except IntegrityError:
+                    # Un dispositivo se eliminó con lecturas en el buffer
+                    segment.readings = _existing_devices_only(segment.readings)
+                    ingest_readings(segment.readings)
+                segment.discard()
+                with self._lock:
+                    self._segments.remove(segment)
+                    self._rows -= queued
+                saved += len(segment.readings)
+            return saved
+
+    def _run(self):
+        try:
+            self.recover()
+        except Exception:
+            logger.exception('No se pudieron recuperar los spools de ingesta')
+        while True:
+            with self._lock:
+                if not self._stopping and len(self._pending) < self.flush_rows:
+                    self._wakeup.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                # Las lecturas siguen en sus segmentos: se reintenta en el siguiente ciclo
+                logger.exception('No se pudieron guardar las lecturas del buffer de ingesta')
+
+    def stop(self):
+        """Dejar de aceptar lecturas y volcar lo pendiente (al apagar el proceso)"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        except Exception:
+            # Quedan en el spool y los recupera el siguiente proceso
+            logger.exception('No se pudo vaciar el buffer de ingesta al detener el proceso')
+            return
+        path, spool_file = self._spool
+        os.unlink(path)
+        spool_file.close()
+
+    def recover(self):
+        """Ingerir los spools de procesos terminados. Devuelve las lecturas recuperadas"""
+        recovered = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(('.spool', '.flushing')):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            try:
+                spool_file = open(path)
+            except FileNotFoundError:
+                continue
+            with spool_file:
+                # Bloqueado: es de un proceso vivo (o de este mismo)
+                if not _lock(spool_file, blocking=False):
+                    continue
+                # Otro proceso lo recuperó y borró mientras esperábamos
+                if os.fstat(spool_file.fileno()).st_nlink == 0:
+                    continue
+                readings = _decode(spool_file)
+                ingest_readings(readings)
+                os.unlink(path)
+            recovered += len(readings)
+            logger.warning('Recuperadas %s lecturas del spool %s', len(readings), name)
+        return recovered
+
+
+def _existing_devices_only(readings):
+    existing = set(Device.objects.filter(pk__in={r.device_id for r in readings}).values_list('pk', flat=True))
+    return [reading for reading in readings if reading.device_id in existing]
+
+
+def _decode(spool_file):
+    rows = []
+    for line in spool_file:
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            # Última línea a medio escribir: no se confirmó al ESP32
+            continue
+    devices = Device.objects.only('id', 'name', 'current_valve_state').in_bulk({row['device'] for row in rows})
+    return [
+        SensorReading(
+            device=devices[row['device']],
+            flow_rate=row['flow_rate'],
+            total_volume=row['total_volume'],
+            timestamp=parse_datetime(row['timestamp']),
+        )
+        for row in rows
+        # Dispositivos eliminados mientras tanto
+        if row['device'] in devices
+    ]
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Buffer del proceso, creado y arrancado en la primera lectura"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            buffer = WriteBehindBuffer(
+                settings.INGEST_SPOOL_DIR,
+                max_rows=settings.INGEST_BUFFER_MAX_ROWS,
+                flush_rows=settings.INGEST_FLUSH_ROWS,
+                flush_interval=settings.INGEST_FLUSH_INTERVAL,
+                fsync=settings.INGEST_SPOOL_FSYNC,
+            )
+            buffer.start()
+            _buffer = buffer
+    return _buffer
@@ -5,4 +5,12 @@ set -o errexit
 pip install -r requirements.txt
 
 python manage.py collectstatic --no-input
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+# Tabla del caché de estado con STATE_CACHE_BACKEND=db (la del caché compartido la crea migrate)
+python manage.py createcachetable
+
+# Particiones mensuales de las lecturas (PostgreSQL): convertir la tabla la primera vez
+# y crear los próximos meses en cada despliegue
+if [ "$READING_PARTITIONS" = "True" ]; then
+  python manage.py manage_partitions --convert
+fi
\ No newline at end of file
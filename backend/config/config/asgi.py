@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Con ASGI se usan las vistas async de los ESP32 (ASYNC_DEVICE_VIEWS)
+os.environ.setdefault('ASYNC_DEVICE_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -50,8 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',  # ← Latencia y consultas por vista (GET /metrics)
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # ← Agregar WhiteNoise para archivos estáticos
+    'api.middleware.WhiteNoiseMiddleware',  # ← WhiteNoise (con soporte async) para archivos estáticos
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -118,6 +119,64 @@ DATABASES = {
     )
 }
 
+# Perfil embebido de SQLite para un solo nodo: WAL y pragmas en cada conexión,
+# BEGIN IMMEDIATE con espera por bloqueo y un solo hilo escritor (api/db_writer.py)
+SQLITE_EMBEDDED = os.environ.get('SQLITE_EMBEDDED', 'False') == 'True'
+if SQLITE_EMBEDDED and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'init_command': ';'.join([
+            'PRAGMA journal_mode=WAL',
+            # Con WAL, NORMAL no hace fsync en cada commit y no corrompe la BD
+            'PRAGMA synchronous=NORMAL',
+            f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))}",
+            # Negativo: en KiB
+            f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_KB', str(64 * 1024)))}",
+            'PRAGMA temp_store=MEMORY',
+        ]),
+        'transaction_mode': 'IMMEDIATE',
+        # busy_timeout en segundos
+        'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '20')),
+    })
+
+
+# Cachés
+# 'state' guarda el último estado de cada dispositivo. Por defecto vive en la
+# memoria de cada proceso; con varios workers usar STATE_CACHE_BACKEND=file
+# (STATE_CACHE_LOCATION = directorio) o =db (tabla creada con createcachetable).
+STATE_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+}
+STATE_CACHE_BACKEND = os.environ.get('STATE_CACHE_BACKEND', 'locmem')
+
+# GET condicional (api/conditional.py): el ETag sale de versiones guardadas en el caché
+# `state`, correcto solo si todos los procesos lo comparten (file o db). Con memoria local
+# cada worker tendría su propia versión y podría responder 304 con datos viejos: activarlo
+# a mano (CONDITIONAL_GET=True) solo con un único proceso (gunicorn -w 1 --threads N)
+CONDITIONAL_GET = os.environ.get('CONDITIONAL_GET', str(STATE_CACHE_BACKEND != 'locmem')) == 'True'
+
+CACHES = {
+    # Compartido por todos los procesos (tabla creada por la migración 0015): versión
+    # del registro de dispositivos (api/registry.py), aunque `state` sea memoria local
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_shared_cache',
+        'TIMEOUT': None,
+    },
+    'state': {
+        'BACKEND': STATE_CACHE_BACKENDS[STATE_CACHE_BACKEND],
+        'LOCATION': os.environ.get('STATE_CACHE_LOCATION', {
+            'locmem': 'device-state',
+            'file': '/tmp/arduino-state-cache',
+            'db': 'device_state_cache',
+        }[STATE_CACHE_BACKEND]),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('STATE_CACHE_MAX_ENTRIES', '20000')),
+        },
+    },
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -166,3 +225,87 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100
 }
+
+# Ingesta de lecturas del sensor
+# Máximo de lecturas aceptadas en una sola petición a /api/sensor-readings/batch/
+SENSOR_BATCH_MAX_SIZE = int(os.environ.get('SENSOR_BATCH_MAX_SIZE', '500'))
+# Hora enviada por el ESP32: se rechazan lecturas más de READING_MAX_CLOCK_SKEW segundos
+# en el futuro o con más de READING_MAX_AGE_DAYS días (reloj sin NTP)
+READING_MAX_CLOCK_SKEW = int(os.environ.get('READING_MAX_CLOCK_SKEW', '300'))
+READING_MAX_AGE_DAYS = int(os.environ.get('READING_MAX_AGE_DAYS', '30'))
+# Ingesta diferida (api/write_behind.py): POST /api/sensor-readings/ responde tras
+# escribir la lectura en un spool local y un hilo la guarda en lotes
+INGEST_WRITE_BEHIND = os.environ.get('INGEST_WRITE_BEHIND', 'False') == 'True'
+# Máximo de lecturas sin guardar por proceso; al superarlo se responde 429
+INGEST_BUFFER_MAX_ROWS = int(os.environ.get('INGEST_BUFFER_MAX_ROWS', '10000'))
+# Se vuelca cada INGEST_FLUSH_INTERVAL segundos o al juntar INGEST_FLUSH_ROWS lecturas
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', '0.5'))
+INGEST_FLUSH_ROWS = int(os.environ.get('INGEST_FLUSH_ROWS', '500'))
+# Carpeta del spool (disco local persistente, no /tmp) y fsync de cada lectura
+INGEST_SPOOL_DIR = os.environ.get('INGEST_SPOOL_DIR', os.path.join(BASE_DIR, 'spool'))
+INGEST_SPOOL_FSYNC = os.environ.get('INGEST_SPOOL_FSYNC', 'True') == 'True'
+# Filas leídas de la base de datos por bloque en /api/sensor-readings/export/
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# Puntos por defecto y máximos de /api/sensor-readings/series/
+SERIES_DEFAULT_POINTS = int(os.environ.get('SERIES_DEFAULT_POINTS', '500'))
+SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', '5000'))
+
+# Detección de fugas: caudal mínimo (L/min) con la válvula cerrada durante
+# LEAK_ALERT_AFTER segundos seguidos genera una alerta
+LEAK_MIN_FLOW = float(os.environ.get('LEAK_MIN_FLOW', '0.1'))
+LEAK_ALERT_AFTER = int(os.environ.get('LEAK_ALERT_AFTER', '300'))
+
+# Retención de lecturas (manage.py prune_readings): días con resolución
+# completa y carpeta de los CSV comprimidos con las lecturas eliminadas
+READING_RETENTION_DAYS = int(os.environ.get('READING_RETENTION_DAYS', '90'))
+READING_ARCHIVE_DIR = os.environ.get('READING_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+# Particiones mensuales de las lecturas (solo PostgreSQL): build.sh particiona la
+# tabla con manage.py manage_partitions --convert; meses creados por adelantado
+READING_PARTITIONS = os.environ.get('READING_PARTITIONS', 'False') == 'True'
+READING_PARTITIONS_AHEAD = int(os.environ.get('READING_PARTITIONS_AHEAD', '3'))
+
+# Liveness de dispositivos
+# Segundos sin contacto tras los que un dispositivo pasa a offline
+DEVICE_OFFLINE_AFTER = int(os.environ.get('DEVICE_OFFLINE_AFTER', '60'))
+# Cada cuántos segundos se guarda last_seen en el caché de estado y se barren los
+# dispositivos inactivos (debe ser menor que DEVICE_OFFLINE_AFTER)
+DEVICE_LIVENESS_FLUSH_INTERVAL = int(os.environ.get('DEVICE_LIVENESS_FLUSH_INTERVAL', '15'))
+
+# Registro device_id -> dispositivo en memoria de cada proceso (api/registry.py)
+DEVICE_REGISTRY_SIZE = int(os.environ.get('DEVICE_REGISTRY_SIZE', '10000'))
+# Cada cuántos segundos se comprueba si otro proceso cambió algún dispositivo
+DEVICE_REGISTRY_CHECK_INTERVAL = float(os.environ.get('DEVICE_REGISTRY_CHECK_INTERVAL', '1'))
+
+# Cola de comandos: segundos tras los que un comando no entregado expira
+COMMAND_TTL = int(os.environ.get('COMMAND_TTL', '120'))
+
+# Long-polling de comandos (GET /api/devices/get_pending_command/?wait=N)
+# Espera máxima permitida en segundos
+COMMAND_LONGPOLL_MAX_WAIT = float(os.environ.get('COMMAND_LONGPOLL_MAX_WAIT', '30'))
+# Cada cuánto se vuelve a consultar la BD mientras se espera (comandos de otros procesos)
+COMMAND_LONGPOLL_RECHECK = float(os.environ.get('COMMAND_LONGPOLL_RECHECK', '2'))
+
+# Vistas async para POST /api/sensor-readings/ y /api/devices/report_valve_state/.
+# Solo con ASGI (daphne), donde evitan ocupar un hilo por petición: config/asgi.py
+# las activa si no se indica otra cosa. Con WSGI (gunicorn) cada una añade un event loop
+ASYNC_DEVICE_VIEWS = os.environ.get('ASYNC_DEVICE_VIEWS', 'False') == 'True'
+
+# Eventos en vivo (long-polling y stream SSE en /api/stream/)
+# 'api.events.LocalBroker' (un proceso) o 'api.events.UnixSocketBroker' (varios workers en la misma máquina)
+EVENTS_BROKER = os.environ.get('EVENTS_BROKER', 'api.events.LocalBroker')
+EVENTS_SOCKET_DIR = os.environ.get('EVENTS_SOCKET_DIR', '/tmp/arduino-events')
+# Segundos entre comentarios keepalive del stream SSE
+SSE_KEEPALIVE = float(os.environ.get('SSE_KEEPALIVE', '15'))
+# Reintento de reconexión sugerido al navegador (ms)
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', '3000'))
+
+# Métricas Prometheus (GET /metrics)
+# Carpeta compartida por los workers: cada proceso vuelca ahí sus métricas y
+# /metrics las suma. Vacía = solo las del proceso que atiende la petición.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# Segundos mínimos entre volcados de cada proceso
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+# Si se define, /metrics exige 'Authorization: Bearer <token>'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
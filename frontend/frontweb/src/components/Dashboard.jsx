@@ -17,7 +17,8 @@ function Dashboard() {
 
   const fetchDevices = async () => {
     try {
-      const response = await deviceAPI.getAll();
+      // Una sola petición para toda la flota (304 si nada cambió)
+      const response = await deviceAPI.getFleetStatus();
 
       console.log('Respuesta completa:', response);
       console.log('Datos recibidos:', response.data);
@@ -25,7 +26,10 @@ function Dashboard() {
       // ✅ ARREGLO: Maneja tanto arrays como objetos con propiedad 'results'
       let devicesData = [];
 
-      if (Array.isArray(response.data)) {
+      if (response.data && Array.isArray(response.data.devices)) {
+        // Respuesta de fleet_status: { devices: [...] }
+        devicesData = response.data.devices;
+      } else if (Array.isArray(response.data)) {
         // Si es un array directo
         devicesData = response.data;
       } else if (response.data && Array.isArray(response.data.results)) {
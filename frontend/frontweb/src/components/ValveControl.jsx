@@ -5,7 +5,7 @@ import './ValveControl.css';
 function ValveControl({ device, onStatusChange }) {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
-  const [valveStatus, setValveStatus] = useState('closed');
+  const [valveStatus, setValveStatus] = useState(device.current_valve_state === 'open' ? 'open' : 'closed');
 
   const handleToggle = async () => {
     if (loading || !device.is_online) return;
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import './WaterSensorDisplay.css';
-import { sensorAPI } from '../services/api';
+import { sensorAPI, streamAPI } from '../services/api';
 
 function WaterSensorDisplay({ device }) {
   const [sensorData, setSensorData] = useState(null);
@@ -9,10 +9,38 @@ function WaterSensorDisplay({ device }) {
   const [lastUpdate, setLastUpdate] = useState(null);
 
   useEffect(() => {
-    fetchSensorData();
-    // Actualizar cada 5 segundos
-    const interval = setInterval(fetchSensorData, 5000);
-    return () => clearInterval(interval);
+    if (device.reading_timestamp) {
+      // La última lectura ya viene en fleet_status
+      setSensorData({
+        flow_rate: device.flow_rate,
+        total_volume: device.total_volume,
+        timestamp: device.reading_timestamp,
+      });
+      setLastUpdate(new Date());
+      setLoading(false);
+    } else {
+      fetchSensorData();
+    }
+
+    // Si el stream SSE no está disponible, actualizar cada 5 segundos
+    let interval = null;
+    const startPolling = () => {
+      if (!interval) interval = setInterval(fetchSensorData, 5000);
+    };
+
+    // Recibir lecturas en vivo del stream de la flota sin consultar al backend
+    const unsubscribe = streamAPI.subscribe(device.id, (type, data) => {
+      if (type !== 'reading') return;
+      setSensorData(data);
+      setLastUpdate(new Date());
+      setError(null);
+      setLoading(false);
+    }, startPolling);
+
+    return () => {
+      unsubscribe();
+      clearInterval(interval);
+    };
   }, [device.id]);
 
 
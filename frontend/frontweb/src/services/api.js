@@ -24,6 +24,12 @@ export const deviceAPI = {
 
   // Obtener estado del dispositivo
   getStatus: (id) => api.get(`/devices/${id}/status/`),
+
+  // Estado de todos los dispositivos (válvula, conexión y última lectura) en una petición
+  getFleetStatus: () => api.get('/devices/fleet_status/'),
+
+  // Sesiones de válvula abierta con su duración (s) y consumo (L)
+  getSessions: (id) => api.get(`/devices/${id}/sessions/`),
 };
 
 export const valveControlAPI = {
@@ -43,8 +49,59 @@ export const sensorAPI = {
     params: { device_id: deviceId, start_date: startDate, end_date: endDate }
   }),
 
+  // Serie reducida para gráficas (timestamps en ms Unix); method: 'lttb' o 'minmax'
+  getSeries: (deviceId, startDate, endDate, points = 500, method = 'lttb') => api.get('/sensor-readings/series/', {
+    params: { device_id: deviceId, start_date: startDate, end_date: endDate, points, method }
+  }),
+
   // Obtener todos los registros
   getAll: () => api.get('/sensor-readings/'),
 };
 
+// Un solo stream SSE para toda la flota, compartido por todas las tarjetas
+const STREAM_EVENTS = ['reading', 'valve_state', 'alert', 'command'];
+const streamSubscribers = new Set();
+let fleetSource = null;
+
+const openFleetStream = () => {
+  const source = new EventSource(`${API_BASE_URL}/stream/`);
+  STREAM_EVENTS.forEach((type) => {
+    source.addEventListener(type, (event) => {
+      const message = JSON.parse(event.data);
+      streamSubscribers.forEach((subscriber) => {
+        if (subscriber.deviceId === message.device) subscriber.onEvent(type, message.data);
+      });
+    });
+  });
+  source.onerror = () => {
+    // El navegador reintenta solo; si cierra la conexión (p. ej. backend WSGI), volver al polling
+    if (source.readyState === EventSource.CLOSED) {
+      streamSubscribers.forEach((subscriber) => subscriber.onClosed());
+    }
+  };
+  return source;
+};
+
+export const streamAPI = {
+  // Eventos en vivo de un dispositivo: onEvent(tipo, datos); onClosed() si no hay stream. Devuelve la baja
+  subscribe: (deviceId, onEvent, onClosed) => {
+    if (typeof EventSource === 'undefined') {
+      onClosed();
+      return () => {};
+    }
+    if (!fleetSource) fleetSource = openFleetStream();
+    const subscriber = { deviceId, onEvent, onClosed };
+    streamSubscribers.add(subscriber);
+    if (fleetSource.readyState === EventSource.CLOSED) onClosed();
+
+    return () => {
+      streamSubscribers.delete(subscriber);
+      if (streamSubscribers.size === 0 && fleetSource) {
+        fleetSource.close();
+        fleetSource = null;
+      }
+    };
+  },
+};
+
 export default api;
\ No newline at end of file